@@ -0,0 +1,60 @@
+"""
+Measures how fast compiled stacks evaluate batches of samples
+
+Compiles every stack in the file and runs it over random samples for each of its
+stubbed outputs. Run from the repository root:
+
+    python benchmarks/bench_evaluate.py [stack file] [--samples N] [--repeat N]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from soundedit import evaluator, keyvalues
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file', nargs='?', default='tests/sound_operator_stacks.txt')
+    parser.add_argument('--samples', type=int, default=100000, help='Samples per batch')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per stack, the best is reported')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as fp:
+        data = keyvalues.load(fp)
+    rng = np.random.default_rng(0)
+
+    total = 0.0
+    for section, stacks in keyvalues.pairs(data):
+        if isinstance(stacks, str):
+            continue
+        for name, stack in keyvalues.pairs(stacks):
+            if isinstance(stack, str):
+                continue
+            t = time.perf_counter()
+            try:
+                program = evaluator.compile_stack(stack, stacks)
+            except evaluator.EvaluationError as e:
+                print(f'{section}/{name}: {e}')
+                continue
+            compile_ms = (time.perf_counter() - t) * 1000
+
+            # Vector outputs get random values in every element too, broadcasting handles the rest
+            samples = {key: rng.uniform(0, 100, args.samples) for key in program.stubs()}
+            best = min(_time(program, samples) for _ in range(args.repeat))
+            total += best
+            print(f'{section}/{name}: {len(program.steps)} nodes, compiled in {compile_ms:.2f}ms, '
+                  f'{args.samples} samples in {best * 1000:.2f}ms')
+    print(f'total {total * 1000:.1f}ms')
+
+
+def _time(program: evaluator.Program, samples: dict) -> float:
+    t = time.perf_counter()
+    program.run(samples)
+    return time.perf_counter() - t
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures how fast SoundOperatorGraph.from_dict materialises operator stacks
+
+Reports nodes per second for every stack in the test file, and for a synthetic
+stack of math_float operators. Run from the repository root:
+
+    python benchmarks/bench_from_dict.py [stack file] [--nodes N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide6.QtWidgets import QApplication
+from vdf import VDFDict
+
+from soundedit import keyvalues
+from soundedit.graph import SoundOperatorGraph
+
+
+def synthetic_stack(count: int, width: int = 100) -> VDFDict:
+    """
+    Build a layered stack of math_float operators. Every operator after the first
+    layer reads from one in the previous layer, the second input is a constant
+    """
+    stack = VDFDict()
+    for i in range(count):
+        layer, col = divmod(i, width)
+        op = VDFDict()
+        op['operator'] = 'math_float'
+        op['apply'] = 'add'
+        if layer:
+            op['input1'] = f'@op_{layer - 1}_{(col * 7) % width}.output'
+        else:
+            op['input1'] = str(col)
+        op['input2'] = '1.0'
+        stack[f'op_{layer}_{col}'] = op
+    return stack
+
+
+def build(stack: VDFDict, stacks: VDFDict) -> tuple[int, float]:
+    """Returns (node count, seconds) for a single from_dict call"""
+    graph = SoundOperatorGraph(None)
+    t = time.perf_counter()
+    graph.from_dict(stack, stacks)
+    return len(graph.nodes), time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('file', nargs='?', default=os.path.join(os.path.dirname(__file__), '..', 'tests', 'sound_operator_stacks.txt'))
+    parser.add_argument('--nodes', type=int, default=5000, help='Size of the synthetic stack')
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+
+    with open(args.file, 'rb') as fp:
+        data = keyvalues.load(fp)
+
+    total_nodes = 0
+    total_time = 0.0
+    failed = 0
+    for section in ('start_stacks', 'update_stacks'):
+        stacks = data[section]
+        for name in stacks:
+            try:
+                n, dt = build(stacks[name], stacks)
+            except Exception:
+                failed += 1
+                continue
+            total_nodes += n
+            total_time += dt
+    print(f'{os.path.basename(args.file)}: {total_nodes} nodes in {total_time:.3f}s, '
+          f'{total_nodes / max(total_time, 1e-9):.0f} nodes/s ({failed} stacks failed)')
+
+    n, dt = build(synthetic_stack(args.nodes), VDFDict())
+    print(f'synthetic: {n} nodes in {dt:.3f}s, {n / dt:.0f} nodes/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Measures layered auto-layout speed and crossing reduction
+
+Lays out every stack of a file (imports merged, all nodes the same size), then a
+synthetic stack of random connections, reporting the time taken and the crossings
+between adjacent columns before and after reordering. Run from the repository root:
+
+    python benchmarks/bench_layout.py [stack file] [--nodes N]
+"""
+
+import argparse
+import random
+import time
+
+from soundedit import keyvalues, layout
+from soundedit.imports import ImportResolver
+
+SIZE = (200.0, 120.0)
+
+
+def references(nodes: dict) -> list[tuple[str, str]]:
+    return [
+        (value[1:].partition('.')[0], node)
+        for node, block in nodes.items() for value in block.values() if value.startswith('@')
+    ]
+
+
+def measure(nodes: list[str], edges: list[tuple[str, str]]) -> tuple[float, int, int]:
+    """Returns (seconds, crossings without reordering, crossings after)"""
+    sizes = dict.fromkeys(nodes, SIZE)
+    before = layout.layered(nodes, edges, sizes, sweeps=0)
+    t = time.perf_counter()
+    after = layout.layered(nodes, edges, sizes)
+    elapsed = time.perf_counter() - t
+    return elapsed, crossings(before, edges), crossings(after, edges)
+
+
+def crossings(positions: dict, edges: list[tuple[str, str]]) -> int:
+    """Count crossings between connections of adjacent columns from the laid out positions"""
+    xs = sorted({x for x, _ in positions.values()})
+    column = {x: i for i, x in enumerate(xs)}
+    spans: dict[int, list[tuple[float, float]]] = {}
+    for src, dst in set(edges):
+        if src not in positions or dst not in positions:
+            continue
+        (x0, y0), (x1, y1) = positions[src], positions[dst]
+        if column[x1] == column[x0] + 1:
+            spans.setdefault(column[x0], []).append((y0, y1))
+    return sum(
+        1 for pairs in spans.values() for i, (a0, a1) in enumerate(pairs) for b0, b1 in pairs[i + 1:]
+        if (a0 - b0) * (a1 - b1) < 0
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file', nargs='?', default='tests/sound_operator_stacks.txt')
+    parser.add_argument('--nodes', type=int, default=5000, help='Size of the synthetic stack')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as fp:
+        data = keyvalues.load(fp)
+    total = [0, 0.0, 0, 0]
+    for section, stacks in keyvalues.pairs(data):
+        if isinstance(stacks, str):
+            continue
+        imports = ImportResolver(stacks, section)
+        for name in stacks:
+            nodes = imports.merged(name)
+            elapsed, before, after = measure(list(nodes), references(nodes))
+            total[0] += len(nodes)
+            total[1] += elapsed
+            total[2] += before
+            total[3] += after
+    print(f'file: {total[0]} nodes in {total[1]:.3f}s, crossings {total[2]} -> {total[3]}')
+
+    rng = random.Random(1)
+    nodes = [f'op_{i}' for i in range(args.nodes)]
+    # Each node reads from two nodes among the previous 50, like a long chain of math operators
+    edges = [(nodes[rng.randrange(max(0, i - 50), i)], nodes[i]) for i in range(1, args.nodes) for _ in range(2)]
+    elapsed, before, after = measure(nodes, edges)
+    print(f'synthetic: {args.nodes} nodes in {elapsed:.3f}s, {args.nodes / elapsed:.0f} nodes/s, '
+          f'crossings {before} -> {after}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Measures editor memory use while opening and closing tabs
+
+Opens the first N stacks of a file in the editor, one tab each, then closes every tab,
+reporting the resident set size after each step. --unlimited disables the tab cache
+limits for comparison. Needs a display, or QT_QPA_PLATFORM=offscreen. Run from the
+repository root:
+
+    python benchmarks/bench_tabs.py [stack file] [--stacks N] [--unlimited]
+"""
+
+import argparse
+import gc
+import os
+import shutil
+import sys
+import tempfile
+
+from PySide6.QtCore import QCoreApplication, QEvent
+from PySide6.QtWidgets import QApplication
+
+from soundedit.soundedit import SoundEdit
+from soundedit.types import STACK_TYPES
+
+
+def rss() -> float:
+    """Resident set size in MB, Linux only"""
+    with open('/proc/self/status') as fp:
+        for line in fp:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def settle(app: QApplication) -> None:
+    """Run deferred deletes and collect garbage, so freed graphs are released"""
+    for _ in range(3):
+        QCoreApplication.sendPostedEvents(None, QEvent.Type.DeferredDelete)
+        app.processEvents()
+        gc.collect()
+
+
+def run(app: QApplication, file: str, count: int, limits: tuple[int, int] | None) -> None:
+    w = SoundEdit()
+    if limits is not None:
+        w.maxGraphs, w.maxNodes = limits
+    # Work on a copy, the layout cache is written next to the file
+    tmp = tempfile.mkdtemp()
+    file = shutil.copy(file, tmp)
+    w.load_operator_stack(file)
+    w.file = file
+    stacks = [(STACK_TYPES[s], name) for s in ('start_stacks', 'update_stacks') for name in w.data[s]]
+
+    settle(app)
+    before = rss()
+    opened_count = failed = 0
+    for type, name in stacks:
+        if opened_count == count:
+            break
+        try:
+            w.open_tab(type, name)
+        except Exception:
+            # i.e. imports a missing stack
+            failed += 1
+            continue
+        opened_count += 1
+        w.tabs.setCurrentWidget(w.openTabs[name][1])
+        # As the event loop would between user actions
+        settle(app)
+    opened = rss()
+    stats = w.cache_stats()
+    while w.openTabs:
+        w._close_tab(w.tabs.indexOf(next(iter(w.openTabs.values()))[1]))
+    settle(app)
+    closed = rss()
+
+    label = 'no limits' if limits is not None else f'limits {w.maxGraphs} graphs/{w.maxNodes} nodes'
+    print(f'{label}: {before:.0f} MB before, {opened:.0f} MB with {opened_count} tabs open '
+          f'({stats["loaded"]} graphs, {stats["nodes"]} nodes loaded), {closed:.0f} MB after closing them'
+          + (f', {failed} stacks failed to open' if failed else ''))
+    w.data.close()
+    shutil.rmtree(tmp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file', nargs='?', default='tests/sound_operator_stacks.txt')
+    parser.add_argument('--stacks', type=int, default=50, help='Number of stacks to open')
+    parser.add_argument('--unlimited', action='store_true', help='Keep every graph loaded while its tab is open')
+    args = parser.parse_args()
+
+    app = QApplication(sys.argv)
+    run(app, os.path.abspath(args.file), args.stacks, (1 << 30, 1 << 30) if args.unlimited else None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Measures whole-file validation speed
+
+Builds a corpus by repeating the stacks of a file under new names (imports are
+renamed along with them) until it holds at least the requested number of nodes,
+then times validator.validate over it. Run from the repository root:
+
+    python benchmarks/bench_validate.py [stack file] [--nodes N]
+"""
+
+import argparse
+import time
+
+from typing import Mapping
+from vdf import VDFDict
+
+from soundedit import keyvalues, validator
+
+
+def repeat_stacks(data: Mapping, copies: int) -> VDFDict:
+    """Copy every stack in data copies times, prefixing the names with x<copy>_"""
+    out = VDFDict()
+    for section, stacks in keyvalues.pairs(data):
+        if isinstance(stacks, str):
+            continue
+        block = out[section] = VDFDict()
+        for i in range(copies):
+            for name, stack in keyvalues.pairs(stacks):
+                if isinstance(stack, str):
+                    continue
+                copy = VDFDict()
+                for k, v in keyvalues.pairs(stack):
+                    copy[k] = f'x{i}_{v}' if k == 'import_stack' else v
+                block[f'x{i}_{name}'] = copy
+    return out
+
+
+def count_nodes(data: Mapping) -> int:
+    return sum(
+        1 for _, stacks in keyvalues.pairs(data) if not isinstance(stacks, str)
+        for _, stack in keyvalues.pairs(stacks) if not isinstance(stack, str)
+        for _, node in keyvalues.pairs(stack) if not isinstance(node, str)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file', nargs='?', default='tests/sound_operator_stacks.txt')
+    parser.add_argument('--nodes', type=int, default=100000, help='Minimum number of nodes to validate')
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as fp:
+        data = keyvalues.load(fp)
+    per_copy = count_nodes(data)
+    corpus = repeat_stacks(data, -(-args.nodes // max(per_copy, 1)))
+    nodes = count_nodes(corpus)
+
+    t = time.perf_counter()
+    problems = validator.validate(corpus)
+    elapsed = time.perf_counter() - t
+    print(f'{nodes} nodes in {elapsed:.3f}s, {nodes / elapsed:.0f} nodes/s, {len(problems)} problems')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,15 @@
-from PySide6.QtWidgets import QApplication
-from PySide6.QtCore import QSettings
 import sys
-from .soundedit import SoundEdit
 
 def main():
+	# Headless subcommands (validate, stats, ...) must not import Qt
+	from .cli import COMMANDS, main as cli_main
+	if len(sys.argv) > 1 and sys.argv[1] in COMMANDS + ('-h', '--help'):
+		sys.exit(cli_main())
+
+	from PySide6.QtWidgets import QApplication
+	from PySide6.QtCore import QSettings
+	from .soundedit import SoundEdit
+
 	app = QApplication(sys.argv)
 
 	QApplication.setOrganizationName('Strata Source')
@@ -20,3 +26,6 @@ def main():
 	window.show()
 	
 	app.exec_()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,92 @@
+"""
+Change tracking for operator stacks
+
+A ChangeSet records which nodes, and which of their keys, have been modified in a
+single stack since it was loaded or last saved. This module does not depend on Qt.
+"""
+
+from typing import Dict, Iterable
+
+
+class ChangeSet:
+    """
+    The changes made to a single operator stack
+
+    Nodes are tracked by name. A node which is added and then removed again (or the
+    reverse) is dropped from the set, keys are property or input names.
+    """
+
+    def __init__(self, section: str = '', stack: str = ''):
+        self.section = section
+        self.stack = stack
+        # Node name -> names of the changed keys
+        self.modified: Dict[str, set[str]] = {}
+        self.added: set[str] = set()
+        self.removed: set[str] = set()
+
+    def change(self, node: str, key: str) -> None:
+        """Record a change to a key (keyvalue, input constant or connection) of a node"""
+        if node not in self.added:
+            self.modified.setdefault(node, set()).add(key)
+
+    def add(self, node: str) -> None:
+        """Record a new node"""
+        if node in self.removed:
+            # Replaced, so it's a modification of the original node
+            self.removed.discard(node)
+            self.modified.setdefault(node, set())
+        else:
+            self.added.add(node)
+
+    def remove(self, node: str) -> None:
+        """Record a removed node"""
+        self.modified.pop(node, None)
+        if node in self.added:
+            self.added.discard(node)
+        else:
+            self.removed.add(node)
+
+    def rename(self, old: str, new: str) -> None:
+        """Record a node being renamed"""
+        keys = self.modified.get(old, set())
+        added = old in self.added
+        self.remove(old)
+        self.add(new)
+        if not added:
+            self.modified.setdefault(new, set()).update(keys)
+
+    def nodes(self) -> set[str]:
+        """Returns the names of all added, removed or modified nodes"""
+        return self.added | self.removed | self.modified.keys()
+
+    def keys(self, node: str) -> set[str]:
+        """Returns the changed keys of a node. Empty for added or removed nodes"""
+        return self.modified.get(node, set())
+
+    def clear(self) -> None:
+        self.modified.clear()
+        self.added.clear()
+        self.removed.clear()
+
+    def __bool__(self) -> bool:
+        return bool(self.modified or self.added or self.removed)
+
+    def __repr__(self) -> str:
+        return (f'ChangeSet({self.section}/{self.stack}: added={sorted(self.added)}, '
+                f'removed={sorted(self.removed)}, modified={ {k: sorted(v) for k, v in self.modified.items()} })')
+
+
+def changed_stacks(changes: Iterable[ChangeSet]) -> Dict[str, list[str]]:
+    """
+    Group the names of the modified stacks by section
+
+    Returns
+    -------
+    Dict[str, list[str]] :
+        Section name -> names of the stacks with changes
+    """
+    out: Dict[str, list[str]] = {}
+    for c in changes:
+        if c:
+            out.setdefault(c.section, []).append(c.stack)
+    return out
@@ -0,0 +1,351 @@
+"""
+Headless command line tools for operator stack files
+
+    soundedit validate FILE|DIR...
+    soundedit stats FILE|DIR...
+    soundedit convert FILE|DIR... (-o DIR | --in-place | --check)
+    soundedit optimise FILE|DIR... [-o DIR] [--check]
+
+Files are processed in parallel with a process pool, results can be printed as JSON
+with --format json. This module must not import Qt, so it can run on build machines.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping
+from vdf import VDFDict
+
+from . import keyvalues, manifest, optimiser, validator
+
+
+# File names picked up when searching directories, same as the open dialog
+STACK_FILE_NAMES = ('sound_operator_stacks.txt',)
+STACK_FILE_EXTENSIONS = ('.sndstack',)
+
+Result = Dict[str, Any]
+
+
+def find_stack_files(paths: Iterable[str]) -> list[str]:
+    """
+    Expand directories into the stack files found within them (recursively).
+    Files given explicitly are always included
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name in STACK_FILE_NAMES or name.endswith(STACK_FILE_EXTENSIONS):
+                    files.append(os.path.join(root, name))
+    return files
+
+
+def _load(file: str) -> tuple[bytes, VDFDict]:
+    with open(file, 'rb') as fp:
+        data = fp.read()
+    return data, keyvalues.parse(data, filename=file)
+
+
+def _stacks(data: Mapping) -> Iterator[tuple[str, str, Mapping]]:
+    """Yields (section, stack name, stack) for every stack in a file"""
+    for section, stacks in keyvalues.pairs(data):
+        if not isinstance(stacks, Mapping):
+            continue
+        for name, stack in keyvalues.pairs(stacks):
+            if isinstance(stack, Mapping):
+                yield section, name, stack
+
+
+def validate_file(file: str) -> Result:
+    """Check a stack file against the manifest, see validator.Validator"""
+    problems = validator.validate_file(file)
+    return {'file': file, 'problems': [p._asdict() for p in problems]}
+
+
+def stats_file(file: str) -> Result:
+    """Count the stacks, nodes and operators in a stack file"""
+    t = time.perf_counter()
+    raw, data = _load(file)
+    parse_ms = (time.perf_counter() - t) * 1000
+
+    sections: Dict[str, int] = {}
+    operators: Dict[str, int] = {}
+    nodes = imports = 0
+    for section, name, stack in _stacks(data):
+        sections[section] = sections.get(section, 0) + 1
+        for key, value in keyvalues.pairs(stack):
+            if key == 'import_stack':
+                imports += 1
+            elif isinstance(value, Mapping):
+                nodes += 1
+                op = value.get('operator', '')
+                operators[op] = operators.get(op, 0) + 1
+    return {
+        'file': file,
+        'bytes': len(raw),
+        'sections': sections,
+        'stacks': sum(sections.values()),
+        'nodes': nodes,
+        'imports': imports,
+        'operators': operators,
+        'parse_ms': round(parse_ms, 3),
+    }
+
+
+def convert_file(file: str, output: str | None = None, check: bool = False) -> Result:
+    """
+    Rewrite a stack file in the normalised layout written by keyvalues.dumps.
+    Comments are dropped and duplicate stacks are merged
+
+    Parameters
+    ----------
+    file : str
+        File to convert
+    output : str | None
+        Path to write to, the file itself if None
+    check : bool
+        Only report whether the file would change
+    """
+    raw, data = _load(file)
+    text = keyvalues.dumps(data).encode('utf-8')
+    changed = text != raw
+    result = {'file': file, 'changed': changed, 'output': None}
+    if check or (not changed and output is None):
+        return result
+
+    output = output or file
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    tmp = f'{output}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fp:
+        fp.write(text)
+    os.replace(tmp, output)
+    result['output'] = output
+    return result
+
+
+def optimise_file(file: str, output: str | None = None) -> Result:
+    """
+    Report the operators of each stack which could be folded, merged or removed.
+    See optimiser.optimise
+
+    Parameters
+    ----------
+    file : str
+        File to analyse
+    output : str | None
+        Path to write the optimised file to, nothing is written if None
+    """
+    _, data = _load(file)
+    optimised, reports = optimiser.optimise(data)
+    result = {
+        'file': file,
+        'stacks': [r._asdict() for r in reports if r.savings() or r.error],
+        'nodes': sum(r.nodes for r in reports),
+        'remaining': sum(r.remaining for r in reports),
+        'output': None,
+    }
+    if output is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        tmp = f'{output}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fp:
+            keyvalues.dump(optimised, fp)
+        os.replace(tmp, output)
+        result['output'] = output
+    return result
+
+
+def _run_one(job: tuple[Callable[..., Result], str, Dict[str, Any]]) -> Result:
+    func, file, kwargs = job
+    try:
+        return func(file, **kwargs)
+    except Exception as e:
+        return {'file': file, 'error': f'{type(e).__name__}: {e}'}
+
+
+def run(func: Callable[..., Result], files: list[str], jobs: int | None = None,
+        game: str = 'strata', kwargs: Callable[[str], Dict[str, Any]] | None = None) -> list[Result]:
+    """
+    Run a per-file command over many files, in a process pool when there's more than one
+
+    Parameters
+    ----------
+    func : Callable[..., Result]
+        Module level function taking the file name, i.e. validate_file
+    files : list[str]
+        Files to process
+    jobs : int | None
+        Number of worker processes, defaults to the number of CPUs
+    game : str
+        Manifest to use, see manifest.GAMES
+    kwargs : Callable[[str], Dict[str, Any]] | None
+        Returns extra keyword arguments to pass to func for a file
+
+    Returns
+    -------
+    list[Result] :
+        One result per file, in the same order. Failures have an 'error' entry
+    """
+    batch = [(func, f, kwargs(f) if kwargs else {}) for f in files]
+    jobs = min(jobs or os.cpu_count() or 1, len(files))
+    if jobs <= 1:
+        manifest.set_current(game)
+        return [_run_one(job) for job in batch]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=manifest.set_current, initargs=(game,)) as pool:
+        return list(pool.map(_run_one, batch, chunksize=max(1, len(batch) // (jobs * 4))))
+
+
+def _print_validate(results: list[Result]) -> None:
+    for r in results:
+        if 'error' in r:
+            print(f'{r["file"]}: error: {r["error"]}')
+            continue
+        for p in r['problems']:
+            where = validator.Problem(**p).location()
+            line = f':{p["line"]}' if p['line'] else ''
+            print(f'{r["file"]}{line}: {p["severity"]}: {where + ": " if where else ""}{p["message"]}')
+
+
+def _print_stats(results: list[Result]) -> None:
+    for r in results:
+        if 'error' in r:
+            print(f'{r["file"]}: error: {r["error"]}')
+        else:
+            print(f'{r["file"]}: {r["stacks"]} stacks, {r["nodes"]} nodes, {r["imports"]} imports, '
+                  f'{r["bytes"]} bytes, parsed in {r["parse_ms"]:.1f}ms')
+
+
+def _print_convert(results: list[Result]) -> None:
+    for r in results:
+        if 'error' in r:
+            print(f'{r["file"]}: error: {r["error"]}')
+        elif r['changed']:
+            print(f'{r["file"]}: {"written to " + r["output"] if r["output"] else "would be reformatted"}')
+
+
+def _print_optimise(results: list[Result]) -> None:
+    for r in results:
+        if 'error' in r:
+            print(f'{r["file"]}: error: {r["error"]}')
+            continue
+        for s in r['stacks']:
+            where = f'{r["file"]}: {s["section"]}/{s["stack"]}'
+            if s['error']:
+                print(f'{where}: not folded: {s["error"]}')
+            print(f'{where}: {s["nodes"]} -> {s["remaining"]} nodes, {len(s["dead"])} dead, '
+                  f'{len(s["folded"])} constant, {len(s["redundant"])} redundant')
+        if r['output']:
+            print(f'{r["file"]}: written to {r["output"]}')
+
+
+def _summary(command: str, results: list[Result], elapsed: float) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {
+        'files': len(results),
+        'failed': sum(1 for r in results if 'error' in r),
+        'seconds': round(elapsed, 3),
+    }
+    if command == 'validate':
+        problems = [p for r in results for p in r.get('problems', [])]
+        summary['errors'] = sum(1 for p in problems if p['severity'] == 'error')
+        summary['warnings'] = sum(1 for p in problems if p['severity'] == 'warning')
+    elif command == 'stats':
+        operators: Dict[str, int] = {}
+        for r in results:
+            for op, n in r.get('operators', {}).items():
+                operators[op] = operators.get(op, 0) + n
+        summary['stacks'] = sum(r.get('stacks', 0) for r in results)
+        summary['nodes'] = sum(r.get('nodes', 0) for r in results)
+        summary['operators'] = dict(sorted(operators.items(), key=lambda x: -x[1]))
+    elif command == 'convert':
+        summary['changed'] = sum(1 for r in results if r.get('changed'))
+    elif command == 'optimise':
+        summary['nodes'] = sum(r.get('nodes', 0) for r in results)
+        summary['removable'] = summary['nodes'] - sum(r.get('remaining', 0) for r in results)
+    return summary
+
+
+def _exit_code(command: str, summary: Dict[str, Any], check: bool = False) -> int:
+    if summary['failed']:
+        return 1
+    if command == 'validate':
+        return 1 if summary['errors'] else 0
+    if command == 'convert' and check:
+        return 1 if summary['changed'] else 0
+    if command == 'optimise' and check:
+        return 1 if summary['removable'] else 0
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='soundedit', description='Sound operator stack tools')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('paths', nargs='+', metavar='PATH', help='Stack files, or directories to search for them')
+    common.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes (default: CPU count)')
+    common.add_argument('--format', choices=('text', 'json'), default='text', help='Output format')
+    common.add_argument('--game', choices=sorted(manifest.GAMES), default='strata', help='Operator manifest to use')
+
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('validate', parents=[common], help='Check stack files for errors')
+    sub.add_parser('stats', parents=[common], help='Count stacks, nodes and operators')
+    convert = sub.add_parser('convert', parents=[common], help='Rewrite stack files in the normalised layout')
+    out = convert.add_mutually_exclusive_group(required=True)
+    out.add_argument('-o', '--output', metavar='DIR', help='Write converted files to this directory')
+    out.add_argument('--in-place', action='store_true', help='Overwrite the files')
+    out.add_argument('--check', action='store_true', help="Don't write anything, fail if any file would change")
+    optimise = sub.add_parser('optimise', parents=[common], help='Find operators which can be folded or removed')
+    optimise.add_argument('-o', '--output', metavar='DIR', help='Write optimised files, with imports inlined, to this directory')
+    optimise.add_argument('--check', action='store_true', help='Fail if any operator can be removed')
+    return parser
+
+
+COMMANDS = ('validate', 'stats', 'convert', 'optimise')
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    files = find_stack_files(args.paths)
+
+    kwargs = None
+    if args.command == 'validate':
+        func, printer = validate_file, _print_validate
+    elif args.command == 'stats':
+        func, printer = stats_file, _print_stats
+    elif args.command == 'optimise':
+        func, printer = optimise_file, _print_optimise
+    else:
+        func, printer = convert_file, _print_convert
+        if args.check:
+            kwargs = lambda f: {'check': True}
+    if args.command in ('convert', 'optimise') and args.output and not args.check:
+        # Keep the layout below the common directory of the inputs
+        base = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files]) if files else ''
+        kwargs = lambda f: {'output': os.path.join(args.output, os.path.relpath(os.path.abspath(f), base))}
+
+    t = time.perf_counter()
+    results = run(func, files, args.jobs, args.game, kwargs)
+    summary = _summary(args.command, results, time.perf_counter() - t)
+
+    if args.format == 'json':
+        json.dump({'command': args.command, 'results': results, 'summary': summary}, sys.stdout, indent=1)
+        print()
+    else:
+        printer(results)
+        totals = ''
+        if args.command == 'validate':
+            totals = f', {summary["errors"]} errors, {summary["warnings"]} warnings'
+        elif args.command == 'optimise':
+            totals = f', {summary["removable"]} of {summary["nodes"]} nodes can be removed'
+        print(f'{summary["files"]} files in {summary["seconds"]:.2f}s{totals}')
+    return _exit_code(args.command, summary, getattr(args, 'check', False))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
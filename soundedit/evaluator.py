@@ -0,0 +1,565 @@
+"""
+Headless evaluation of operator stacks with NumPy
+
+A stack is compiled once into a Program, which then evaluates the math and calc
+operators over a whole batch of samples at once: every float is an array of shape
+(n,), a vec3 is (n, 3) and speakers are (n, SPEAKERS). Operators which read game
+state (get_convar, get_sys_time, get_source_info, ...) are stubs, their outputs are
+taken from the samples passed to Program.run. This module does not depend on Qt.
+
+    program = evaluator.compile_stack(stacks['update_default'], stacks)
+    result = program.run({'get_sys_time.output_client_time': np.linspace(0, 10, 100000)})
+    volume = result.values['volume_apply.output']
+"""
+
+import math
+
+from collections import deque
+from functools import lru_cache
+from typing import Callable, Dict, Mapping, NamedTuple
+
+import numpy as np
+
+from numpy.typing import ArrayLike
+
+from . import keyvalues, manifest
+from .imports import ImportResolver
+from .manifest import Manifest, OperatorDesc
+from .utils import str_bool
+
+
+# Number of channels in a speakers value
+SPEAKERS = 8
+
+# Element count of each port type, None for scalars
+_WIDTHS = {'float': None, 'vec3': 3, 'speakers': SPEAKERS}
+
+# Element types of ports which can be indexed, i.e. "input_angles[0]" or "input2[*]"
+_INDEXED = ('vec3', 'speakers')
+
+# Reference levels used by calc_falloff, the defaults of snd_refdb and snd_refdist
+_REF_DB = 60.0
+_REF_DIST = 36.0
+
+Value = np.ndarray | float
+
+
+class EvaluationError(Exception):
+    """Raised when a stack can't be compiled, i.e. a dangling reference or a cycle"""
+    pass
+
+
+class Evaluation(NamedTuple):
+    """Result of Program.run"""
+    # "node.output" -> values, one row per sample. For operators without outputs
+    # (sys_output, set_opvar_float, ...) their inputs are recorded as "node.input"
+    values: Dict[str, np.ndarray]
+    # Stubbed outputs which weren't in the samples, and were evaluated as zero
+    missing: list[str]
+
+
+# name -> fn(ctx, inputs, keyvalues) -> outputs
+_Operator = Callable[['_Context', Dict[str, Value], Mapping[str, str]], Dict[str, Value]]
+_OPERATORS: Dict[str, _Operator] = {}
+
+
+def _operator(*names: str):
+    def register(fn: _Operator) -> _Operator:
+        for name in names:
+            _OPERATORS[name] = fn
+        return fn
+    return register
+
+
+def supported_operators() -> set[str]:
+    """Names of the operators which are evaluated, all others are stubs fed from the samples"""
+    return set(_OPERATORS)
+
+
+class _Context:
+    """State shared by the operators during a single Program.run"""
+
+    def __init__(self, count: int, rng: np.random.Generator):
+        self.count = count
+        self.rng = rng
+
+
+def _flag(v: Value) -> np.ndarray:
+    return np.asarray(v, dtype=np.float64)
+
+
+def _apply(apply: str, a: Value, b: Value) -> Value:
+    """Binary operation shared by math_float, math_vec3, math_speakers and accumulators"""
+    match apply:
+        case 'set':
+            return a
+        case 'add':
+            return a + b
+        case 'sub':
+            return a - b
+        case 'mult':
+            return a * b
+        case 'div':
+            return np.divide(a, b)
+        case 'mod':
+            return np.fmod(a, b)
+        case 'max':
+            return np.maximum(a, b)
+        case 'min':
+            return np.minimum(a, b)
+        case 'invert':
+            return 1.0 - a
+        case 'invert_scale':
+            return 1.0 - (1.0 - a) * b
+        case 'greater_than':
+            return _flag(a > b)
+        case 'less_than':
+            return _flag(a < b)
+        case 'greater_than_or_equal':
+            return _flag(a >= b)
+        case 'less_than_or_equal':
+            return _flag(a <= b)
+        case 'equals':
+            return _flag(a == b)
+        case 'not_equal':
+            return _flag(a != b)
+        case 'pow':
+            return np.power(a, b)
+        case _:
+            # 'none' leaves the output untouched
+            return np.zeros_like(np.asarray(a, dtype=np.float64))
+
+
+@_operator('math_float', 'math_vec3', 'math_speakers')
+def _math(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    return {'output': _apply(kv.get('apply', 'none'), inputs['input1'], inputs['input2'])}
+
+
+@_operator('math_float_accumulate12')
+def _math_accumulate(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    apply = kv.get('apply', 'none')
+    out = inputs['input1']
+    for i in range(2, 13):
+        out = _apply(apply, out, inputs[f'input{i}'])
+    return {'output': out}
+
+
+def _ufunc(fn: Callable[[float], float]) -> Callable[[Value], np.ndarray]:
+    """Element-wise version of a math module function NumPy doesn't provide"""
+    vec = np.frompyfunc(fn, 1, 1)
+    return lambda x: vec(x).astype(np.float64)
+
+
+def _round(x: Value) -> Value:
+    # C round(), halfway cases away from zero
+    return np.copysign(np.floor(np.abs(x) + 0.5), x)
+
+
+_FUNC1: Dict[str, Callable[[Value], Value]] = {
+    'sin': np.sin, 'asin': np.arcsin, 'cos': np.cos, 'acos': np.arccos, 'tan': np.tan, 'atan': np.arctan,
+    'sinh': np.sinh, 'asinh': np.arcsinh, 'cosh': np.cosh, 'acosh': np.arccosh, 'tanh': np.tanh,
+    'atanh': np.arctanh, 'exp': np.exp, 'expm1': np.expm1, 'exp2': np.exp2, 'log': np.log, 'log2': np.log2,
+    'log1p': np.log1p, 'log10': np.log10, 'logb': lambda x: np.floor(np.log2(np.abs(x))), 'fabs': np.abs,
+    'sqrt': np.sqrt, 'erf': _ufunc(math.erf), 'erfc': _ufunc(math.erfc), 'gamma': _ufunc(math.gamma),
+    'lgamma': _ufunc(math.lgamma), 'ceil': np.ceil, 'floor': np.floor, 'rint': np.rint, 'nearbyint': np.rint,
+    'rintol': np.rint, 'round': _round, 'roundtol': _round, 'trunc': np.trunc,
+}
+
+
+@_operator('math_func1')
+def _math_func1(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    function = kv.get('function', 'none')
+    fn = _FUNC1.get(function)
+    if fn is None:
+        return {'output': 0.0}
+    out = fn(inputs['input1'])
+    if function in ('sin', 'cos') and str_bool(kv.get('normalize_trig', 'false')):
+        # Map -1..1 to 0..1
+        out = (out + 1.0) * 0.5
+    return {'output': out}
+
+
+@_operator('math_remap_float')
+def _math_remap_float(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    lo, hi = inputs['input_min'], inputs['input_max']
+    map_lo, map_hi = inputs['input_map_min'], inputs['input_map_max']
+    span = np.subtract(hi, lo)
+    t = np.divide(np.subtract(inputs['input'], lo), span)
+    if str_bool(kv.get('clamp_range', 'true')):
+        t = np.clip(t, 0.0, 1.0)
+    out = map_lo + t * np.subtract(map_hi, map_lo)
+    # An empty range can't be mapped
+    default = map_hi if str_bool(kv.get('default_to_max', 'true')) else map_lo
+    return {'output': np.where(span == 0, default, out)}
+
+
+@_operator('math_curve_2d_4knot')
+def _math_curve_2d_4knot(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    x = inputs['input']
+    knots = [(inputs[f'input_X{i}'], inputs[f'input_Y{i}']) for i in range(1, 5)]
+    out = np.broadcast_to(np.asarray(knots[0][1], dtype=np.float64), np.shape(x))
+    if kv.get('curve_type', 'step') == 'linear':
+        for (x0, y0), (x1, y1) in zip(knots, knots[1:]):
+            t = np.divide(np.subtract(x, x0), np.subtract(x1, x0))
+            out = np.where(x > x0, y0 + t * np.subtract(y1, y0), out)
+        out = np.where(x > knots[-1][0], knots[-1][1], out)
+    else:
+        for xk, yk in knots[1:]:
+            out = np.where(x >= xk, yk, out)
+    return {'output': out}
+
+
+@_operator('math_logic_switch')
+def _math_logic_switch(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    return {'output': np.where(np.asarray(inputs['input_switch']) > 0, inputs['input1'], inputs['input2'])}
+
+
+@_operator('math_random')
+def _math_random(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    out = ctx.rng.uniform(size=ctx.count)
+    out = inputs['input_min'] + out * np.subtract(inputs['input_max'], inputs['input_min'])
+    if str_bool(kv.get('round_to_int', 'false')):
+        out = _round(out)
+    return {'output': out}
+
+
+@_operator('math_delta')
+def _math_delta(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    # Samples are independent, so there's no previous frame to differ from
+    return {'output': 0.0}
+
+
+@_operator('math_float_filter')
+def _math_float_filter(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    # Without a previous frame the filter passes the input through
+    return {'output': inputs['input']}
+
+
+@_operator('calc_falloff')
+def _calc_falloff(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    level = np.asarray(inputs['input_level'], dtype=np.float64)
+    with np.errstate(divide='ignore', over='ignore'):
+        mult = np.where(level > 0, 10.0 ** ((_REF_DB - level) / 20.0) / _REF_DIST, 0.0)
+    relative = inputs['input_distance'] * mult
+    gain = np.where(relative > 0.1, np.divide(1.0, np.maximum(relative, 0.1)), 10.0)
+    return {'output': np.minimum(gain, 1.0)}
+
+
+@_operator('util_pos_vec8')
+def _util_pos_vec8(ctx: _Context, inputs: Dict[str, Value], kv: Mapping[str, str]) -> Dict[str, Value]:
+    count = np.asarray(inputs['input_entry_count'], dtype=np.float64)
+    index = np.clip(np.asarray(inputs['input_index']), 0, np.clip(count - 1, 0, 7)).astype(np.intp)
+    if index.ndim == 0:
+        position = inputs[f'input_position_{index}']
+    else:
+        # Select per sample without stacking all eight positions
+        position = inputs['input_position_0']
+        for i in range(1, 8):
+            position = np.where((index == i)[:, None], inputs[f'input_position_{i}'], position)
+    return {'output_position': position, 'output_max_index': count - 1}
+
+
+def _accessor_key(desc: OperatorDesc, kv: Mapping[str, str], output: str) -> str:
+    """Sample name a stubbed output is read from, when there isn't one for the node itself"""
+    match desc.name:
+        case 'get_convar':
+            return f'convar:{kv.get("convar", "")}'
+        case 'get_opvar_float' if output == 'output':
+            return f'opvar:{kv.get("opvar", "")}'
+        case 'get_dashboard':
+            return f'dashboard:{kv.get("ds_type", "music")}'
+    return f'{desc.name}.{output}'
+
+
+def _parse_vector(text: str, width: int) -> np.ndarray:
+    """A vec3 or speakers constant, a single number fills every element"""
+    parts = text.split()
+    try:
+        values = [float(x) for x in parts] or [0.0]
+    except ValueError:
+        raise EvaluationError(f'"{text}" is not a number')
+    if len(values) == 1:
+        return np.full(width, values[0])
+    if len(values) != width:
+        raise EvaluationError(f'"{text}" has {len(values)} elements, expected {width}')
+    return np.array(values)
+
+
+@lru_cache(maxsize=1024)
+def _parse_constant(text: str, type: str) -> Value:
+    # Cached, stacks repeat the same few constants. Results are never modified in place
+    width = _WIDTHS.get(type)
+    if width is not None:
+        return _parse_vector(text, width)
+    try:
+        return float(text)
+    except ValueError:
+        raise EvaluationError(f'"{text}" is not a number')
+
+
+def _vector(value: Value, width: int | None) -> Value:
+    """Shape a value for a port with width elements. A float per sample applies to every element"""
+    if width is None:
+        return value
+    value = np.asarray(value, dtype=np.float64)
+    if value.ndim == 1 and value.shape[0] != width:
+        value = value[:, None]
+    return value
+
+
+class _Input(NamedTuple):
+    type: str
+    # Constant value, or (node, output) of a connection
+    source: Value | tuple[str, str]
+    # Element assignments from indexed keys: (column or None for all, source)
+    elements: list[tuple[int | None, Value | tuple[str, str]]]
+
+
+class _Step(NamedTuple):
+    node: str
+    desc: OperatorDesc
+    fn: _Operator | None
+    inputs: Dict[str, _Input]
+    keyvalues: Dict[str, str]
+
+
+class Program:
+    """
+    A compiled operator stack, see compile_stack
+
+    Parameters
+    ----------
+    steps : list[_Step]
+        Nodes in evaluation order
+    """
+
+    def __init__(self, steps: list[_Step]):
+        self.steps = steps
+
+    def stubs(self) -> list[str]:
+        """Names of the stubbed outputs, as "node.output", which can be fed through samples"""
+        return [f'{s.node}.{o.name}' for s in self.steps if s.fn is None for o in s.desc.outputs]
+
+    def constant_nodes(self, exclude: set[str] = frozenset()) -> list[str]:
+        """
+        Nodes whose outputs only depend on constants, in evaluation order. Stubs and
+        operators named in exclude are never constant, nor is anything reading from them
+        """
+        constant: set[str] = set()
+        out = []
+        for step in self.steps:
+            if step.fn is None or step.desc.name in exclude:
+                continue
+            sources = [s for inp in step.inputs.values() for s in (inp.source, *(e[1] for e in inp.elements))]
+            if all(not isinstance(s, tuple) or s[0] in constant for s in sources):
+                constant.add(step.node)
+                out.append(step.node)
+        return out
+
+    def run(self, samples: Mapping[str, ArrayLike] | None = None,
+            count: int | None = None, seed: int | None = None) -> Evaluation:
+        """
+        Evaluate the stack over a batch of samples
+
+        Parameters
+        ----------
+        samples : Mapping[str, ArrayLike] | None
+            Values of the stubbed operators, either per node ("source_info.output_position") or
+            per accessor: "convar:<name>", "opvar:<name>", "dashboard:<type>" or
+            "<operator>.<output>" (i.e. "get_sys_time.output_client_time"). Each is a scalar,
+            or an array with one row per sample
+        count : int | None
+            Number of samples, defaults to the length of the longest sample array
+        seed : int | None
+            Seed for math_random
+        """
+        samples = {k: np.asarray(v, dtype=np.float64) for k, v in (samples or {}).items()}
+        if count is None:
+            count = max((len(v) for v in samples.values() if v.ndim), default=1)
+        ctx = _Context(count, np.random.default_rng(seed))
+
+        values: Dict[str, Dict[str, Value]] = {}
+        missing: list[str] = []
+
+        def resolve(source: Value | tuple[str, str]) -> Value:
+            if isinstance(source, tuple):
+                return values[source[0]][source[1]]
+            return source
+
+        def stub(step: _Step) -> Dict[str, Value]:
+            out = {}
+            for port in step.desc.outputs:
+                key = f'{step.node}.{port.name}'
+                value = samples.get(key)
+                if value is None:
+                    value = samples.get(_accessor_key(step.desc, step.keyvalues, port.name))
+                if value is None:
+                    missing.append(key)
+                    value = np.zeros(_WIDTHS.get(port.type) or ())
+                out[port.name] = _vector(value, _WIDTHS.get(port.type))
+            return out
+
+        # Iterated nodes read from their iterate operator before it runs
+        for step in self.steps:
+            if 'iterate_operator' in step.desc.keyvalue_map:
+                values[step.node] = stub(step)
+
+        with np.errstate(all='ignore'):
+            for step in self.steps:
+                inputs = {name: self._input(ctx, inp, resolve) for name, inp in step.inputs.items()}
+                if step.fn is not None:
+                    out = step.fn(ctx, inputs, step.keyvalues)
+                else:
+                    out = values[step.node] if step.node in values else stub(step)
+
+                execute = inputs.get('input_execute', 1.0)
+                if step.desc.outputs and not (np.ndim(execute) == 0 and execute > 0):
+                    # Operators which don't execute leave their outputs at zero
+                    on = np.asarray(execute) > 0
+                    for port in step.desc.outputs:
+                        if port.name in out:
+                            mask = on if _WIDTHS.get(port.type) is None else on[..., None]
+                            out[port.name] = np.where(mask, out[port.name], 0.0)
+                values[step.node] = out if step.desc.outputs else inputs
+
+        result = {}
+        for step in self.steps:
+            ports = step.desc.outputs or step.desc.inputs
+            for port in ports:
+                if port.name in values[step.node]:
+                    width = _WIDTHS.get(port.type)
+                    shape = (count,) if width is None else (count, width)
+                    value = np.asarray(values[step.node][port.name], dtype=np.float64)
+                    result[f'{step.node}.{port.name}'] = np.broadcast_to(value, shape)
+        return Evaluation(result, missing)
+
+    @staticmethod
+    def _input(ctx: _Context, inp: _Input, resolve: Callable) -> Value:
+        value = resolve(inp.source)
+        width = _WIDTHS.get(inp.type)
+        if width is None:
+            return value
+        value = _vector(value, width)
+        if inp.elements:
+            value = np.array(np.broadcast_to(value, (ctx.count, width)))
+            for column, source in inp.elements:
+                element = resolve(source)
+                if column is None:
+                    value[:] = np.asarray(element)[..., None] if np.ndim(element) else element
+                elif column < width:
+                    value[:, column] = element
+        return value
+
+
+def compile_stack(stack: Mapping, stacks: Mapping | ImportResolver | None = None,
+                  m: Manifest | None = None) -> Program:
+    """
+    Compile an operator stack for evaluation
+
+    Parameters
+    ----------
+    stack : Mapping
+        The stack, as passed to SoundOperatorGraph.from_dict
+    stacks : Mapping | ImportResolver | None
+        All stacks of the section, used to resolve import_stack. Pass the section's
+        resolver when compiling many stacks, to share the merged imports
+    m : Manifest | None
+        The manifest, defaults to the current one
+
+    Raises
+    ------
+    EvaluationError
+        For unknown operators, references to missing nodes or outputs, and cycles
+    """
+    resolver = stacks if isinstance(stacks, ImportResolver) else ImportResolver(stacks or {})
+    for key, imp in keyvalues.pairs(stack):
+        if key != 'import_stack':
+            continue
+        if imp not in resolver.stacks:
+            raise EvaluationError(f'imports unknown stack "{imp}"')
+        if resolver.is_broken(imp):
+            raise EvaluationError(f'"{imp}" imports an unknown stack')
+    return compile_nodes(resolver.merge(stack), m)
+
+
+def compile_nodes(nodes: Mapping[str, Mapping[str, str]], m: Manifest | None = None) -> Program:
+    """
+    Compile the nodes of a stack with its imports already merged, see compile_stack
+
+    Parameters
+    ----------
+    nodes : Mapping[str, Mapping[str, str]]
+        Node name -> keyvalues
+    m : Manifest | None
+        The manifest, defaults to the current one
+    """
+    operators = (m or manifest.current()).node_types()
+    steps: Dict[str, _Step] = {}
+    deps: Dict[str, set[str]] = {}
+    iterators = {node for node, block in nodes.items() if 'iterate_operator' in block}
+    for node, block in nodes.items():
+        op = block.get('operator')
+        desc = operators.get(op)
+        if desc is None:
+            raise EvaluationError(f'{node}: unknown operator "{op}"')
+
+        def source(key: str, value: str, type: str) -> Value | tuple[str, str]:
+            if not value.startswith('@'):
+                try:
+                    return _parse_constant(value, type)
+                except EvaluationError as e:
+                    raise EvaluationError(f'{node}.{key}: {e}')
+            other, _, output = value[1:].partition('.')
+            target = operators.get(nodes[other].get('operator')) if other in nodes else None
+            if target is None or output not in target.output_map:
+                raise EvaluationError(f'{node}.{key}: no output "{value[1:]}"')
+            if other not in iterators:
+                deps[node].add(other)
+            return (other, output)
+
+        deps[node] = set()
+        inputs = {
+            p.name: _Input(p.type, _parse_constant(p.default or '0', p.type), [])
+            for p in desc.inputs
+        }
+        kv = {k.name: k.default for k in desc.keyvalues if k.default is not None}
+        for key, value in block.items():
+            name, _, index = key.partition('[')
+            port = desc.input_map.get(name)
+            if port is None:
+                if key in desc.keyvalue_map:
+                    kv[key] = value
+                continue
+            if not index:
+                inputs[name] = inputs[name]._replace(source=source(key, value, port.type))
+            elif port.type in _INDEXED:
+                index = index.rstrip(']')
+                column = None if index == '*' else int(index)
+                inputs[name].elements.append((column, source(key, value, 'float')))
+        steps[node] = _Step(node, desc, _OPERATORS.get(desc.name), inputs, kv)
+
+    # Kahn's algorithm, keeping the file order between independent nodes
+    order = []
+    pending = {node: len(d) for node, d in deps.items()}
+    users: Dict[str, list[str]] = {node: [] for node in deps}
+    for node, d in deps.items():
+        for other in d:
+            users[other].append(node)
+    queue = deque(node for node, n in pending.items() if n == 0)
+    while queue:
+        node = queue.popleft()
+        order.append(steps[node])
+        for user in users[node]:
+            pending[user] -= 1
+            if pending[user] == 0:
+                queue.append(user)
+    if len(order) != len(steps):
+        cycle = sorted(node for node, n in pending.items() if n)
+        raise EvaluationError(f'connections form a cycle through {", ".join(cycle)}')
+    return Program(order)
+
+
+def evaluate(stack: Mapping, stacks: Mapping | None = None,
+             samples: Mapping[str, ArrayLike] | None = None, **kwargs) -> Evaluation:
+    """Compile and run a stack in one go. See compile_stack and Program.run"""
+    return compile_stack(stack, stacks).run(samples, **kwargs)
@@ -4,7 +4,7 @@ from NodeGraphQt import (
 )
 from NodeGraphQt.widgets.node_graph import NodeGraphWidget
 from PySide6.QtWidgets import (
-    QTabWidget, QHBoxLayout, QMenu
+    QTabWidget, QHBoxLayout, QMenu, QGraphicsScene
 )
 from PySide6.QtCore import QObject
 from PySide6.QtGui import QCursor
@@ -12,49 +12,97 @@ from PySide6 import QtCore
 
 from vdf import VDFDict
 
-from . import manifest, nodes, types
+from . import manifest, nodes, types, layout
+from .changes import ChangeSet
+from .imports import ImportResolver
+from .model import OperatorStack
 from . nodes import (
     OperatorNode, FloatConstNode
 )
 
+from contextlib import contextmanager
 from typing import (
-    Tuple, TypedDict, Dict, Any
+    Tuple, TypedDict, Dict, Any, Callable, Iterable, Iterator, Mapping, NamedTuple, Sequence
 )
 
+# (source node, output, destination node, input)
+Link = Tuple[str, str, str, str]
+
+
+class GraphState(NamedTuple):
+    """The edited state of a closed graph, enough to rebuild it"""
+    model: OperatorStack
+    positions: Dict[str, Tuple[float, float]]
+    changes: ChangeSet
+    dirty: bool
+    layout_hash: str | None
+
+
+class _NodeGraph(NodeGraph):
+    """
+    NodeGraph that can skip the linear scan over every node in get_unique_name
+    while a SoundOperatorGraph is being built in bulk
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._names: set[str] | None = None
+
+    def begin_bulk(self) -> None:
+        self._names = {n.name() for n in self.all_nodes()}
+
+    def end_bulk(self) -> None:
+        self._names = None
+
+    def get_unique_name(self, name: str) -> str:
+        if self._names is None:
+            return super().get_unique_name(name)
+        name = ' '.join(name.split())
+        if name in self._names:
+            name = super().get_unique_name(name)
+        self._names.add(name)
+        return name
+
 
 class SoundOperatorGraph(QObject):
     """
     Main graph for the sound editor
-    Registers all required node types and manages the editor
+    Registers all required node types and manages the editor. The graph is a view of an
+    OperatorStack: edits made in the graph, including undo and redo, are applied to the
+    model, and the stack is serialised from it
     """
 
-    def __init__(self, parent):
+    def __init__(self, parent, section: str = '', name: str = ''):
         super().__init__()
         self.nodes: Dict[str, OperatorNode] = {}
-        self.graph = NodeGraph(self)
+        self.model = OperatorStack(section, name)
+        self.graph = _NodeGraph(self)
         # Register all node types
-        for type in manifest.node_types().keys():
-            self.graph.register_node(
-                OperatorNode(type).__class__
-            )
-
-        self.graph.register_node(
-            FloatConstNode
-        )
+        nodes.register_operator_nodes(self.graph)
 
+        # What has changed in the stack since it was loaded or saved
+        self.changes = ChangeSet(section, name)
+        # Structure hash of the stack as loaded or last saved, keys its cached layout
+        self.layout_hash: str | None = None
         self._dirty = False
+        self._bulk = 0
+        self._notify_pending = False
+        self._closed = False
 
         # Configure our context menus. These are static for some reason
         self._build_graph_context_menu()
         self._build_node_context_menu()
 
-        self.graph.property_changed.connect(lambda: self.mark_dirty())
-        self.graph.node_created.connect(lambda: self.mark_dirty())
-        self.graph.nodes_deleted.connect(lambda: self.mark_dirty())
-        self.graph.port_connected.connect(lambda: self.mark_dirty())
-        self.graph.port_disconnected.connect(lambda: self.mark_dirty())
+        self.graph.property_changed.connect(self._on_property_changed)
+        self.graph.node_created.connect(self._on_node_created)
+        self.graph.nodes_deleted.connect(self._on_nodes_deleted)
+        self.graph.port_connected.connect(self._on_port_connected)
+        self.graph.port_disconnected.connect(self._on_port_disconnected)
 
-    """Signaled when the dirty flag has been changed"""
+    """
+    Signaled when the graph has been changed, or the dirty flag has been set or cleared.
+    Bursts of changes are coalesced into one signal per event loop iteration
+    """
     dirty_changed = QtCore.Signal(bool)
 
     def mark_dirty(self, dirty: bool = True, signal: bool = False) -> None:
@@ -64,57 +112,226 @@ class SoundOperatorGraph(QObject):
         Parameters
         ----------
         dirty : bool
-            True if dirty
+            True if dirty. False also clears the change set, i.e. after saving
         """
         self._dirty = dirty
-        self.dirty_changed.emit(dirty)
+        if not dirty:
+            self.changes.clear()
+        self._schedule_notify()
+
+    def _schedule_notify(self) -> None:
+        """Emit dirty_changed on the next event loop iteration, if not already pending"""
+        if self._notify_pending or self.in_bulk_build():
+            return
+        self._notify_pending = True
+        QtCore.QTimer.singleShot(0, self._notify)
+
+    def _notify(self) -> None:
+        self._notify_pending = False
+        if not self._closed:
+            self.dirty_changed.emit(self.dirty())
+
+    def _on_property_changed(self, node, name: str, value) -> None:
+        if not isinstance(node, OperatorNode):
+            return
+        node.on_property_changed(name)
+        if name == 'name':
+            old = next((k for k, v in self.nodes.items() if v is node), None)
+            if old is not None and old != value:
+                self.nodes[value] = self.nodes.pop(old)
+                self.model.rename(old, value)
+                self.changes.rename(old, value)
+                self._schedule_notify()
+        elif node.view.has_field(name):
+            # Positions, selection and so on aren't saved in the stack
+            self.model.set_value(node.name(), name, value)
+            self.changes.change(node.name(), name)
+            self._schedule_notify()
+
+    def _on_node_created(self, node) -> None:
+        if isinstance(node, OperatorNode):
+            # New nodes have no fields yet, nodes restored by undo have their old values
+            self.nodes[node.name()] = node
+            self.model.add(node.name(), node.type, node.field_values())
+            self.changes.add(node.name())
+            self._schedule_notify()
+
+    def _on_nodes_deleted(self, ids: list[str]) -> None:
+        ids = set(ids)
+        for name in [k for k, v in self.nodes.items() if v.id in ids]:
+            del self.nodes[name]
+            self.model.remove(name)
+            self.changes.remove(name)
+        self._schedule_notify()
+
+    def _on_port_connected(self, in_port: Port, out_port: Port) -> None:
+        target, source = in_port.node().name(), out_port.node().name()
+        if target in self.model and source in self.model:
+            self.model.connect(source, out_port.name(), target, in_port.name())
+        self.changes.change(target, in_port.name())
+        self._schedule_notify()
+
+    def _on_port_disconnected(self, in_port: Port, out_port: Port) -> None:
+        target = in_port.node().name()
+        c = self.model[target].inputs.get(in_port.name()) if target in self.model else None
+        # The input may already have been connected elsewhere
+        if c is not None and (c.source, c.output) == (out_port.node().name(), out_port.name()):
+            self.model.disconnect(target, in_port.name())
+        self.changes.change(target, in_port.name())
+        self._schedule_notify()
 
     @property
     def widget(self) -> NodeGraphWidget:
         return self.graph.widget
 
     def dirty(self) -> bool:
-        """Returns the status of the dirty flag"""
-        return self._dirty
+        """Returns True if the dirty flag is set or the stack has changes"""
+        return self._dirty or bool(self.changes)
 
-    def from_dict(self, opstack: VDFDict, all_opstacks: VDFDict):
+    def in_bulk_build(self) -> bool:
+        """Returns True while inside bulk_build()"""
+        return self._bulk > 0
+
+    @contextmanager
+    def bulk_build(self) -> Iterator[None]:
+        """
+        Context manager for building large parts of the graph at once
+        Graph signals, undo recording and scene indexing are suspended until the outermost
+        bulk_build exits, then dirty_changed is emitted once. Changes made in the meantime
+        aren't recorded in the change set. Nodes don't get their defaults set either,
+        they already have them from the manifest
+        """
+        outer = self._bulk == 0
+        self._bulk += 1
+        if outer:
+            scene = self.graph.scene()
+            blocked = self.graph.blockSignals(True)
+            scene.setItemIndexMethod(QGraphicsScene.NoIndex)
+            self.graph.begin_bulk()
+        try:
+            yield
+        finally:
+            self._bulk -= 1
+            if outer:
+                self.graph.end_bulk()
+                scene.setItemIndexMethod(QGraphicsScene.BspTreeIndex)
+                self.graph.blockSignals(blocked)
+                self._schedule_notify()
+
+    def from_dict(self, opstack: Mapping, all_opstacks: Mapping | ImportResolver,
+                  layouts: layout.LayoutCache | None = None):
         """
         Load an operator stack from a dict
+        The graph is built in bulk, loading doesn't mark the graph dirty or add to the undo stack.
+        Neither the stack nor the stacks it imports are modified
         
         Parameters
         ----------
-        opstack : dict
+        opstack : Mapping
             The operator stack to load.
+        all_opstacks : Mapping | ImportResolver
+            All stacks of the section, or its resolver, to merge in the nodes of import_stack
+        layouts : layout.LayoutCache | None
+            Cached node positions. The stack is only laid out if it has none, or has changed since
+        """
+        resolver = all_opstacks if isinstance(all_opstacks, ImportResolver) else ImportResolver(all_opstacks)
+        name = self.changes.stack
+        if name in resolver.stacks and resolver.stacks[name] is opstack:
+            # Merged view is cached, so reopening the stack is cheap
+            merged = resolver.merged(name)
+        else:
+            merged = resolver.merge(opstack)
+        self.layout_hash = layout.stack_hash(merged)
+        positions = layouts.get(self.changes.section, name, self.layout_hash) if layouts is not None else None
+        self.from_model(OperatorStack.from_nodes(self.changes.section, name, merged), positions)
+
+    def from_model(self, model: OperatorStack, positions: Mapping[str, Sequence[float]] | None = None):
+        """
+        Show a stack's model, which the graph then edits. The graph is built in bulk like from_dict
+        
+        Parameters
+        ----------
+        model : OperatorStack
+            The stack, with its imports merged
+        positions : Mapping[str, Sequence[float]] | None
+            Node positions, the stack is laid out if they don't cover every node
         """
-        # Pass 0: find all import_stacks
-        # TODO: Handling for this should be improved. import_stack's are a bit funny, they basically merge keyvalues sections
-        #  for now we're just merging with no regard for the output. Not sure how else you'd represent this in the graph anyway
-        for imp in opstack.get_all_for('import_stack'):
-            data: VDFDict = all_opstacks[imp]
-            for key in data.keys():
-                if key in opstack:
-                    opstack[key] = (0,data)
-                else:
-                    opstack[key] = data
-
-        # Pass 1: create all nodes
-        for node in opstack.keys():
-            value = opstack[node]
-            if isinstance(value, dict):
-                self._create_node(node, opstack)
-            elif isinstance(value, str):
-                print('WARNING: unhandled import_stack operator')
-                print(f'{node} = {opstack[node]}')
-
-        # Pass 2: resolve connections
-        for node in opstack.keys():
-            value = opstack[node]
-            if isinstance(value, dict):
-                self._resolve(node, opstack)
-
-        self.graph.auto_layout_nodes()
-
-    def make_node(self, node_type: str, name: str | None = None) -> OperatorNode:
+        self.model = model
+        with self.bulk_build():
+            self._build(positions)
+
+    def state(self) -> GraphState:
+        """
+        Returns the edited state of the graph, to rebuild it with restore() once closed.
+        The undo history isn't kept
+        """
+        return GraphState(self.model, self.positions(), self.changes, self._dirty, self.layout_hash)
+
+    def restore(self, state: GraphState) -> None:
+        """Rebuild a graph from the state of a closed one, like from_model"""
+        self.from_model(state.model, state.positions)
+        self.changes = state.changes
+        self._dirty = state.dirty
+        self.layout_hash = state.layout_hash
+        self._schedule_notify()
+
+    def close(self) -> None:
+        """
+        Tear down the Qt scene and widget, releasing their memory. Graphs aren't freed
+        otherwise, and can't be used afterwards. The model is kept
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.graph.blockSignals(True)
+        self.nodes.clear()
+        self.widget.setParent(None)
+        self.widget.deleteLater()
+        self.graph.deleteLater()
+        self.deleteLater()
+
+    def remember_layout(self, layouts: layout.LayoutCache) -> None:
+        """Store the node positions in the cache, unless the graph has changes which weren't saved"""
+        if self.layout_hash is not None and not self.dirty():
+            layouts.put(self.changes.section, self.changes.stack, self.layout_hash, self.positions())
+
+    def _build(self, positions: Mapping[str, Sequence[float]] | None = None):
+        """Create the nodes and connections of the model, which isn't modified"""
+        for name, inst in self.model.nodes.items():
+            self.make_node(inst.operator, name, inst.values.items())
+
+        links: list[Link] = [(c.source, c.output, c.target, c.input) for c in self.model.connections()]
+        # Place the nodes before connecting them, so each pipe is only drawn once
+        self._place_nodes(links, positions)
+        for otherName, outName, nodeName, inputName in links:
+            self.nodes[otherName].get_output_port(outName).connect_to(
+                self.nodes[nodeName].get_input_port(inputName),
+                push_undo=False,
+                emit_signal=False
+            )
+
+    def to_dict(self, original: Mapping | None = None, imports: ImportResolver | None = None) -> VDFDict:
+        """
+        Serialise the graph to an operator stack, see OperatorStack.to_dict
+        
+        Parameters
+        ----------
+        original : Mapping | None
+            The stack as it was loaded, unmodified. Its layout is kept: import_stack entries,
+            the order of the nodes and their keys, and anything the graph doesn't know about
+        imports : ImportResolver | None
+            Resolver of the stack's section, for the stacks named by import_stack. Nodes from
+            imported stacks are only written if they've been changed, with just the changed keys
+        
+        Returns
+        -------
+        VDFDict :
+            The stack
+        """
+        return self.model.to_dict(original, imports)
+
+    def make_node(self, node_type: str, name: str | None = None,
+                  values: Iterable[Tuple[str, str]] = ()) -> OperatorNode:
         """
         Makes a new node, setting defaults as required
         
@@ -125,6 +342,8 @@ class SoundOperatorGraph(QObject):
         name : str | None
             Name of the node when added to the graph (i.e. my_node)
             If not provided, a unique name will be generated based on the operator type
+        values : Iterable[Tuple[str, str]]
+            Initial (name, value) keyvalues and input constants
             
         Returns
         -------
@@ -134,89 +353,66 @@ class SoundOperatorGraph(QObject):
         if name is None:
             name = self.graph.get_unique_name(node_type)
 
+        bulk = self.in_bulk_build()
         n: OperatorNode = self.graph.create_node(
             f'io.soundedit.operators.Operator_{node_type}',
-            name=name
+            name=name,
+            push_undo=not bulk
         )
-        n.set_type(node_type)
-        self.nodes[name] = n
-        self.set_defaults(n)
+        self.nodes[n.name()] = n
+        if bulk:
+            n.set_type(node_type, values)
+        else:
+            n.set_type(node_type)
+            self.set_defaults(n)
+            for key, value in values:
+                n.set_widget_value(key, value)
         return n
 
     def set_defaults(self, node: OperatorNode) -> None:
         """Set default keyvalues on the node"""
         for kv in manifest.current().keyvalue_desc(node.type):
-            node.set_widget_value(kv['name'], kv['default'])
+            node.set_widget_value(kv.name, kv.default)
 
-    def _create_node(self, nodeName: str, opstack: VDFDict):
+    def _place_nodes(self, links: list[Link], positions: Mapping[str, Sequence[float]] | None = None) -> None:
         """
-        Creates a new named node from existing operator stack data
+        Place the nodes, setting positions directly rather than through the undo stack
         
         Parameters
         ----------
-        nodeName : str
-            Name of the node
-        opstack : VDFDict
-            Dictionary of operator stack data
+        links : list[Link]
+            Connections between the nodes
+        positions : Mapping[str, Sequence[float]] | None
+            Cached positions, used if they cover every node. Otherwise the nodes are laid out
         """
-        node = opstack[nodeName]
-        operator = node['operator']
-        n = self.make_node(operator, operator)
-
-        # Create any constant nodes
-        constNodeNum = 0
-        for input in manifest.current().input_desc(operator):
-            inpName = input['name']
-            if not inpName in node:
-                continue
-
-            value: str = node[inpName]
-            port: Port = n.get_input_port(inpName)
-            if value.startswith('@'):
-                continue
-            
-            n.set_input_const(inpName, value)
-            
-        # Set keyvalues
-        for kv in manifest.current().keyvalue_desc(operator):
-            if kv['name'] not in node:
-                continue
-            n.set_widget_value(kv['name'], node[kv['name']])
-
-    def _resolve(self, nodeName: str, opstack: VDFDict):
-        """
-        Resolves inter-node references
-        
-        Parameters
-        ----------
-        nodeName : str
-            Name of the node
-        opstack : VDFDict
-            Dictionary of operator stack data
-        """
-        operator = opstack[nodeName]['operator']
-        node = opstack[nodeName]
-        
-        for input in manifest.current().input_desc(operator):
-            inputName = input['name']
-            if not inputName in node or not node[inputName].startswith('@'):
-                continue
-            
-            value: str = node[inputName]
-            otherName, outName = self._split_input_str(value)
-            
-            other: OperatorNode = self.nodes[otherName]
-            p: Port = other.get_output_port(outName)
-            i: Port = self.nodes[nodeName].get_input_port(inputName)
-            p.connect_to(
-                i,
-                push_undo=False
-            )
-
-    def _split_input_str(self, value: str) -> Tuple[str, str]: # (nodeName, outputName)
-        value = value.removeprefix('@')
-        vals = value.split('.')
-        return (vals[0], vals[1])
+        if positions is None or not all(name in positions for name in self.nodes):
+            positions = self._layout((src, dst) for src, _, dst, _ in links)
+        for name, n in self.nodes.items():
+            x, y = positions[name]
+            n.model.pos = [x, y]
+            n.view.place(x, y)
+
+    def _layout(self, edges: Iterable[Tuple[str, str]]) -> Dict[str, layout.Position]:
+        sizes = {name: (n.view.width, n.view.height) for name, n in self.nodes.items()}
+        return layout.layered(list(self.nodes), edges, sizes)
+
+    def positions(self) -> Dict[str, Tuple[float, float]]:
+        """Returns the position of each node"""
+        return {name: (n.model.pos[0], n.model.pos[1]) for name, n in self.nodes.items()}
+
+    def auto_layout(self) -> None:
+        """Lay out all nodes by their current connections, as a single undo step"""
+        edges = [
+            (other.node().name(), name)
+            for name, n in self.nodes.items()
+            for port in n.input_ports()
+            for other in port.connected_ports()
+        ]
+        positions = self._layout(edges)
+        self.graph.begin_undo('Auto-layout')
+        for name, n in self.nodes.items():
+            n.set_pos(*positions[name])
+        self.graph.end_undo()
 
     def remove_node(self, name: str) -> bool:
         """
@@ -234,8 +430,8 @@ class SoundOperatorGraph(QObject):
         """
         if name not in self.nodes:
             return False
-        n = self.nodes.pop(name)
-        self.graph.delete_node(n)
+        # Removed from self.nodes and the model by _on_nodes_deleted
+        self.graph.delete_node(self.nodes[name])
         return True
 
     def _add_node(self, type: str) -> None:
@@ -252,15 +448,14 @@ class SoundOperatorGraph(QObject):
         m = menu.add_menu('Add Node')
         subs = {x: m.add_menu(x) for x in manifest.current().categories()}
         for k, v in manifest.node_types().items():
-            if k == '__base': continue # Skip the "base" node
-            x = subs[v['category']] if 'category' in v else m
+            x = subs[v.category] if v.category is not None else m
             x.add_command(
-                k, lambda graph: self._add_node(k)
+                k, lambda graph, k=k: self._add_node(k)
             )
 
         menu.add_command(
             'Auto-layout',
-            lambda graph: graph.auto_layout_nodes()
+            lambda graph: self.auto_layout()
         )
 
     def _build_node_context_menu(self):
@@ -0,0 +1,217 @@
+"""
+import_stack resolution
+
+A stack can import the nodes of other stacks in the same section, and override their
+keys. ImportResolver builds the import graph of a section once, finds cycles and
+missing targets, and caches the merged nodes of each stack without modifying the
+stacks themselves. This module does not depend on Qt.
+"""
+
+from typing import Dict, Iterator, Mapping
+
+from . import keyvalues
+from .stackfile import StackSection
+
+
+# Node name -> keyvalues
+Nodes = Dict[str, Dict[str, str]]
+
+
+def _local_nodes(stack: Mapping) -> Iterator[tuple[str, Mapping]]:
+    for key, value in keyvalues.pairs(stack):
+        if not isinstance(value, str):
+            yield key, value
+
+
+def _stack_imports(stack: Mapping) -> list[str]:
+    return [v for k, v in keyvalues.pairs(stack) if k == 'import_stack' and isinstance(v, str)]
+
+
+class ImportResolver:
+    """
+    Merged view of the stacks in a section, with import_stack applied
+
+    Merged nodes are shared between the stacks importing them, and must be treated
+    as read-only. Later imports override earlier ones, and a stack's own keys
+    override anything imported. Duplicate keys within a node resolve to the last one,
+    as they do in the editor.
+
+    Parameters
+    ----------
+    stacks : Mapping
+        The stacks of a section, either parsed or a lazy StackSection
+    section : str
+        Name of the section, for reference
+    """
+
+    def __init__(self, stacks: Mapping, section: str = ''):
+        self.stacks = stacks
+        self.section = section
+        # Stack -> directly imported stacks, and the reverse
+        self._imports: Dict[str, list[str]] = {}
+        self._importers: Dict[str, set[str]] = {}
+        # Imports which would complete a cycle, as (stack, imported stack)
+        self._cycles: set[tuple[str, str]] = set()
+        self._merged: Dict[str, Nodes] = {}
+        self._broken: Dict[str, bool] = {}
+
+        for name in stacks:
+            self._add_edges(name)
+        self._find_cycles()
+
+    def _read_imports(self, name: str) -> list[str]:
+        if isinstance(self.stacks, StackSection):
+            # Read from the scan, without parsing the stack
+            return self.stacks.imports(name)
+        stack = self.stacks.get(name)
+        return _stack_imports(stack) if isinstance(stack, Mapping) else []
+
+    def _add_edges(self, name: str) -> None:
+        imports = self._read_imports(name)
+        self._imports[name] = imports
+        for imp in imports:
+            self._importers.setdefault(imp, set()).add(name)
+
+    def _find_cycles(self) -> None:
+        """Depth-first search in file order, recording the back edges"""
+        self._cycles = set()
+        state: Dict[str, int] = {}
+        for start in self._imports:
+            if start in state:
+                continue
+            state[start] = 1
+            path = [(start, iter(self._imports[start]))]
+            while path:
+                name, it = path[-1]
+                imp = next(it, None)
+                if imp is None:
+                    state[name] = 2
+                    path.pop()
+                elif imp not in self._imports:
+                    continue
+                elif imp not in state:
+                    state[imp] = 1
+                    path.append((imp, iter(self._imports[imp])))
+                elif state[imp] == 1:
+                    self._cycles.add((name, imp))
+
+    def imports(self, name: str) -> list[str]:
+        """Stacks imported directly by a stack"""
+        return self._imports.get(name, [])
+
+    def importers(self, name: str) -> set[str]:
+        """Stacks which import a stack, directly or through other stacks"""
+        out = set()
+        todo = [name]
+        while todo:
+            for other in self._importers.get(todo.pop(), ()):
+                if other not in out:
+                    out.add(other)
+                    todo.append(other)
+        out.discard(name)
+        return out
+
+    def problems(self, name: str) -> list[tuple[str, str]]:
+        """
+        Problems with the imports of a stack itself
+
+        Returns
+        -------
+        list[tuple[str, str]] :
+            (kind, imported stack), kind is 'missing' or 'cycle'
+        """
+        out = []
+        for imp in self.imports(name):
+            if imp not in self._imports:
+                out.append(('missing', imp))
+            elif (name, imp) in self._cycles:
+                out.append(('cycle', imp))
+        return out
+
+    def is_broken(self, name: str) -> bool:
+        """
+        True if a stack, or any stack it imports, imports a missing stack. Its merged
+        view is incomplete, so i.e. nodes overriding a missing node have no operator
+        """
+        broken = self._broken.get(name)
+        if broken is None:
+            # Provisionally fine, in case of a cycle
+            self._broken[name] = False
+            broken = any(kind == 'missing' for kind, _ in self.problems(name)) or any(
+                self.is_broken(imp) for imp in self.imports(name)
+                if imp in self._imports and (name, imp) not in self._cycles
+            )
+            self._broken[name] = broken
+        return broken
+
+    def _merge_imports(self, imports: list[str], skip: str | None = None) -> Nodes:
+        nodes: Nodes = {}
+        for imp in imports:
+            if imp not in self._imports or (skip, imp) in self._cycles:
+                continue
+            for node, block in self.merged(imp).items():
+                nodes[node] = {**nodes[node], **block} if node in nodes else block
+        return nodes
+
+    def _merge(self, stack: Mapping, nodes: Nodes) -> Nodes:
+        for node, block in _local_nodes(stack):
+            base = nodes.get(node)
+            nodes[node] = {**base, **dict(keyvalues.pairs(block))} if base else dict(keyvalues.pairs(block))
+        return nodes
+
+    def merged(self, name: str) -> Nodes:
+        """The nodes of a stack with its imports applied. Cached until invalidated"""
+        nodes = self._merged.get(name)
+        if nodes is None:
+            stack = self.stacks[name]
+            nodes = self._merge(stack, self._merge_imports(self.imports(name), name)) \
+                if isinstance(stack, Mapping) else {}
+            self._merged[name] = nodes
+        return nodes
+
+    def imported(self, stack: Mapping) -> Nodes:
+        """The nodes a stack, which needn't be in the section, gets from its imports"""
+        return self._merge_imports(_stack_imports(stack))
+
+    def merge(self, stack: Mapping) -> Nodes:
+        """
+        Merge a stack which needn't be in the section (i.e. an edited copy) with its
+        imports. The result isn't cached
+        """
+        return self._merge(stack, self.imported(stack))
+
+    def invalidate(self, name: str) -> set[str]:
+        """
+        Call when a stack has been changed, added or removed. Its imports are read
+        again, and the cached views of it and every stack importing it are dropped
+
+        Returns
+        -------
+        set[str] :
+            The affected stacks, including name itself
+        """
+        for imp in self._imports.pop(name, []):
+            self._importers.get(imp, set()).discard(name)
+        if name in self.stacks:
+            self._add_edges(name)
+        cycles = self._cycles
+        self._find_cycles()
+
+        affected = self.importers(name) | {name}
+        if cycles != self._cycles:
+            # Which import is skipped to break a cycle can change anywhere
+            self._merged.clear()
+        for other in affected:
+            self._merged.pop(other, None)
+        self._broken.clear()
+        return affected
+
+    def invalidate_all(self) -> None:
+        """Drop every cached view, i.e. after the whole file has been reloaded"""
+        self._imports.clear()
+        self._importers.clear()
+        self._merged.clear()
+        self._broken.clear()
+        for name in self.stacks:
+            self._add_edges(name)
+        self._find_cycles()
@@ -0,0 +1,353 @@
+"""
+Fast KeyValues (VDF) reader used for sound operator stack files
+
+Tokenizes the whole buffer in a single regex pass over bytes and builds the same
+structure as ``vdf.load(fp, mapper=VDFDict)``. This module does not depend on Qt so
+it can be used headlessly.
+"""
+
+import re
+
+from typing import IO, Callable, Mapping, Type
+from vdf import VDFDict
+
+
+# Each match is a single token, with any leading whitespace and // comments consumed.
+# Groups: 1 = quoted string, 2 = brace, 3 = conditional ([$WIN32] etc), 4 = unquoted, 5 = stray quote/bracket.
+# The empty match at \Z swallows trailing whitespace without backtracking.
+_TOKEN_RE = re.compile(
+    rb'(?:\s+|//[^\n]*)*'
+    rb'(?:"([^"\\]*(?:\\.[^"\\]*)*)"'
+    rb'|([{}])'
+    rb'|(\[[^\]\n]*\])'
+    rb'|((?:[^\s"{}\[/]|/(?!/))[^\s"{}\[/]*(?:/(?!/)[^\s"{}\[/]*)*)'
+    rb'|(["\[])'
+    rb'|\Z)',
+    re.S
+)
+
+_QUOTED = 1
+_BRACE = 2
+_COND = 3
+_UNQUOTED = 4
+_STRAY = 5
+
+_UNESCAPE_RE = re.compile(r'\\[ntvbrfa\\?"\']')
+_UNESCAPE_MAP = {
+    '\\n': '\n', '\\t': '\t', '\\v': '\v', '\\b': '\b', '\\r': '\r', '\\f': '\f',
+    '\\a': '\a', '\\\\': '\\', '\\?': '?', '\\"': '"', "\\'": "'",
+}
+
+_ESCAPE_RE = re.compile(r'[\n\t\v\b\r\f\a\\"]')
+_ESCAPE_MAP = {v: k for k, v in _UNESCAPE_MAP.items() if v not in '?\''}
+
+_BOM = b'\xef\xbb\xbf'
+
+# Number of tokens between progress callbacks
+_PROGRESS_INTERVAL = 16384
+
+ProgressCallback = Callable[[int, int], None]
+
+
+class KeyValuesSyntaxError(SyntaxError):
+    """Raised when a KeyValues buffer is malformed"""
+    pass
+
+
+def _unescape(text: str) -> str:
+    return _UNESCAPE_RE.sub(lambda m: _UNESCAPE_MAP[m.group()], text)
+
+
+def _error(msg: str, data, pos: int, filename: str) -> KeyValuesSyntaxError:
+    lineno = bytes(data[:pos]).count(b'\n') + 1
+    return KeyValuesSyntaxError(f'keyvalues: {msg}', (filename, lineno, 0, None))
+
+
+def parse(data, mapper: Type[Mapping] = VDFDict, escaped: bool = True,
+          start: int = 0, end: int | None = None, filename: str = '<buffer>',
+          root: Mapping | None = None, progress: ProgressCallback | None = None) -> Mapping:
+    """
+    Parse a KeyValues buffer
+
+    Duplicate keys follow ``vdf.parse``: repeated blocks are merged into the first one,
+    repeated scalar keys are appended (and kept as duplicates when mapper is a VDFDict).
+
+    Parameters
+    ----------
+    data : bytes | bytearray | mmap
+        Raw UTF-8 encoded file contents
+    mapper : Type[Mapping]
+        Mapping type to construct for each block
+    escaped : bool
+        Unescape backslash sequences in quoted strings
+    start, end : int
+        Byte range of data to parse. Defaults to the whole buffer
+    filename : str
+        Used in error messages
+    root : Mapping | None
+        Existing block to parse into. A new one is created if not provided
+    progress : ProgressCallback | None
+        Called periodically with (offset, end). May raise to abort parsing
+
+    Returns
+    -------
+    Mapping :
+        The root block
+    """
+    if end is None:
+        end = len(data)
+    if start == 0 and data[:3] == _BOM:
+        start = 3
+
+    if root is None:
+        root = mapper()
+    stack = [root]
+    cur = root
+    key = None
+    # Decoded token cache. Stack files repeat the same handful of keys and values
+    # constantly, sharing the str objects keeps memory down and skips redundant decodes
+    strings = {}
+
+    countdown = _PROGRESS_INTERVAL
+    for m in _TOKEN_RE.finditer(data, start, end):
+        if progress is not None:
+            countdown -= 1
+            if not countdown:
+                countdown = _PROGRESS_INTERVAL
+                progress(m.end(), end)
+
+        kind = m.lastindex
+        if kind == _QUOTED or kind == _UNQUOTED:
+            raw = m[kind]
+            tok = strings.get(raw)
+            if tok is None:
+                tok = raw.decode('utf-8')
+                if escaped and kind == _QUOTED and '\\' in tok:
+                    tok = _unescape(tok)
+                strings[raw] = tok
+            if key is None:
+                key = tok
+            else:
+                cur[key] = tok
+                key = None
+        elif kind == _BRACE:
+            if m[_BRACE] == b'{':
+                if key is None:
+                    raise _error('unexpected opening brace', data, m.start(_BRACE), filename)
+                if key in cur:
+                    block = cur[key]
+                    # Descending into a key we've seen as a string, vdf replaces it with a block
+                    if not isinstance(block, mapper):
+                        block = mapper()
+                        cur[key] = block
+                else:
+                    block = mapper()
+                    cur[key] = block
+                stack.append(block)
+                cur = block
+                key = None
+            else:
+                if key is not None:
+                    raise _error(f'key "{key}" has no value', data, m.start(_BRACE), filename)
+                if len(stack) == 1:
+                    raise _error('one too many closing braces', data, m.start(_BRACE), filename)
+                stack.pop()
+                cur = stack[-1]
+        elif kind == _STRAY:
+            what = 'quoted string' if m.group(_STRAY) == b'"' else 'conditional'
+            raise _error(f'unterminated {what}', data, m.start(_STRAY), filename)
+        # _COND: platform conditionals are ignored, as vdf does
+
+    if key is not None:
+        raise _error(f'key "{key}" has no value (EOF)', data, end, filename)
+    if len(stack) != 1:
+        raise _error('unclosed brace (EOF)', data, end, filename)
+    return root
+
+
+def pairs(block: Mapping) -> list[tuple[str, object]]:
+    """
+    Returns the (key, value) pairs of a block, including duplicates
+
+    Much faster than VDFDict.items(), which is a Python generator. A VDFDict's underlying
+    dict is keyed on (index, key) in insertion order, so the order only differs from
+    items() after duplicate keys have been deleted.
+    """
+    if isinstance(block, VDFDict):
+        return [(k, v) for (_, k), v in dict.items(block)]
+    return list(block.items())
+
+
+def loads(s: str | bytes, **kwargs) -> Mapping:
+    """
+    Parse KeyValues from a string. See parse() for arguments
+    """
+    if isinstance(s, str):
+        s = s.encode('utf-8')
+    return parse(s, **kwargs)
+
+
+def load(fp: IO, **kwargs) -> Mapping:
+    """
+    Parse KeyValues from a file object opened in either text or binary mode.
+    See parse() for arguments
+    """
+    kwargs.setdefault('filename', getattr(fp, 'name', '<file>'))
+    return loads(fp.read(), **kwargs)
+
+
+def _escape(text: str) -> str:
+    return _ESCAPE_RE.sub(lambda m: _ESCAPE_MAP[m.group()], text)
+
+
+def _dump(block: Mapping, level: int, escaped: bool, out: list[str]) -> None:
+    indent = '\t' * level
+    for key, value in pairs(block):
+        if escaped:
+            key = _escape(key)
+        if isinstance(value, Mapping):
+            out.append(f'{indent}"{key}"\n{indent}{{\n')
+            _dump(value, level + 1, escaped, out)
+            out.append(f'{indent}}}\n')
+        else:
+            out.append(f'{indent}"{key}" "{_escape(value) if escaped else value}"\n')
+
+
+def dumps(block: Mapping, level: int = 0, escaped: bool = True) -> str:
+    """
+    Serialise a block to KeyValues text, in the same layout as the stack files:
+    tab indented, every key and value quoted, braces on their own lines
+
+    Parameters
+    ----------
+    block : Mapping
+        Block to write. Duplicate keys in a VDFDict are written out
+    level : int
+        Indentation level of the block's pairs
+    escaped : bool
+        Escape special characters in strings, the reverse of parse()
+    """
+    out = []
+    _dump(block, level, escaped, out)
+    return ''.join(out)
+
+
+def dump(block: Mapping, fp: IO, **kwargs) -> None:
+    """
+    Serialise a block to a file object opened in text mode. See dumps() for arguments
+    """
+    fp.write(dumps(block, **kwargs))
+
+
+def dump_pair(key: str, value: str | Mapping, level: int = 0, escaped: bool = True) -> str:
+    """
+    Serialise a single pair, for splicing into existing text at the given indentation level.
+    The result starts at the key (no indentation) and ends at the value or closing brace
+    """
+    out = []
+    _dump({key: value}, level, escaped, out)
+    return ''.join(out)[level:-1]
+
+
+class BlockSpan:
+    """
+    Location of a block within a KeyValues buffer, as found by scan()
+    """
+    __slots__ = ('key', 'key_start', 'start', 'end', 'children')
+
+    def __init__(self, key: str, key_start: int, start: int):
+        self.key = key
+        self.key_start = key_start # Offset of the key token, including its quote
+        self.start = start # Offset of the opening brace
+        self.end = -1 # Offset just past the closing brace
+        # (key, str | BlockSpan) pairs, only filled for blocks within the scanned depth
+        self.children: list[tuple[str, 'str | BlockSpan']] = []
+
+    def __repr__(self) -> str:
+        return f'BlockSpan({self.key!r}, {self.start}, {self.end})'
+
+
+def scan(data, max_depth: int = 2, filename: str = '<buffer>',
+         progress: ProgressCallback | None = None) -> BlockSpan:
+    """
+    Quick structural scan of a KeyValues buffer
+
+    Records the byte range of every block down to max_depth without building any
+    mappings. Anything deeper is skipped over, only counting braces.
+
+    Parameters
+    ----------
+    data : bytes | bytearray | mmap
+        Raw UTF-8 encoded file contents
+    max_depth : int
+        Deepest block level to record. 1 = top-level blocks only
+    filename : str
+        Used in error messages
+    progress : ProgressCallback | None
+        Called periodically with (offset, end). May raise to abort the scan
+
+    Returns
+    -------
+    BlockSpan :
+        Span covering the whole buffer, its children are the top-level pairs
+    """
+    end = len(data)
+    start = 3 if data[:3] == _BOM else 0
+
+    root = BlockSpan('', start, start)
+    stack = [root]
+    cur = root
+    depth = 0
+    key = None
+    key_start = 0
+
+    countdown = _PROGRESS_INTERVAL
+    for m in _TOKEN_RE.finditer(data, start, end):
+        if progress is not None:
+            countdown -= 1
+            if not countdown:
+                countdown = _PROGRESS_INTERVAL
+                progress(m.end(), end)
+
+        kind = m.lastindex
+        if kind == _QUOTED or kind == _UNQUOTED:
+            if depth > max_depth:
+                continue
+            tok = m[kind].decode('utf-8')
+            if key is None:
+                key = tok
+                key_start = m.start(kind) - (kind == _QUOTED)
+            else:
+                cur.children.append((key, tok))
+                key = None
+        elif kind == _BRACE:
+            if m[_BRACE] == b'{':
+                if key is None and depth <= max_depth:
+                    raise _error('unexpected opening brace', data, m.start(_BRACE), filename)
+                depth += 1
+                if depth > max_depth:
+                    key = None
+                    continue
+                block = BlockSpan(key, key_start, m.start(_BRACE))
+                cur.children.append((key, block))
+                stack.append(block)
+                cur = block
+                key = None
+            else:
+                if depth == 0:
+                    raise _error('one too many closing braces', data, m.start(_BRACE), filename)
+                depth -= 1
+                if depth >= max_depth:
+                    continue
+                if key is not None:
+                    raise _error(f'key "{key}" has no value', data, m.start(_BRACE), filename)
+                stack.pop().end = m.end(_BRACE)
+                cur = stack[-1]
+        elif kind == _STRAY:
+            what = 'quoted string' if m[_STRAY] == b'"' else 'conditional'
+            raise _error(f'unterminated {what}', data, m.start(_STRAY), filename)
+
+    if depth != 0:
+        raise _error('unclosed brace (EOF)', data, end, filename)
+    root.end = end
+    return root
@@ -0,0 +1,270 @@
+"""
+Layered (Sugiyama style) layout of operator stacks, and a cache of node positions
+
+The layout runs in four phases on the dependency graph, each near-linear in the number
+of nodes and connections:
+
+1. Cycle removal: connections which close a cycle are reversed
+2. Layering: each node goes in the column of its longest path from a node with no inputs
+3. Crossing reduction: alternating barycentre sweeps, keeping the ordering with the fewest
+   crossings between adjacent columns. Long connections aren't split into dummy nodes,
+   instead they use the relative position of their far end
+4. Coordinates: columns are packed left to right, each node is pulled towards the
+   median height of its inputs without overlapping its neighbours
+
+Positions are cached in a sidecar file next to the stack file, keyed by stack name and a
+hash of the stack's structure, so a stack reopens with the positions it was left with.
+This module does not depend on Qt.
+"""
+
+import hashlib
+import json
+import os
+
+from typing import Dict, Iterable, Mapping, Sequence, Tuple
+
+# (x, y) of a node's top left corner
+Position = Tuple[float, float]
+# (width, height) of a node
+Size = Tuple[float, float]
+
+# Gaps between columns, and between nodes of a column
+COLUMN_SPACING = 100.0
+ROW_SPACING = 40.0
+
+
+def _remove_cycles(order: Sequence[str], succ: Dict[str, list[str]]) -> None:
+    """Reverse the connections which close a cycle, found by depth-first search in node order"""
+    state: Dict[str, int] = {}
+    reverse: list[tuple[str, str]] = []
+    for start in order:
+        if start in state:
+            continue
+        state[start] = 1
+        path = [(start, iter(succ[start]))]
+        while path:
+            node, it = path[-1]
+            nxt = next(it, None)
+            if nxt is None:
+                state[node] = 2
+                path.pop()
+            elif nxt not in state:
+                state[nxt] = 1
+                path.append((nxt, iter(succ[nxt])))
+            elif state[nxt] == 1:
+                reverse.append((node, nxt))
+    for src, dst in reverse:
+        succ[src].remove(dst)
+        if src not in succ[dst]:
+            succ[dst].append(src)
+
+
+def _layers(order: Sequence[str], succ: Dict[str, list[str]]) -> Dict[str, int]:
+    """Longest path from a node with no inputs, in topological order"""
+    indegree = dict.fromkeys(order, 0)
+    for node in order:
+        for dst in succ[node]:
+            indegree[dst] += 1
+    layer = dict.fromkeys(order, 0)
+    queue = [node for node in order if indegree[node] == 0]
+    for node in queue:
+        for dst in succ[node]:
+            layer[dst] = max(layer[dst], layer[node] + 1)
+            indegree[dst] -= 1
+            if indegree[dst] == 0:
+                queue.append(dst)
+    return layer
+
+
+def _crossings(columns: list[list[str]], layer: Dict[str, int], succ: Dict[str, list[str]]) -> int:
+    """Crossings between connections of adjacent columns, counted as inversions with a Fenwick tree"""
+    index = {node: i for column in columns for i, node in enumerate(column)}
+    total = 0
+    for i, column in enumerate(columns[:-1]):
+        size = len(columns[i + 1])
+        tree = [0] * (size + 1)
+        seen = 0
+        # Connections in source order, ties broken by destination order
+        for _, dst in sorted(
+            (index[src], index[dst]) for src in column for dst in succ[src] if layer[dst] == i + 1
+        ):
+            # Earlier connections ending below this one cross it
+            j = dst + 1
+            below = 0
+            while j > 0:
+                below += tree[j]
+                j -= j & -j
+            total += seen - below
+            seen += 1
+            j = dst + 1
+            while j <= size:
+                tree[j] += 1
+                j += j & -j
+    return total
+
+
+def _order(columns: list[list[str]], layer: Dict[str, int], succ: Dict[str, list[str]],
+           pred: Dict[str, list[str]], sweeps: int) -> list[list[str]]:
+    """Reorder each column to reduce crossings, returns the best ordering found"""
+    # Relative position of each node in its column, so long connections can be compared
+    pos: Dict[str, float] = {}
+
+    def place(column: list[str]) -> None:
+        for i, node in enumerate(column):
+            pos[node] = (i + 0.5) / len(column)
+
+    for column in columns:
+        place(column)
+
+    best = [list(c) for c in columns]
+    best_crossings = _crossings(columns, layer, succ)
+    for sweep in range(sweeps):
+        if best_crossings == 0:
+            break
+        down = sweep % 2 == 0
+        neighbours = pred if down else succ
+
+        def barycentre(node: str) -> float:
+            others = neighbours[node]
+            if not others:
+                return pos[node]
+            return sum(pos[x] for x in others) / len(others)
+
+        for i in (range(1, len(columns)) if down else range(len(columns) - 2, -1, -1)):
+            columns[i].sort(key=barycentre)
+            place(columns[i])
+
+        crossings = _crossings(columns, layer, succ)
+        if crossings < best_crossings:
+            best = [list(c) for c in columns]
+            best_crossings = crossings
+    return best
+
+
+def layered(nodes: Sequence[str], edges: Iterable[tuple[str, str]], sizes: Mapping[str, Size],
+            sweeps: int = 4) -> Dict[str, Position]:
+    """
+    Lay out a graph in columns, inputs on the left
+
+    Parameters
+    ----------
+    nodes : Sequence[str]
+        Names of the nodes, their order is the initial order of each column
+    edges : Iterable[tuple[str, str]]
+        (source, destination) connections. Duplicates and unknown nodes are ignored
+    sizes : Mapping[str, Size]
+        Width and height of each node
+    sweeps : int
+        Maximum number of crossing reduction sweeps
+
+    Returns
+    -------
+    Dict[str, Position] :
+        Top left corner of each node
+    """
+    succ: Dict[str, list[str]] = {node: [] for node in nodes}
+    for src, dst in edges:
+        if src != dst and src in succ and dst in succ and dst not in succ[src]:
+            succ[src].append(dst)
+    _remove_cycles(nodes, succ)
+    layer = _layers(nodes, succ)
+    pred: Dict[str, list[str]] = {node: [] for node in nodes}
+    for src in nodes:
+        for dst in succ[src]:
+            pred[dst].append(src)
+
+    columns: list[list[str]] = [[] for _ in range(max(layer.values(), default=-1) + 1)]
+    for node in nodes:
+        columns[layer[node]].append(node)
+    columns = _order(columns, layer, succ, pred, sweeps)
+
+    positions: Dict[str, Position] = {}
+    # Vertical centre of each placed node
+    centre: Dict[str, float] = {}
+    x = 0.0
+    for column in columns:
+        bottom = None
+        for node in column:
+            height = sizes[node][1]
+            inputs = sorted(centre[p] for p in pred[node])
+            y = inputs[len(inputs) // 2] - height / 2 if inputs else 0.0
+            if bottom is not None:
+                y = max(y, bottom + ROW_SPACING)
+            positions[node] = (x, y)
+            centre[node] = y + height / 2
+            bottom = y + height
+        x += max((sizes[node][0] for node in column), default=0.0) + COLUMN_SPACING
+    return positions
+
+
+def stack_hash(nodes: Mapping[str, Mapping[str, str]]) -> str:
+    """
+    Hash of the structure of a stack's merged nodes: their names, operators and
+    connections. Changing a constant or keyvalue doesn't change the hash
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for node, block in nodes.items():
+        h.update(node.encode('utf-8'))
+        h.update(b'\0')
+        for key, value in block.items():
+            if key == 'operator' or value.startswith('@'):
+                h.update(f'{key}\0{value}\0'.encode('utf-8'))
+        h.update(b'\1')
+    return h.hexdigest()
+
+
+class LayoutCache:
+    """
+    Node positions of the stacks of a file, stored in a JSON sidecar file next to it
+
+    Parameters
+    ----------
+    file : str
+        Path to the stack file
+    """
+
+    def __init__(self, file: str):
+        self.stack_file = file
+        self.file = file + '.layout.json'
+        self._entries: Dict[str, dict] | None = None
+        self._dirty = False
+
+    def _load(self) -> Dict[str, dict]:
+        if self._entries is None:
+            try:
+                with open(self.file, 'r', encoding='utf-8') as fp:
+                    data = json.load(fp)
+                self._entries = data if isinstance(data, dict) else {}
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, section: str, name: str, hash: str) -> Dict[str, Position] | None:
+        """Cached positions of a stack, None if there are none or the stack has changed since"""
+        entry = self._load().get(f'{section}/{name}')
+        if not isinstance(entry, dict) or entry.get('hash') != hash:
+            return None
+        positions = entry.get('positions')
+        return {k: (v[0], v[1]) for k, v in positions.items()} if isinstance(positions, dict) else None
+
+    def put(self, section: str, name: str, hash: str, positions: Mapping[str, Sequence[float]]) -> None:
+        """Remember the positions of a stack, written by flush()"""
+        self._load()[f'{section}/{name}'] = {
+            'hash': hash,
+            'positions': {k: [round(v[0], 1), round(v[1], 1)] for k, v in positions.items()}
+        }
+        self._dirty = True
+
+    def flush(self) -> None:
+        """Write the sidecar file, if anything has changed. Failures are ignored, it's only a cache"""
+        if not self._dirty:
+            return
+        tmp = f'{self.file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as fp:
+                json.dump(self._entries, fp, separators=(',', ':'))
+            os.replace(tmp, self.file)
+            self._dirty = False
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
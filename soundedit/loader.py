@@ -0,0 +1,138 @@
+from PySide6.QtCore import QObject, QRunnable, Signal
+
+from typing import Mapping, NamedTuple
+
+from . import keyvalues, search, validator
+from .stackfile import StackFile, missing_imports
+
+
+class LoadCancelled(Exception):
+    """Raised inside the worker when a load has been cancelled"""
+    pass
+
+
+class LoadResult(NamedTuple):
+    file: str
+    data: Mapping
+    warnings: list[str]
+
+
+class StackLoaderSignals(QObject):
+    """Signals emitted by StackLoader. These are delivered on the GUI thread"""
+
+    """Load progress, in percent"""
+    progress = Signal(int)
+    """Emitted with a LoadResult on success"""
+    finished = Signal(object)
+    """Emitted with an error message on failure"""
+    failed = Signal(str)
+    """Emitted once the load has been cancelled"""
+    cancelled = Signal()
+
+
+class StackLoader(QRunnable):
+    """
+    Loads an operator stack file on a worker thread
+    Parses (or scans, when lazy) the file and checks its import_stack references
+    """
+
+    def __init__(self, file: str, lazy: bool = True):
+        super().__init__()
+        self.file = file
+        self.lazy = lazy
+        self.signals = StackLoaderSignals()
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        """Request cancellation. The worker stops at its next progress update"""
+        self._cancelled = True
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled
+
+    def _progress(self, pos: int, end: int) -> None:
+        if self._cancelled:
+            raise LoadCancelled()
+        self.signals.progress.emit(pos * 100 // max(end, 1))
+
+    def _load(self) -> Mapping:
+        if self.lazy:
+            return StackFile(self.file, progress=self._progress)
+        with open(self.file, 'rb') as fp:
+            return keyvalues.load(fp, progress=self._progress)
+
+    def run(self) -> None:
+        try:
+            data = self._load()
+            warnings = [
+                f'{stack} imports unknown stack "{imp}"'
+                for section, stack, imp in missing_imports(data)
+            ]
+            if self._cancelled:
+                if isinstance(data, StackFile):
+                    data.close()
+                raise LoadCancelled()
+            self.signals.progress.emit(100)
+            self.signals.finished.emit(LoadResult(self.file, data, warnings))
+        except LoadCancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+
+
+class ValidateSignals(QObject):
+    """Signals emitted by ValidateTask. These are delivered on the GUI thread"""
+
+    """Emitted with the file name and a list of validator.Problem"""
+    finished = Signal(str, object)
+    """Emitted with the file name and an error message on failure"""
+    failed = Signal(str, str)
+
+
+class ValidateTask(QRunnable):
+    """
+    Validates an operator stack file on a worker thread.
+    The file is read from disk, so the result reflects the last saved state
+    """
+
+    def __init__(self, file: str):
+        super().__init__()
+        self.file = file
+        self.signals = ValidateSignals()
+
+    def run(self) -> None:
+        try:
+            problems = validator.validate_file(self.file)
+        except Exception as e:
+            self.signals.failed.emit(self.file, str(e))
+            return
+        self.signals.finished.emit(self.file, problems)
+
+
+class IndexSignals(QObject):
+    """Signals emitted by IndexTask. These are delivered on the GUI thread"""
+
+    """Emitted with the file name and a search.SearchIndex"""
+    finished = Signal(str, object)
+    """Emitted with the file name and an error message on failure"""
+    failed = Signal(str, str)
+
+
+class IndexTask(QRunnable):
+    """
+    Builds the search index of an operator stack file on a worker thread.
+    The file is read from disk, so the index reflects the last saved state
+    """
+
+    def __init__(self, file: str):
+        super().__init__()
+        self.file = file
+        self.signals = IndexSignals()
+
+    def run(self) -> None:
+        try:
+            idx = search.index_file(self.file)
+        except Exception as e:
+            self.signals.failed.emit(self.file, str(e))
+            return
+        self.signals.finished.emit(self.file, idx)
@@ -1,87 +1,262 @@
 
 import json
 import os
+import pickle
+import sys
+import zlib
 
 from typing import Tuple, Dict
 
 from .types import NodeType, NodeInputType, NodeOutputType, NodeManifest, NodeKeyValueType
 
+
+def color_for_type(type: str) -> Tuple[int, int, int]:
+    match type:
+        case 'vec3':
+            return (0, 255, 0)
+        case 'float':
+            return (255, 255, 0)
+        case 'speakers':
+            return (255, 0, 0)
+        case 'vec3x8':
+            return (255, 0, 255)
+        case _:
+            raise Exception('Invalid type name')
+
+
+class _Descriptor:
+    """
+    Base for compiled, immutable manifest descriptors
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, x) for x in self._fields))
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.name!r})'
+
+
+class PortDesc(_Descriptor):
+    """
+    Describes an input or output of an operator
+    """
+    __slots__ = ('name', 'type', 'default', 'color')
+    _fields = __slots__
+
+    def __init__(self, name: str, type: str, default: str | None, color: Tuple[int, int, int]):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'type', type)
+        object.__setattr__(self, 'default', default)
+        object.__setattr__(self, 'color', color)
+
+    @classmethod
+    def from_json(cls, desc: NodeInputType | NodeOutputType) -> 'PortDesc':
+        return cls(desc['name'], desc['type'], desc.get('default'), color_for_type(desc['type']))
+
+
+class KeyValueDesc(_Descriptor):
+    """
+    Describes a single keyvalue of an operator
+    """
+    __slots__ = ('name', 'type', 'choices', 'default')
+    _fields = __slots__
+
+    def __init__(self, name: str, type: str, choices: Tuple[str, ...] | None, default: str | None):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'type', type)
+        object.__setattr__(self, 'choices', choices)
+        object.__setattr__(self, 'default', default)
+
+    @classmethod
+    def from_json(cls, desc: NodeKeyValueType) -> 'KeyValueDesc':
+        choices = desc.get('choices')
+        return cls(desc['name'], desc['type'], tuple(choices) if choices is not None else None, desc.get('default'))
+
+
+class OperatorDesc(_Descriptor):
+    """
+    Describes an operator type: its inputs, outputs and keyvalues, in declaration order
+    and indexed by name
+    """
+    __slots__ = ('name', 'category', 'inputs', 'outputs', 'keyvalues', 'input_map', 'output_map', 'keyvalue_map')
+    _fields = ('name', 'category', 'inputs', 'outputs', 'keyvalues')
+
+    def __init__(self, name: str, category: str | None, inputs: Tuple[PortDesc, ...],
+                 outputs: Tuple[PortDesc, ...], keyvalues: Tuple[KeyValueDesc, ...]):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'category', category)
+        object.__setattr__(self, 'inputs', inputs)
+        object.__setattr__(self, 'outputs', outputs)
+        object.__setattr__(self, 'keyvalues', keyvalues)
+        object.__setattr__(self, 'input_map', {x.name: x for x in inputs})
+        object.__setattr__(self, 'output_map', {x.name: x for x in outputs})
+        object.__setattr__(self, 'keyvalue_map', {x.name: x for x in keyvalues})
+
+    @classmethod
+    def from_json(cls, name: str, desc: NodeType, base: 'OperatorDesc | None' = None) -> 'OperatorDesc':
+        """
+        Compile an operator from its manifest JSON, appending the inputs, outputs and keyvalues of base
+        """
+        inputs = tuple(PortDesc.from_json(x) for x in desc['inputs'])
+        outputs = tuple(PortDesc.from_json(x) for x in desc['outputs'])
+        keyvalues = tuple(KeyValueDesc.from_json(x) for x in desc['keyvalues'])
+        if base is not None:
+            inputs += base.inputs
+            outputs += base.outputs
+            keyvalues += base.keyvalues
+        return cls(name, desc.get('category'), inputs, outputs, keyvalues)
+
+
 class Manifest:
     """
     A game-specific manifest
     Describes all available nodes, their inputs, outputs and keyvalues
     """
-    def __init__(self, file: str):
+    def __init__(self, file: str, use_cache: bool = True):
         self.manifest = file
         self._categories = set()
-        self._load_manifest()
+        if not use_cache or not self._load_cache():
+            self._load_manifest()
+            if use_cache:
+                self._save_cache()
 
     def _load_manifest(self) -> None:
         with open(self.manifest, 'r') as fp:
-            self.nodes: dict = json.load(fp)
-            self.baseNode = self.node_type('__base')
-            
-            if self.baseNode is None:
-                return
-
-            # Unify __base with all other node types
-            for k in self.nodes.keys():
-                if k == '__base':
-                    continue
-                n = self.nodes[k]
-                n['keyvalues'] += self.baseNode['keyvalues']
-                n['outputs'] += self.baseNode['outputs']
-                n['inputs'] += self.baseNode['inputs']
-                if 'category' in n:
-                    self._categories.add(n['category'])
-                self.nodes[k] = n
-
-    def node_type(self, type: str) -> NodeType|None:
-        return self.node_types()[type] if type in self.node_types() else None
-
-    def node_types(self) -> Dict[str, NodeType]:
+            raw: dict = json.load(fp)
+
+        base = raw.get('__base')
+        self.baseNode = OperatorDesc.from_json('__base', base) if base is not None else None
+
+        # Unify __base with all other node types
+        self.nodes: Dict[str, OperatorDesc] = {}
+        for k, v in raw.items():
+            if k == '__base':
+                continue
+            self.nodes[k] = OperatorDesc.from_json(k, v, self.baseNode)
+            if self.nodes[k].category is not None:
+                self._categories.add(self.nodes[k].category)
+
+    def _cache_key(self) -> Tuple[str, int, int]:
+        st = os.stat(self.manifest)
+        return (os.path.abspath(self.manifest), st.st_mtime_ns, st.st_size)
+
+    def _load_cache(self) -> bool:
+        """
+        Load the compiled manifest from the on-disk cache
+
+        Returns
+        -------
+        bool :
+            True if a valid cache entry was found
+        """
+        try:
+            key = self._cache_key()
+            with open(_cache_file(key[0]), 'rb') as fp:
+                cached = pickle.load(fp)
+            if cached['version'] != _CACHE_VERSION or cached['key'] != key:
+                return False
+            self.baseNode = cached['base']
+            self.nodes = cached['nodes']
+            self._categories = cached['categories']
+            return True
+        except Exception:
+            # Missing, stale or unreadable cache. Fall back to the JSON
+            return False
+
+    def _save_cache(self) -> None:
+        """Write the compiled manifest to the on-disk cache, failures are ignored"""
+        try:
+            key = self._cache_key()
+            file = _cache_file(key[0])
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            tmp = f'{file}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as fp:
+                pickle.dump({
+                    'version': _CACHE_VERSION,
+                    'key': key,
+                    'base': self.baseNode,
+                    'nodes': self.nodes,
+                    'categories': self._categories,
+                }, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, file)
+        except OSError:
+            pass
+
+    def node_type(self, type: str) -> OperatorDesc | None:
+        return self.nodes.get(type)
+
+    def node_types(self) -> Dict[str, OperatorDesc]:
         return self.nodes
 
-    def input_desc(self, type: str) -> list[NodeInputType]:
-        return self.nodes[type]['inputs']
+    def input_desc(self, type: str) -> Tuple[PortDesc, ...]:
+        return self.nodes[type].inputs
 
-    def output_desc(self, type: str) -> list[NodeOutputType]:
-        return self.nodes[type]['outputs']
+    def output_desc(self, type: str) -> Tuple[PortDesc, ...]:
+        return self.nodes[type].outputs
 
-    def keyvalue_desc(self, type: str) -> list[NodeKeyValueType]:
-        return self.nodes[type]['keyvalues']
+    def keyvalue_desc(self, type: str) -> Tuple[KeyValueDesc, ...]:
+        return self.nodes[type].keyvalues
 
     def categories(self) -> set[str]:
         return self._categories
 
-                
+
+# Bump when the descriptor classes change
+_CACHE_VERSION = 1
+
+
+def cache_dir() -> str:
+    """
+    Directory holding compiled manifests
+    Can be overridden with the SOUNDEDIT_CACHE_DIR environment variable
+    """
+    if 'SOUNDEDIT_CACHE_DIR' in os.environ:
+        return os.environ['SOUNDEDIT_CACHE_DIR']
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'soundedit')
+
+
+def _cache_file(manifest: str) -> str:
+    # The full path is also stored in the cache and checked on load, so collisions are harmless
+    name = zlib.crc32(manifest.encode('utf-8'))
+    return os.path.join(cache_dir(), f'manifest-{name:08x}.pickle')
+
+
+"""Manifest files for each game. Loaded on first use, see load_game()"""
 GAMES = {
-    'strata': Manifest(os.path.dirname(__file__) + '/games/strata.json')
+    'strata': os.path.dirname(__file__) + '/games/strata.json'
 }
-_current = GAMES['strata']
+_loaded: Dict[str, Manifest] = {}
+_current = 'strata'
+
+
+def load_game(name: str) -> Manifest:
+    """Returns the manifest for a game, loading it if required"""
+    m = _loaded.get(name)
+    if m is None:
+        m = _loaded[name] = Manifest(GAMES[name])
+    return m
 
 
 def set_current(name: str):
     global _current
-    _current = GAMES[name]
+    if name not in GAMES:
+        raise KeyError(name)
+    _current = name
 
 
 def current() -> Manifest:
-    global _current
-    return _current
+    return load_game(_current)
 
-def node_types() -> Dict[str, NodeType]:
+def node_types() -> Dict[str, OperatorDesc]:
     return current().nodes
-
-def color_for_type(type: str) -> Tuple[int, int, int]:
-    match type:
-        case 'vec3':
-            return (0, 255, 0)
-        case 'float':
-            return (255, 255, 0)
-        case 'speakers':
-            return (255, 0, 0)
-        case 'vec3x8':
-            return (255, 0, 255)
-        case _:
-            raise Exception('Invalid type name')
@@ -0,0 +1,415 @@
+"""
+Data model of operator stack files
+
+A compact representation of stacks for editing: each OperatorStack holds its
+OperatorInstances by name, with their keyvalues and input constants as written in the
+file, and their connections as edge lists in both directions. Names, keys and values are
+interned, since the same few strings repeat across every stack. SoundOperatorGraph is a
+view of an OperatorStack: edits made in the graph are applied to the model, and stacks
+are serialised from the model. This module does not depend on Qt.
+"""
+
+import sys
+
+from typing import Dict, Iterable, Iterator, Mapping
+
+from vdf import VDFDict
+
+from . import keyvalues, manifest
+from .imports import ImportResolver, Nodes
+from .manifest import KeyValueDesc, Manifest, OperatorDesc
+from .utils import str_bool
+
+_intern = sys.intern
+
+
+def keyvalue_default(kv: KeyValueDesc) -> str | bool:
+    """Initial value of a keyvalue, bools are returned as bool"""
+    match kv.type:
+        case 'bool' | 'implicit_bool':
+            return str_bool(kv.default) if kv.default is not None else False
+        case 'enum':
+            return kv.default if kv.default is not None else kv.choices[0]
+        case _:
+            return kv.default if kv.default is not None else ''
+
+
+def value_text(value: str | bool) -> str:
+    """Text of a value, as written in a stack file"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def same_value(text: str, value: str | bool) -> bool:
+    """Returns True if the text from a stack file has the same meaning as a value"""
+    if isinstance(value, bool):
+        return str_bool(text) == value
+    return text == value
+
+
+class Connection:
+    """An output of one node connected to an input of another"""
+    __slots__ = ('source', 'output', 'target', 'input')
+
+    def __init__(self, source: str, output: str, target: str, input: str):
+        self.source = source
+        self.output = output
+        self.target = target
+        self.input = input
+
+    def reference(self) -> str:
+        """The connection as written in the target node, i.e. @node.output"""
+        return f'@{self.source}.{self.output}'
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Connection) and (self.source, self.output, self.target, self.input) == \
+            (other.source, other.output, other.target, other.input)
+
+    def __hash__(self) -> int:
+        return hash((self.source, self.output, self.target, self.input))
+
+    def __repr__(self) -> str:
+        return f'Connection({self.source}.{self.output} -> {self.target}.{self.input})'
+
+
+class OperatorInstance:
+    """A single node of a stack"""
+    __slots__ = ('name', 'operator', 'values', 'inputs', 'outputs')
+
+    def __init__(self, name: str, operator: str | None):
+        self.name = name
+        self.operator = operator
+        # Keyvalues and input constants, and any other key which isn't a connection
+        self.values: Dict[str, str] = {}
+        # Input name -> connection into it
+        self.inputs: Dict[str, Connection] = {}
+        # Connections from this node's outputs
+        self.outputs: list[Connection] = []
+
+    def __repr__(self) -> str:
+        return f'OperatorInstance({self.name}: {self.operator})'
+
+
+class OperatorStack:
+    """
+    The nodes of a single operator stack, with its imports merged
+
+    Parameters
+    ----------
+    section : str
+        Section of the file the stack is in, i.e. update_stacks
+    name : str
+        Name of the stack
+    m : Manifest | None
+        The manifest, defaults to the current one
+    """
+    __slots__ = ('section', 'name', 'nodes', 'manifest')
+
+    def __init__(self, section: str, name: str, m: Manifest | None = None):
+        self.section = section
+        self.name = name
+        self.nodes: Dict[str, OperatorInstance] = {}
+        self.manifest = m if m is not None else manifest.current()
+
+    @classmethod
+    def from_nodes(cls, section: str, name: str, nodes: Mapping[str, Mapping[str, str]],
+                   m: Manifest | None = None) -> 'OperatorStack':
+        """
+        Build the model of a stack from its merged nodes, see ImportResolver.merged.
+        References to unknown nodes or outputs are kept as values
+        """
+        stack = cls(section, name, m)
+        operators = stack.manifest.node_types()
+        links = []
+        for node, block in nodes.items():
+            op = block.get('operator')
+            inst = stack.add(node, op)
+            desc = operators.get(op)
+            for key, value in block.items():
+                if key == 'operator':
+                    continue
+                if value.startswith('@') and desc is not None and key in desc.input_map:
+                    links.append((node, key, value))
+                else:
+                    inst.values[_intern(key)] = _intern(value)
+
+        for node, key, value in links:
+            source, _, output = value[1:].partition('.')
+            desc = operators.get(nodes[source].get('operator')) if source in nodes else None
+            if desc is not None and output in desc.output_map:
+                stack.connect(source, output, node, key)
+            else:
+                stack.nodes[node].values[_intern(key)] = _intern(value)
+        return stack
+
+    @classmethod
+    def from_dict(cls, section: str, name: str, stack: Mapping, imports: ImportResolver | Mapping,
+                  m: Manifest | None = None) -> 'OperatorStack':
+        """Build the model of a stack as written in a file, merging its imports"""
+        resolver = imports if isinstance(imports, ImportResolver) else ImportResolver(imports, section)
+        if name in resolver.stacks and resolver.stacks[name] is stack:
+            return cls.from_nodes(section, name, resolver.merged(name), m)
+        return cls.from_nodes(section, name, resolver.merge(stack), m)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.nodes
+
+    def __getitem__(self, name: str) -> OperatorInstance:
+        return self.nodes[name]
+
+    def desc(self, name: str) -> OperatorDesc | None:
+        """The operator type of a node, None if the manifest doesn't know it"""
+        return self.manifest.node_types().get(self.nodes[name].operator)
+
+    def add(self, name: str, operator: str | None, values: Iterable[tuple[str, str]] = ()) -> OperatorInstance:
+        """Add a node, replacing any node of the same name"""
+        if name in self.nodes:
+            self.remove(name)
+        inst = self.nodes[name] = OperatorInstance(_intern(name), _intern(operator) if operator else operator)
+        for key, value in values:
+            inst.values[_intern(key)] = _intern(value)
+        return inst
+
+    def remove(self, name: str) -> None:
+        """Remove a node along with its connections"""
+        inst = self.nodes.get(name)
+        if inst is None:
+            return
+        for c in list(inst.inputs.values()):
+            self.disconnect(c.target, c.input)
+        for c in list(inst.outputs):
+            self.disconnect(c.target, c.input)
+        del self.nodes[name]
+
+    def rename(self, old: str, new: str) -> None:
+        """Rename a node, updating the connections to and from it"""
+        inst = self.nodes.pop(old, None)
+        if inst is None or old == new:
+            if inst is not None:
+                self.nodes[old] = inst
+            return
+        inst.name = _intern(new)
+        self.nodes[inst.name] = inst
+        for c in inst.inputs.values():
+            c.target = inst.name
+        for c in inst.outputs:
+            c.source = inst.name
+
+    def set_value(self, name: str, key: str, value: str | bool) -> None:
+        """Set a keyvalue or input constant of a node"""
+        self.nodes[name].values[_intern(key)] = _intern(value_text(value))
+
+    def connect(self, source: str, output: str, target: str, input: str) -> Connection:
+        """Connect an output to an input, replacing the input's connection if it has one"""
+        self.disconnect(target, input)
+        c = Connection(_intern(source), _intern(output), _intern(target), _intern(input))
+        self.nodes[target].inputs[c.input] = c
+        self.nodes[source].outputs.append(c)
+        return c
+
+    def disconnect(self, target: str, input: str) -> Connection | None:
+        """Disconnect an input, returns the connection it had"""
+        inst = self.nodes.get(target)
+        c = inst.inputs.pop(input, None) if inst is not None else None
+        if c is not None:
+            source = self.nodes.get(c.source)
+            if source is not None:
+                source.outputs.remove(c)
+        return c
+
+    def connections(self) -> Iterator[Connection]:
+        """Every connection, by target node"""
+        for inst in self.nodes.values():
+            yield from inst.inputs.values()
+
+    def to_nodes(self) -> Nodes:
+        """The nodes as keyvalues, like ImportResolver.merged, i.e. for the validator or evaluator"""
+        out: Nodes = {}
+        for name, inst in self.nodes.items():
+            block = out[name] = {'operator': inst.operator} if inst.operator is not None else {}
+            block.update(inst.values)
+            for key, c in inst.inputs.items():
+                block[key] = c.reference()
+        return out
+
+    def to_dict(self, original: Mapping | None = None, imports: ImportResolver | None = None) -> VDFDict:
+        """
+        Serialise the stack as it's written in a file
+
+        Parameters
+        ----------
+        original : Mapping | None
+            The stack as it was loaded, unmodified. Its layout is kept: import_stack entries,
+            the order of the nodes and their keys, and anything the model doesn't know about
+        imports : ImportResolver | None
+            Resolver of the stack's section, for the stacks named by import_stack. Nodes from
+            imported stacks are only written if they've been changed, with just the changed keys
+
+        Returns
+        -------
+        VDFDict :
+            The stack
+        """
+        imported = imports.imported(original) if original is not None and imports is not None else {}
+
+        out = VDFDict()
+        done = set()
+        for key, value in (keyvalues.pairs(original) if original is not None else []):
+            if not isinstance(value, Mapping):
+                out[key] = value
+            elif key in self.nodes and key not in done:
+                done.add(key)
+                block = self._node_to_dict(key, value, imported.get(key))
+                if block:
+                    out[key] = block
+
+        for name in self.nodes:
+            if name not in done:
+                block = self._node_to_dict(name, None, imported.get(name))
+                if block:
+                    out[name] = block
+        return out
+
+    def _node_to_dict(self, name: str, original: Mapping | None, base: Dict[str, str] | None) -> VDFDict:
+        """
+        Serialise a node. If it came from an imported stack (base), only the keys that differ from
+        the imported definition are returned
+        """
+        if base is None:
+            return self.node_to_dict(name, original)
+
+        loaded = dict(base)
+        if original is not None:
+            loaded.update(keyvalues.pairs(original))
+        block = VDFDict()
+        for key, value in keyvalues.pairs(self.node_to_dict(name, loaded)):
+            if base.get(key) != value:
+                block[key] = value
+        return block
+
+    def node_to_dict(self, name: str, original: Mapping | None = None) -> VDFDict:
+        """
+        Serialise a node as it's written in a stack file
+
+        Parameters
+        ----------
+        name : str
+            Name of the node
+        original : Mapping | None
+            The node as it was loaded. Its key order is kept, as is the text of any value which
+            hasn't changed meaning (i.e. "1" for true) and keys unknown to the manifest. Keys
+            not in the original are only written if they differ from the manifest default
+
+        Returns
+        -------
+        VDFDict :
+            The node's keyvalues. "operator" comes first, unless the original had it elsewhere
+        """
+        inst = self.nodes[name]
+        desc = self.desc(name)
+        values: Dict[str, str | bool] = {}
+        defaults: Dict[str, str | bool] = {}
+        if desc is not None:
+            for i in desc.inputs:
+                c = inst.inputs.get(i.name)
+                if c is not None:
+                    values[i.name] = c.reference()
+                else:
+                    defaults[i.name] = i.default if i.default is not None else ''
+                    values[i.name] = inst.values.get(i.name, defaults[i.name])
+            for kv in desc.keyvalues:
+                defaults[kv.name] = keyvalue_default(kv)
+                text = inst.values.get(kv.name)
+                values[kv.name] = defaults[kv.name] if text is None else \
+                    str_bool(text) if isinstance(defaults[kv.name], bool) else text
+        else:
+            # Unknown operator, written as it was
+            values.update(inst.values)
+            values.update((key, c.reference()) for key, c in inst.inputs.items())
+
+        out = VDFDict()
+        original = keyvalues.pairs(original) if original is not None else []
+        if not any(key == 'operator' for key, _ in original) and inst.operator is not None:
+            out['operator'] = inst.operator
+        written = set()
+        for key, text in original:
+            if key in written:
+                continue
+            if key == 'operator':
+                written.add(key)
+                out[key] = inst.operator
+            elif key in values:
+                written.add(key)
+                out[key] = text if same_value(text, values[key]) else value_text(values[key])
+            else:
+                out[key] = text
+
+        for key, value in values.items():
+            if key not in written and (key not in defaults or value != defaults[key]):
+                out[key] = value_text(value)
+        return out
+
+
+class OperatorStackFile:
+    """
+    The models of the stacks of a file, built from the parsed (or lazily loaded) file
+    when first needed
+
+    Parameters
+    ----------
+    data : Mapping
+        The stack file
+    m : Manifest | None
+        The manifest, defaults to the current one
+    """
+    __slots__ = ('data', 'manifest', '_resolvers', '_stacks')
+
+    def __init__(self, data: Mapping, m: Manifest | None = None):
+        self.data = data
+        self.manifest = m if m is not None else manifest.current()
+        self._resolvers: Dict[str, ImportResolver] = {}
+        self._stacks: Dict[tuple[str, str], OperatorStack] = {}
+
+    def sections(self) -> list[str]:
+        """Names of the sections holding stacks"""
+        return [key for key, value in keyvalues.pairs(self.data) if not isinstance(value, str)]
+
+    def stack_names(self, section: str) -> list[str]:
+        return list(self.data[section]) if section in self.data else []
+
+    def resolver(self, section: str) -> ImportResolver:
+        """The import_stack resolver of a section, built when first needed"""
+        resolver = self._resolvers.get(section)
+        if resolver is None:
+            resolver = self._resolvers[section] = ImportResolver(self.data[section], section)
+        return resolver
+
+    def stack(self, section: str, name: str) -> OperatorStack:
+        """The model of a stack as written in the file. Build a new one with load() to edit it"""
+        stack = self._stacks.get((section, name))
+        if stack is None:
+            stack = self._stacks[(section, name)] = self.load(section, name)
+        return stack
+
+    def load(self, section: str, name: str) -> OperatorStack:
+        """Build a new model of a stack, with its imports merged"""
+        return OperatorStack.from_nodes(section, name, self.resolver(section).merged(name), self.manifest)
+
+    def invalidate(self, section: str, name: str) -> None:
+        """Call when a stack in the file has changed, drops the cached models of its section"""
+        resolver = self._resolvers.get(section)
+        if resolver is not None:
+            resolver.invalidate(name)
+        # Import cycles can change which stacks are affected, models are cheap to rebuild
+        for key in [key for key in self._stacks if key[0] == section]:
+            del self._stacks[key]
+
+    def stacks(self) -> Iterator[OperatorStack]:
+        """Models of every stack in the file"""
+        for section in self.sections():
+            for name in self.data[section]:
+                yield self.stack(section, name)
@@ -1,21 +1,229 @@
 
 from NodeGraphQt import (
-    BaseNode, Port
+    BaseNode, NodeGraph, Port
 )
-from NodeGraphQt.widgets.node_widgets import (
-    NodeLineEdit, NodeBaseWidget, NodeComboBox, NodeCheckBox
+from NodeGraphQt.constants import (
+    LayoutDirectionEnum, NodePropWidgetEnum
 )
+from NodeGraphQt.qgraphics.node_base import NodeItem
 
+from PySide6.QtCore import (
+    Qt, QPointF, QRectF
+)
 from PySide6.QtWidgets import (
-    QLineEdit
+    QLineEdit, QGraphicsItem, QGraphicsProxyWidget, QMenu
 )
 from PySide6.QtGui import (
-    QDoubleValidator
+    QDoubleValidator, QColor, QCursor, QFont, QFontMetricsF
 )
 
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
 from . import manifest
 from .utils import str_bool
-from .types import NodeKeyValueType
+from .manifest import KeyValueDesc
+from .model import keyvalue_default, value_text
+
+
+class OperatorNodeItem(NodeItem):
+    """
+    Node item for operators
+    Input constants and keyvalues are painted as plain text rows below the ports, rather than
+    embedding a widget for each of them. A real editor is only created when a row is double clicked
+    """
+
+    ROW_PADDING = 6.0
+    MAX_ROW_WIDTH = 240.0
+
+    def __init__(self, name='node', parent=None):
+        super().__init__(name, parent)
+        # name -> (kind, choices), kind is one of 'text', 'bool' or 'enum'
+        self._fields: Dict[str, Tuple[str, Tuple[str, ...] | None]] = {}
+        self._disabled_fields: set[str] = set()
+        self._rows_offset = 0.0
+        self._editor: QGraphicsProxyWidget | None = None
+        self._font = QFont()
+        self._font.setPointSize(8)
+        self._metrics = QFontMetricsF(self._font)
+        self._row_height = self._metrics.height() + 2.0
+        # Returns the current value of a field, set by the owning node
+        self.get_value: Callable[[str], object] = lambda name: None
+        # Called with (name, value) when the user edits a field
+        self.value_edited: Callable[[str, object], None] = lambda name, value: None
+        # While set, draw_node() does nothing. NodeItem redraws after every port is added
+        self.hold_draw = False
+
+    @contextmanager
+    def _quiet_ports(self) -> Iterator[None]:
+        """
+        Ports ask for scene position changes so they can redraw their pipes, and Qt handles
+        every move by checking each item in the scene that does so. Moving a node or laying
+        out its ports is then linear in the size of the scene. Turn that off meanwhile and
+        redraw the pipes once at the end
+        """
+        ports = self.inputs + self.outputs
+        for p in ports:
+            p.setFlag(QGraphicsItem.ItemSendsScenePositionChanges, False)
+        try:
+            yield
+        finally:
+            for p in ports:
+                p.setFlag(QGraphicsItem.ItemSendsScenePositionChanges, True)
+                p.redraw_connected_pipes()
+
+    def draw_node(self):
+        if self.hold_draw:
+            return
+        with self._quiet_ports():
+            super().draw_node()
+
+    def place(self, x: float, y: float) -> None:
+        """Move the node, used when laying out many nodes at once"""
+        with self._quiet_ports():
+            self.setPos(x, y)
+
+    def add_field(self, name: str, kind: str, choices: Tuple[str, ...] | None = None) -> None:
+        """
+        Add a row displaying a value
+        
+        Parameters
+        ----------
+        name : str
+            Name of the node property backing this row
+        kind : str
+            'text', 'bool' or 'enum'
+        choices : Tuple[str, ...] | None
+            Valid values of an enum
+        """
+        self._fields[name] = (kind, choices)
+
+    def fields(self) -> Iterable[str]:
+        """Names of the fields, in the order they're displayed"""
+        return self._fields.keys()
+
+    def has_field(self, name: str) -> bool:
+        return name in self._fields
+
+    def field_kind(self, name: str) -> str | None:
+        f = self._fields.get(name)
+        return f[0] if f is not None else None
+
+    def set_field_enabled(self, name: str, enabled: bool) -> None:
+        """Disabled fields are drawn greyed out and can't be edited (i.e. connected inputs)"""
+        if enabled:
+            self._disabled_fields.discard(name)
+        else:
+            self._disabled_fields.add(name)
+        self.update()
+
+    def _row_text(self, name: str) -> str:
+        value = self.get_value(name)
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        if name in self._disabled_fields:
+            value = '(connected)'
+        return f'{name}: {value if value is not None else ""}'
+
+    def _rows_visible(self) -> bool:
+        return self.layout_direction is LayoutDirectionEnum.HORIZONTAL.value and bool(self._fields)
+
+    def _calc_size_horizontal(self):
+        width, height = super()._calc_size_horizontal()
+        self._rows_offset = height
+        if self._fields:
+            text_w = max(self._metrics.horizontalAdvance(self._row_text(x)) for x in self._fields)
+            width = max(width, min(text_w, self.MAX_ROW_WIDTH) + self.ROW_PADDING * 2)
+            height += self._row_height * len(self._fields) + 4.0
+        return width, height
+
+    def _row_rect(self, index: int) -> QRectF:
+        top = self._text_item.boundingRect().height() + 4.0 + self._rows_offset + index * self._row_height
+        return QRectF(self.ROW_PADDING, top, self._width - self.ROW_PADDING * 2, self._row_height)
+
+    def _field_at(self, pos: QPointF) -> str | None:
+        if not self._rows_visible():
+            return None
+        for index, name in enumerate(self._fields):
+            if self._row_rect(index).contains(pos):
+                return name
+        return None
+
+    def paint(self, painter, option, widget):
+        super().paint(painter, option, widget)
+        if self._proxy_mode or not self._rows_visible():
+            return
+
+        painter.save()
+        painter.setFont(self._font)
+        color = QColor(*self.text_color)
+        disabled_color = QColor(color)
+        disabled_color.setAlpha(100)
+        for index, name in enumerate(self._fields):
+            rect = self._row_rect(index)
+            painter.setPen(disabled_color if name in self._disabled_fields else color)
+            text = self._metrics.elidedText(self._row_text(name), Qt.TextElideMode.ElideRight, rect.width())
+            painter.drawText(rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, text)
+        painter.restore()
+
+    def mouseDoubleClickEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton and not self.disabled:
+            name = self._field_at(event.pos())
+            if name is not None:
+                if name not in self._disabled_fields:
+                    self.edit_field(name)
+                event.accept()
+                return
+        super().mouseDoubleClickEvent(event)
+
+    def edit_field(self, name: str) -> None:
+        """
+        Start editing a field. Bools are toggled, enums pick from a menu and
+        everything else gets a line edit over the row, which is destroyed once editing is finished
+        """
+        self.close_editor()
+        kind, choices = self._fields[name]
+        match kind:
+            case 'bool':
+                self.value_edited(name, not self.get_value(name))
+            case 'enum':
+                menu = QMenu()
+                for choice in choices or ():
+                    menu.addAction(choice)
+                action = menu.exec(QCursor.pos())
+                if action is not None:
+                    self.value_edited(name, action.text())
+            case _:
+                rect = self._row_rect(list(self._fields).index(name))
+                edit = QLineEdit()
+                edit.setFont(self._font)
+                value = self.get_value(name)
+                edit.setText(str(value) if value is not None else '')
+                edit.selectAll()
+
+                proxy = QGraphicsProxyWidget(self)
+                proxy.setWidget(edit)
+                proxy.setGeometry(rect)
+                proxy.setZValue(self.zValue() + 1)
+                self._editor = proxy
+
+                def commit():
+                    if self._editor is not proxy:
+                        return # Already committed
+                    self.close_editor()
+                    self.value_edited(name, edit.text())
+                edit.editingFinished.connect(commit)
+
+                proxy.setFocus()
+                edit.setFocus()
+
+    def close_editor(self) -> None:
+        """Destroy the active editor widget, if any"""
+        proxy, self._editor = self._editor, None
+        if proxy is not None:
+            if proxy.scene() is not None:
+                proxy.scene().removeItem(proxy)
+            proxy.deleteLater()
 
 
 class OperatorNode(BaseNode):
@@ -27,133 +235,166 @@ class OperatorNode(BaseNode):
 
     NODE_NAME = 'new operator'
     __identifier__ = 'io.soundedit.operators'
+    opType_: str|None = None
 
 
     def __init__(self, type: str|None = None):
-        super().__init__()
+        super().__init__(OperatorNodeItem)
         self.in_ports = {}
         self.out_ports = {}
-        self.type = type
+        self.type = type if type is not None else self.opType_
+        self.view.get_value = self.model.get_property
+        self.view.value_edited = lambda name, value: self.set_property(name, value)
 
 
-    def _create_input_widget(self, kv: NodeKeyValueType):
+    def _create_field(self, kv: KeyValueDesc):
         """
-        Create input widget for specified type
+        Create the property and displayed row for a keyvalue
         
         Parameters
         ----------
-        type : dict
-            Dict representing the type
-        """
-        match kv['type']:
-            case 'string':
-                self.add_text_input(
-                    name=kv['name'],
-                    label=kv['name'],
-                    text=kv['default'] if 'default' in kv else ''
-                )
-            case 'implicit_bool':
-                self.add_checkbox(
-                    name=kv['name'],
-                    label=kv['name'],
-                    state=str_bool(kv['default']) if 'default' in kv else False
-                )
-            case 'bool':
-                self.add_checkbox(
-                    name=kv['name'],
-                    label=kv['name'],
-                    state=str_bool(kv['default']) if 'default' in kv else False
+        kv : KeyValueDesc
+            The keyvalue to create a field for
+        """
+        match kv.type:
+            case 'bool' | 'implicit_bool':
+                self.create_property(
+                    kv.name,
+                    keyvalue_default(kv),
+                    widget_type=NodePropWidgetEnum.QCHECK_BOX.value
                 )
+                self.view.add_field(kv.name, 'bool')
             case 'enum':
-                self.add_combo_menu(
-                    name=kv['name'],
-                    label=kv['name'],
-                    items=kv['choices']
+                self.create_property(
+                    kv.name,
+                    keyvalue_default(kv),
+                    items=list(kv.choices),
+                    widget_type=NodePropWidgetEnum.QCOMBO_BOX.value
+                )
+                self.view.add_field(kv.name, 'enum', kv.choices)
+            case _:
+                self.create_property(
+                    kv.name,
+                    keyvalue_default(kv),
+                    widget_type=NodePropWidgetEnum.QLINE_EDIT.value
                 )
+                self.view.add_field(kv.name, 'text')
 
                 
-    def set_widget_value(self, widget_name: str, value: str) -> bool:
+    def set_widget_value(self, widget_name: str, value: str, push_undo: bool = True) -> bool:
         """
-        Set a named widget's value
+        Set a named keyvalue or input constant
         
         Parameters
         ----------
         widget_name : str
-            Name of the widget to lookup
+            Name of the keyvalue
         value : str
-            Value of the widget. This will be automatically converted to the required type depending on the widget
+            Value of the keyvalue. This will be automatically converted to the required type depending on the keyvalue
+        push_undo : bool
+            Register the change on the undo stack
         """
-        w: NodeBaseWidget = self.get_widget(widget_name)
-        if w is None:
+        kind = self.view.field_kind(widget_name)
+        if kind is None:
             return False
 
-        if isinstance(w, NodeCheckBox):
-            w.set_value(str_bool(value))
-        else:
-            w.set_value(value)
+        self.set_property(widget_name, str_bool(value) if kind == 'bool' else value, push_undo=push_undo)
         return True
 
 
-    def set_type(self, type: str):
+    def load_values(self, values: Iterable[tuple[str, str]]):
+        """
+        Set many keyvalues and input constants at once, i.e. when loading a stack
+        The node model is written directly: no undo commands or property_changed signals,
+        and the node is only redrawn once
+        
+        Parameters
+        ----------
+        values : Iterable[tuple[str, str]]
+            (name, value) pairs. Names without a field are ignored
+        """
+        for name, value in values:
+            kind = self.view.field_kind(name)
+            if kind is None:
+                continue
+            self.model.set_property(name, str_bool(value) if kind == 'bool' else value)
+        self.view.draw_node()
+
+
+    def field_values(self) -> Iterator[tuple[str, str]]:
+        """(name, value) of each keyvalue and input constant, as written in a stack file"""
+        for name in self.view.fields():
+            yield name, value_text(self.get_property(name))
+
+
+    def set_type(self, type: str, values: Iterable[tuple[str, str]] = ()):
         """
         Sets the node type
-        This will create all input and output ports, and any embedded widgets
+        This will create all input and output ports, and the properties for input constants and keyvalues
         
         Parameters
         ----------
         type : str
             Name of the backing node type, looked up within the manifest
+        values : Iterable[tuple[str, str]]
+            Initial keyvalues and input constants, see load_values()
         """
-        layout = manifest.current().node_types()[type]
+        layout = manifest.current().node_type(type)
         self.type = type
         
         self.in_ports = {}
         self.out_ports = {}
+        self.view.hold_draw = True
 
-        for o in layout['outputs']:
-            print(o)
-            name = o['name']
-            self.out_ports[name] = self.add_output(
-                name=name,
-                color=manifest.color_for_type(o['type'])
+        for o in layout.outputs:
+            self.out_ports[o.name] = self.add_output(
+                name=o.name,
+                color=o.color
             )
 
-        for i in layout['inputs']:
-            name = i['name']
+        for i in layout.inputs:
+            name = i.name
             self.in_ports[name] = self.add_input(
                 name=name,
-                color=manifest.color_for_type(i['type'])
+                color=i.color
             )
-            self.add_text_input(
-                name=name,
-                label=name,
-                tab=name,
-                text='1.0' # TODO: Defaults!!!
+            self.create_property(
+                name,
+                i.default if i.default is not None else '',
+                widget_type=NodePropWidgetEnum.QLINE_EDIT.value,
+                tab='Inputs'
             )
+            self.view.add_field(name, 'text')
             
-        for kv in layout['keyvalues']:
-            self._create_input_widget(kv)
+        for kv in layout.keyvalues:
+            self._create_field(kv)
+
+        self.view.hold_draw = False
+        self.load_values(values)
 
 
     def on_input_connected(self, in_port: Port, out_port: Port):
         """
         Called when an input is connected
         """
-        w: QLineEdit = self.get_widget(in_port.name()).get_custom_widget()
-        w.setDisabled(True)
+        self.view.set_field_enabled(in_port.name(), False)
         return super().on_input_connected(in_port, out_port)
 
 
     def on_input_disconnected(self, in_port, out_port):
-        w: QLineEdit = self.get_widget(in_port.name()).get_custom_widget()
-        w.setDisabled(False)
+        self.view.set_field_enabled(in_port.name(), True)
         return super().on_input_disconnected(in_port, out_port)
 
 
-    def set_input_const(self, input: str, value: str):
+    def on_property_changed(self, name: str):
+        """Called by the graph when a property has changed, including through undo/redo"""
+        if self.view.has_field(name):
+            self.view.draw_node()
+
+
+    def set_input_const(self, input: str, value: str, push_undo: bool = True):
         """
         Set an input constant for the specified input
-        This will set the line edit's value
         
         Parameters
         ----------
@@ -161,9 +402,10 @@ class OperatorNode(BaseNode):
             Input name
         value : str
             Value text
+        push_undo : bool
+            Register the change on the undo stack
         """
-        w: QLineEdit = self.get_widget(input).get_custom_widget()
-        w.setText(value)
+        self.set_property(input, value, push_undo=push_undo)
 
 
 
@@ -175,26 +417,48 @@ class OperatorNode(BaseNode):
         return self.out_ports[name]
 
 
-    def __new__(metacls, typ: str|None = None):
-        """
-        Returns new instance of OperatorNode.
-        Generates a new metatype with a unique name so we can use this single class
-        for multiple node types, dynamically added via the manifest.
-        
-        Parameters
-        ----------
-        typ : str
-            The type of the operator node
-        """
-        if typ is not None:
-            # Generate new type
-            metacls = type(f'Operator_{typ}', (OperatorNode,), {
-                'opType_': typ,
-                '__identifier__': f'io.soundedit.operators'
-            })
-        
-        c = object.__new__(metacls)
-        return c
+# Generated operator node classes for each manifest
+_operator_classes: Dict[manifest.Manifest, list[type[OperatorNode]]] = {}
+
+
+def operator_node_class(typ: str) -> type[OperatorNode]:
+    """
+    Generates a new OperatorNode subclass for an operator type.
+    The class is named Operator_<type>, so it registers as io.soundedit.operators.Operator_<type>
+    
+    Parameters
+    ----------
+    typ : str
+        The type of the operator node
+    """
+    return type(f'Operator_{typ}', (OperatorNode,), {
+        'NODE_NAME': typ,
+        'opType_': typ,
+        '__identifier__': 'io.soundedit.operators'
+    })
+
+
+def operator_node_classes(m: manifest.Manifest | None = None) -> list[type[OperatorNode]]:
+    """
+    Returns the generated node classes for every operator type in a manifest.
+    Classes are built once per manifest and shared by every graph
+    
+    Parameters
+    ----------
+    m : Manifest | None
+        The manifest, defaults to the current one
+    """
+    if m is None:
+        m = manifest.current()
+    classes = _operator_classes.get(m)
+    if classes is None:
+        classes = _operator_classes[m] = [operator_node_class(t) for t in m.node_types()]
+    return classes
+
+
+def register_operator_nodes(graph: NodeGraph) -> None:
+    """Register all node types for the current manifest with a graph"""
+    graph.register_nodes(operator_node_classes() + [FloatConstNode])
 
 
 class FloatConstNode(BaseNode):
@@ -0,0 +1,237 @@
+"""
+Static optimisation of operator stacks
+
+Each stack is analysed on its dependency DAG (with imports merged) in a single pass in
+evaluation order:
+
+* Constant folding: operators which only depend on literal inputs are evaluated with
+  the evaluator and their outputs replaced by the result
+* Redundant operators: math operators which pass an input straight through (add 0,
+  mult by 1, set) and duplicates of an earlier operator with identical inputs
+* Dead operators: anything whose outputs never reach an operator with side effects,
+  i.e. sys_output, set_opvar_float or set_convar
+
+The optimised stack has the imports inlined, since imported nodes can't be removed
+from a stack which imports them. This module does not depend on Qt.
+"""
+
+import math
+
+from typing import Dict, Iterator, Mapping, NamedTuple
+
+import numpy as np
+from vdf import VDFDict
+
+from . import evaluator, keyvalues, manifest
+from .manifest import Manifest, OperatorDesc
+from .imports import ImportResolver
+
+
+# Operators with outputs, which also change game state
+_SIDE_EFFECTS = frozenset(('sys_stop_entries', 'increment_opvar_float', 'track_queue'))
+
+# Evaluated operators which can't be folded, their results change between updates
+_VOLATILE = frozenset(('math_random', 'math_delta', 'math_float_filter'))
+
+# Pure operators which return one of their inputs unchanged, for
+# apply -> (identity of input2, whether input1 may be the identity instead)
+_IDENTITIES = {
+    'add': (0.0, True), 'sub': (0.0, False), 'mult': (1.0, True), 'div': (1.0, False), 'pow': (1.0, False)
+}
+_PASS_THROUGH = frozenset(('math_float', 'math_vec3', 'math_speakers'))
+
+
+class StackReport(NamedTuple):
+    """Result of analysing a single stack"""
+    section: str
+    stack: str
+    # Number of nodes, with imports merged
+    nodes: int
+    # Nodes which don't contribute to any side effect, before any rewrites
+    dead: list[str]
+    # Node -> output -> constant value
+    folded: Dict[str, Dict[str, str]]
+    # Node -> the reference or constant its output is replaced by
+    redundant: Dict[str, str]
+    # Nodes left after optimising
+    remaining: int
+    # Set when the stack couldn't be compiled, folding and redundancy are skipped
+    error: str | None = None
+
+    def savings(self) -> int:
+        return self.nodes - self.remaining
+
+
+def _format(value: np.ndarray) -> str | None:
+    """Constant text for an evaluated output, None if it can't be written as one"""
+    values = np.ravel(value)
+    if not all(math.isfinite(x) for x in values):
+        return None
+    return ' '.join(f'{x:.9g}' for x in values)
+
+
+def _references(block: Mapping[str, str]) -> Iterator[str]:
+    """Names of the nodes a node reads from"""
+    for key, value in block.items():
+        if value.startswith('@'):
+            yield value[1:].partition('.')[0]
+        elif key == 'iterate_operator':
+            yield value
+
+
+def _live(nodes: Mapping[str, Mapping[str, str]], operators: Dict[str, OperatorDesc]) -> set[str]:
+    """Nodes which contribute to a side effect"""
+    live = set()
+    todo = []
+    for node, block in nodes.items():
+        desc = operators.get(block.get('operator'))
+        # Unknown operators are kept, they may well have side effects
+        if desc is None or not desc.outputs or desc.name in _SIDE_EFFECTS:
+            live.add(node)
+            todo.append(node)
+    while todo:
+        for other in _references(nodes[todo.pop()]):
+            if other in nodes and other not in live:
+                live.add(other)
+                todo.append(other)
+    return live
+
+
+def _equals(value: str | None, test) -> bool:
+    """True if value is a constant, and test is true for all of its elements"""
+    if value is None or value.startswith('@'):
+        return False
+    try:
+        return all(test(float(x)) for x in value.split())
+    except ValueError:
+        return False
+
+
+def _pass_through(desc: OperatorDesc, block: Mapping[str, str]) -> str | None:
+    """The input a math operator returns unchanged, if any"""
+    if desc.name not in _PASS_THROUGH or not _equals(block.get('input_execute', '1'), lambda x: x > 0):
+        return None
+    apply = block.get('apply', 'none')
+    a, b = block.get('input1'), block.get('input2')
+    if apply == 'set':
+        return a
+    identity = _IDENTITIES.get(apply)
+    if identity is None:
+        return None
+
+    def is_identity(value: str | None) -> bool:
+        return _equals(value, lambda x: x == identity[0])
+
+    if is_identity(b):
+        return a
+    if identity[1] and is_identity(a):
+        return b
+    return None
+
+
+def analyse_nodes(nodes: Mapping[str, Mapping[str, str]], m: Manifest | None = None,
+                  section: str = '', stack: str = '') -> tuple[StackReport, Dict[str, Dict[str, str]]]:
+    """
+    Analyse and optimise the merged nodes of a stack
+
+    Returns
+    -------
+    tuple[StackReport, Dict[str, Dict[str, str]]] :
+        The report, and the optimised nodes in their original order
+    """
+    operators = (m or manifest.current()).node_types()
+    live = _live(nodes, operators)
+    dead = [node for node in nodes if node not in live]
+
+    try:
+        program = evaluator.compile_nodes(nodes, m)
+    except evaluator.EvaluationError as e:
+        optimised = {node: dict(block) for node, block in nodes.items() if node in live}
+        return StackReport(section, stack, len(nodes), dead, {}, {}, len(optimised), str(e)), optimised
+
+    # Nodes driven by an iterator run once per iteration, they must stay as they are
+    iterated = {block['iterate_operator'] for block in nodes.values() if 'iterate_operator' in block}
+    constant = set(program.constant_nodes(_VOLATILE)) - iterated
+    # Constant nodes only read from each other, so they can run on their own
+    values = evaluator.Program([s for s in program.steps if s.node in constant]).run(count=1).values if constant else {}
+
+    # "@node.output" -> replacement text, applied as nodes are visited in evaluation order
+    alias: Dict[str, str] = {}
+    folded: Dict[str, Dict[str, str]] = {}
+    redundant: Dict[str, str] = {}
+    seen: Dict[tuple, str] = {}
+    rewritten: Dict[str, Dict[str, str]] = {}
+    for step in program.steps:
+        node, desc = step.node, step.desc
+        block = {k: alias.get(v, v) for k, v in nodes[node].items()}
+        rewritten[node] = block
+        if node not in live or node in iterated or not desc.outputs or desc.name in _SIDE_EFFECTS:
+            continue
+
+        # Speakers have no literal form in stack files
+        if node in constant and all(p.type != 'speakers' for p in desc.outputs):
+            outputs = {p.name: _format(values[f'{node}.{p.name}'][0]) for p in desc.outputs}
+            if all(v is not None for v in outputs.values()):
+                folded[node] = outputs
+                alias.update((f'@{node}.{k}', v) for k, v in outputs.items())
+                continue
+
+        source = _pass_through(desc, block)
+        if source is not None:
+            redundant[node] = source
+            alias[f'@{node}.output'] = source
+            continue
+
+        if desc.name not in _VOLATILE and 'iterate_operator' not in block:
+            key = tuple(sorted(block.items()))
+            first = seen.setdefault(key, node)
+            if first != node:
+                redundant[node] = f'@{first}'
+                alias.update((f'@{node}.{p.name}', f'@{first}.{p.name}') for p in desc.outputs)
+
+    remaining = _live(rewritten, operators)
+    optimised = {node: rewritten[node] for node in nodes if node in remaining}
+    report = StackReport(section, stack, len(nodes), dead, folded, redundant, len(optimised))
+    return report, optimised
+
+
+def _to_block(nodes: Dict[str, Dict[str, str]]) -> VDFDict:
+    out = VDFDict()
+    for node, block in nodes.items():
+        b = out[node] = VDFDict()
+        for k, v in block.items():
+            b[k] = v
+    return out
+
+
+def optimise(data: Mapping, m: Manifest | None = None) -> tuple[VDFDict, list[StackReport]]:
+    """
+    Optimise every stack of a parsed (or lazily loaded) stack file
+
+    Parameters
+    ----------
+    data : Mapping
+        The stack file
+    m : Manifest | None
+        The manifest, defaults to the current one
+
+    Returns
+    -------
+    tuple[VDFDict, list[StackReport]] :
+        The optimised file, with imports inlined, and a report per stack
+    """
+    out = VDFDict()
+    reports = []
+    for section, stacks in keyvalues.pairs(data):
+        if isinstance(stacks, str):
+            out[section] = stacks
+            continue
+        imports = ImportResolver(stacks, section)
+        block = out[section] = VDFDict()
+        for name, stack in keyvalues.pairs(stacks):
+            if isinstance(stack, str) or name in block:
+                continue
+            report, nodes = analyse_nodes(imports.merged(name), m, section, name)
+            reports.append(report)
+            block[name] = _to_block(nodes)
+    return out, reports
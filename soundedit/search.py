@@ -0,0 +1,176 @@
+"""
+Inverted index over the stacks of a file
+
+Maps operator types, keyvalue and input values, @node.output references, node names and
+stack names (including the targets of import_stack) to where they're written. Stacks are
+indexed as written, without merging their imports, so each location is the declaration
+to edit. A single stack can be re-indexed after it's been edited. Queries are
+case-insensitive substring matches over the distinct terms, then a lookup of their
+locations. This module does not depend on Qt.
+"""
+
+from typing import Dict, Iterator, Mapping, NamedTuple
+
+from . import keyvalues
+
+
+class Kind:
+    Operator = 'operator'
+    Value = 'value'
+    Reference = 'reference'
+    Node = 'node'
+    Stack = 'stack'
+
+
+KINDS = (Kind.Operator, Kind.Value, Kind.Reference, Kind.Node, Kind.Stack)
+
+
+class Location(NamedTuple):
+    """Where a term is written"""
+    section: str
+    stack: str
+    node: str | None = None
+    key: str | None = None
+
+    def location(self) -> str:
+        """section/stack/node.key, leaving out whatever is unknown"""
+        where = '/'.join(x for x in (self.section, self.stack, self.node) if x)
+        return f'{where}.{self.key}' if self.key else where
+
+
+class Match(NamedTuple):
+    kind: str
+    term: str
+    location: Location
+
+
+def _terms(section: str, name: str, stack: Mapping) -> Iterator[tuple[str, str, Location]]:
+    """(kind, term, location) of everything in a stack worth finding"""
+    yield Kind.Stack, name, Location(section, name)
+    for node, block in keyvalues.pairs(stack):
+        if isinstance(block, str):
+            if node == 'import_stack':
+                yield Kind.Stack, block, Location(section, name, key=node)
+            continue
+        yield Kind.Node, node, Location(section, name, node)
+        for key, value in keyvalues.pairs(block):
+            if not isinstance(value, str):
+                continue
+            where = Location(section, name, node, key)
+            if key == 'operator':
+                yield Kind.Operator, value, where
+            elif value.startswith('@'):
+                yield Kind.Reference, value[1:], where
+            else:
+                yield Kind.Value, value, where
+
+
+class SearchIndex:
+    """
+    Inverted index of the stacks of a file. Build it with index() or index_file(),
+    keep it current with update_stack() and remove_stack()
+    """
+
+    def __init__(self):
+        # (kind, term) -> locations, in the order they were indexed
+        self._postings: Dict[tuple[str, str], Dict[Location, None]] = {}
+        # kind -> term -> lowercase term, for matching
+        self._terms: Dict[str, Dict[str, str]] = {kind: {} for kind in KINDS}
+        # (section, stack) -> the postings it contributed, to remove them again
+        self._stacks: Dict[tuple[str, str], list[tuple[tuple[str, str], Location]]] = {}
+
+    def __len__(self) -> int:
+        """Number of distinct terms"""
+        return len(self._postings)
+
+    def stacks(self) -> int:
+        """Number of indexed stacks"""
+        return len(self._stacks)
+
+    def add_stack(self, section: str, name: str, stack: Mapping) -> None:
+        """Index a stack. Repeated declarations of a stack add to the same entry"""
+        added = self._stacks.setdefault((section, name), [])
+        for kind, term, where in _terms(section, name, stack):
+            key = (kind, term)
+            postings = self._postings.get(key)
+            if postings is None:
+                postings = self._postings[key] = {}
+                self._terms[kind][term] = term.lower()
+            postings[where] = None
+            added.append((key, where))
+
+    def remove_stack(self, section: str, name: str) -> None:
+        """Drop everything indexed for a stack"""
+        for key, where in self._stacks.pop((section, name), ()):
+            postings = self._postings.get(key)
+            if postings is None or where not in postings:
+                continue
+            del postings[where]
+            if not postings:
+                del self._postings[key]
+                del self._terms[key[0]][key[1]]
+
+    def update_stack(self, section: str, name: str, stack: Mapping) -> None:
+        """Re-index a stack after it has been edited"""
+        self.remove_stack(section, name)
+        self.add_stack(section, name, stack)
+
+    def find(self, kind: str, term: str) -> list[Location]:
+        """Locations of an exact term"""
+        return list(self._postings.get((kind, term), ()))
+
+    def search(self, text: str, kind: str | None = None, limit: int | None = None) -> list[Match]:
+        """
+        Find the terms containing some text, ignoring case
+
+        Parameters
+        ----------
+        text : str
+            Text to search for
+        kind : str | None
+            Only search terms of this Kind, defaults to all of them
+        limit : int | None
+            Maximum number of matches to return
+
+        Returns
+        -------
+        list[Match] :
+            Exact matches first, then terms starting with the text, then the rest.
+            Locations of a term are in file order
+        """
+        query = text.strip().lower()
+        if not query:
+            return []
+        terms = [
+            (lower != query, not lower.startswith(query), lower, k, term)
+            for k in ((kind,) if kind else KINDS)
+            for term, lower in self._terms[k].items() if query in lower
+        ]
+        terms.sort()
+
+        out: list[Match] = []
+        for *_, k, term in terms:
+            for where in self._postings[(k, term)]:
+                if limit is not None and len(out) >= limit:
+                    return out
+                out.append(Match(k, term, where))
+        return out
+
+
+def index(data: Mapping) -> SearchIndex:
+    """Index every stack of a parsed (or lazily loaded) stack file"""
+    idx = SearchIndex()
+    for section, stacks in keyvalues.pairs(data):
+        if isinstance(stacks, str):
+            continue
+        for name, stack in keyvalues.pairs(stacks):
+            if not isinstance(stack, str):
+                idx.add_stack(section, name, stack)
+    return idx
+
+
+def index_file(file: str) -> SearchIndex:
+    """Parse and index a stack file"""
+    with open(file, 'rb') as fp:
+        data = keyvalues.load(fp)
+    return index(data)
@@ -2,26 +2,39 @@
 
 import os
 import signal
-import vdf
 import sys
 
-from typing import Tuple
+from typing import Iterable, Tuple
 from vdf import VDFDict
 from PySide6 import QtCore, QtWidgets
 from PySide6.QtWidgets import (
     QApplication, QWidget, QMainWindow,
     QFileDialog, QTreeWidget, QTreeWidgetItem,
     QDockWidget, QMessageBox, QTabWidget,
-    QHBoxLayout
+    QHBoxLayout, QVBoxLayout, QProgressBar, QToolButton,
+    QLineEdit, QComboBox
 )
-from PySide6.QtCore import Qt, QSettings
+from PySide6.QtCore import Qt, QSettings, QThreadPool
+from PySide6.QtGui import QKeySequence
 from NodeGraphQt import (
     NodesPaletteWidget
 )
 
-from .graph import SoundOperatorGraph
-from .types import StackType
-from . import manifest
+from .graph import SoundOperatorGraph, GraphState
+from .loader import StackLoader, LoadResult, ValidateTask, IndexTask
+from .imports import ImportResolver
+from .model import OperatorStackFile
+from .layout import LayoutCache, stack_hash
+from .stackfile import StackFile
+from .types import StackType, STACK_SECTIONS, STACK_TYPES
+from .changes import ChangeSet
+from .validator import Problem, Severity
+from .search import SearchIndex, Match, KINDS
+from . import manifest, keyvalues
+
+
+# Most search results shown at once
+SEARCH_LIMIT = 1000
 
 
 class SoundEdit(QMainWindow):
@@ -31,23 +44,176 @@ class SoundEdit(QMainWindow):
     """
     def __init__(self):
         super().__init__()
-        self.data: VDFDict = {}
-        self.graphs = {}
+        self.data: VDFDict | StackFile = {}
+        # Models of the open file's stacks, and their import_stack resolvers
+        self.stacks = OperatorStackFile(self.data)
+        # Loaded graphs, least recently used first
+        self.graphs: dict[str, SoundOperatorGraph] = {}
+        # Stack name -> (type, tab) of every open tab, its graph may be unloaded
+        self.openTabs: dict[str, tuple[StackType, QWidget]] = {}
+        # Edited state of graphs which were unloaded with unsaved changes
+        self.unloaded: dict[str, GraphState] = {}
+        s = QSettings()
+        # Beyond either limit, the least recently used hidden graphs are unloaded
+        self.maxGraphs = int(s.value('MaxLoadedGraphs', 10))
+        self.maxNodes = int(s.value('MaxLoadedNodes', 2000))
         self.file = None
+        # Node positions of the open file's stacks
+        self.layouts: LayoutCache | None = None
         self.dirty = None
+        # (type, stack name) -> item in the stack list
+        self.stackItems: dict[tuple[int, str], QTreeWidgetItem] = {}
+        self._loader: StackLoader | None = None
+        self._validateTask: ValidateTask | None = None
+        # Index of the open file for the search panel, None until built
+        self.search: SearchIndex | None = None
+        self._indexTask: IndexTask | None = None
         self._setup_ui()
 
-    def load_operator_stack(self, file: str) -> Tuple[bool,str]:
+    def load_operator_stack(self, file: str, lazy: bool = True) -> Tuple[bool,str]:
         """
         Load a sound operator stack
+
+        Parameters
+        ----------
+        file : str
+            Path to the stack file
+        lazy : bool
+            Only scan the file structure up front, and parse each stack when it's opened
         """
         try:
-            with open(file, 'r') as fp:
-                return (self._load_operator_stack(vdf.load(fp, mapper=VDFDict)), '')
+            if lazy:
+                return (self._load_operator_stack(StackFile(file)), '')
+            with open(file, 'rb') as fp:
+                return (self._load_operator_stack(keyvalues.load(fp)), '')
         except Exception as e:
             return (False, str(e))
 
 
+    def save(self) -> Tuple[bool, str]:
+        """
+        Save the modified stacks to the open file
+        Only the modified stacks are written, the rest of the file is kept byte-for-byte
+        """
+        if self.file is None:
+            return (False, 'No file is open')
+        modified = self.modified_stacks()
+        if not modified:
+            return (True, '')
+
+        try:
+            data = self.data
+            if not isinstance(data, StackFile) or data.closed:
+                data = StackFile(self.file)
+            files = self.stacks if data is self.data else OperatorStackFile(data)
+            stacks = {}
+            for changes in modified:
+                graph = self.graphs.get(changes.stack)
+                model = graph.model if graph is not None else self.unloaded[changes.stack].model
+                stacks[(changes.section, changes.stack)] = model.to_dict(
+                    data[changes.section][changes.stack], files.resolver(changes.section)
+                )
+            data.save(stacks)
+        except Exception as e:
+            return (False, str(e))
+
+        if data is not self.data:
+            self._load_operator_stack(data)
+        else:
+            for changes in modified:
+                self.stacks.invalidate(changes.section, changes.stack)
+        layouts = self._layout_cache()
+        for changes in modified:
+            layout_hash = stack_hash(self._resolver(changes.section).merged(changes.stack))
+            graph = self.graphs.get(changes.stack)
+            if graph is None:
+                # Reloaded from the file when next shown
+                state = self.unloaded.pop(changes.stack)
+                layouts.put(changes.section, changes.stack, layout_hash, state.positions)
+                self._on_graph_changed(STACK_TYPES[changes.section], changes.stack)
+                continue
+            graph.mark_dirty(False)
+            graph.layout_hash = layout_hash
+            graph.remember_layout(layouts)
+        layouts.flush()
+        self.mark_dirty(False)
+        self.statusBar().showMessage(f'Saved {len(modified)} modified stacks to {self.file}', 5000)
+        self.validate()
+        return (True, '')
+
+    def validate(self) -> None:
+        """
+        Validate the open file on the thread pool, the problems panel is filled in once done.
+        The file on disk is validated, so unsaved changes aren't included
+        """
+        if self.file is None:
+            return
+        task = ValidateTask(self.file)
+        task.signals.finished.connect(lambda file, problems: self._on_validate_finished(task, problems))
+        task.signals.failed.connect(lambda file, err: self._on_validate_failed(task, err))
+        self._validateTask = task
+        QThreadPool.globalInstance().start(task)
+
+    def index(self) -> None:
+        """
+        Build the search index of the open file on the thread pool. The file on disk is indexed,
+        stacks with unsaved changes are updated from their graphs once done
+        """
+        if self.file is None:
+            return
+        task = IndexTask(self.file)
+        task.signals.finished.connect(lambda file, idx: self._on_index_finished(task, idx))
+        task.signals.failed.connect(lambda file, err: self._on_index_failed(task, err))
+        self._indexTask = task
+        self._run_search()
+        QThreadPool.globalInstance().start(task)
+
+    def _on_index_finished(self, task: IndexTask, idx: SearchIndex) -> None:
+        if task is not self._indexTask:
+            return
+        self._indexTask = None
+        self.search = idx
+        for graph in self.graphs.values():
+            if graph.dirty():
+                self._update_index(graph)
+        self._run_search()
+
+    def _on_index_failed(self, task: IndexTask, err: str) -> None:
+        if task is self._indexTask:
+            self._indexTask = None
+            self.statusBar().showMessage(f'Could not index {task.file}: {err}', 5000)
+
+    def _update_index(self, graph: SoundOperatorGraph) -> None:
+        """Re-index the stack of a graph from its current contents"""
+        section, name = graph.changes.section, graph.changes.stack
+        stacks = self.data.get(section)
+        if self.search is None or stacks is None or name not in stacks:
+            return
+        self.search.update_stack(section, name, graph.to_dict(stacks[name], self._resolver(section)))
+
+    def _on_validate_finished(self, task: ValidateTask, problems: list[Problem]) -> None:
+        if task is not self._validateTask:
+            return
+        self._validateTask = None
+
+        items = []
+        for p in problems:
+            item = QTreeWidgetItem([p.severity, p.location(), p.message])
+            item.setData(0, Qt.ItemDataRole.UserRole, p)
+            items.append(item)
+        self.problemList.clear()
+        self.problemList.addTopLevelItems(items)
+
+        errors = sum(1 for p in problems if p.severity == Severity.Error)
+        self.problemsDock.setWindowTitle(
+            f'Problems ({errors} errors, {len(problems) - errors} warnings)' if problems else 'Problems'
+        )
+
+    def _on_validate_failed(self, task: ValidateTask, err: str) -> None:
+        if task is self._validateTask:
+            self._validateTask = None
+            self.statusBar().showMessage(f'Could not validate {task.file}: {err}', 5000)
+
     def _update_window_title(self) -> None:
         """
         Updates the window title reflecting currently open file and "dirty" status
@@ -55,7 +221,7 @@ class SoundEdit(QMainWindow):
         if self.file is None:
             self.setWindowTitle('Source Sound Editor - No File')
         else:
-            self.setWindowTitle(f'Source Sound Editor - [{self.file}{"*" if self.dirty else ""}]')
+            self.setWindowTitle(f'Source Sound Editor - [{self.file}{"*" if self.is_dirty() else ""}]')
 
     def mark_dirty(self, dirty: bool) -> None:
         """
@@ -64,6 +230,40 @@ class SoundEdit(QMainWindow):
         self.dirty = dirty
         self._update_window_title()
 
+    def is_dirty(self) -> bool:
+        """Returns True if the document has been marked dirty, or any stack has changes"""
+        return bool(self.dirty) or bool(self.unloaded) or any(g.dirty() for g in self.graphs.values())
+
+    def modified_stacks(self) -> list[ChangeSet]:
+        """Returns the change sets of all stacks with unsaved changes, loaded or not"""
+        return [g.changes for g in self.graphs.values() if g.dirty()] + [s.changes for s in self.unloaded.values()]
+
+    def _on_graph_changed(self, type: StackType, name: str) -> None:
+        """
+        Called once per event loop iteration when a graph has changed.
+        Marks the stack in the tab bar and stack list, and updates the window title
+        """
+        graph = self.graphs.get(name)
+        dirty = graph.dirty() if graph is not None else name in self.unloaded
+        label = f'{name}*' if dirty else name
+        if dirty and graph is not None and self.search is not None:
+            self._update_index(graph)
+            self._run_search()
+
+        if name in self.openTabs:
+            i = self.tabs.indexOf(self.openTabs[name][1])
+            if i >= 0:
+                self.tabs.setTabText(i, label)
+
+        item = self.stackItems.get((type, name))
+        if item is not None:
+            item.setText(0, label)
+            font = item.font(0)
+            font.setItalic(dirty)
+            item.setFont(0, font)
+
+        self._update_window_title()
+
     def open_tab(self, type: StackType, name: str) -> bool:
         """
         Load the specified stack in a new tab
@@ -75,67 +275,201 @@ class SoundEdit(QMainWindow):
         name : str
             Name of the tab
         """
-        if name in self.graphs:
-            self.graphs[name].widget.raise_()
-            return True
-        graph = SoundOperatorGraph(self)
-        stacks = self.data['start_stacks' if type == StackType.Start else 'update_stacks']
-        graph.from_dict(stacks[name], stacks)
+        if name in self.openTabs:
+            w = self.openTabs[name][1]
+        else:
+            w = QWidget(self)
+            w.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+            w.setLayout(QHBoxLayout())
+            self.openTabs[name] = (type, w)
+            self.tabs.addTab(w, f'{name}*' if name in self.unloaded else name)
+
+        if name not in self.graphs:
+            try:
+                self._load_graph(type, name, w)
+            except Exception:
+                if w.layout().count() == 0:
+                    self._close_tab(self.tabs.indexOf(w))
+                raise
+        else:
+            self._touch(name)
+        self.graphs[name].widget.raise_()
+        return True
 
-        w = QWidget(self)
-        w.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
-        w.setLayout(QHBoxLayout())
-        w.layout().addWidget(graph.widget)
+    def _load_graph(self, type: StackType, name: str, tab: QWidget) -> None:
+        """Build the graph of an open tab, from its unsaved state if it has one"""
+        section = STACK_SECTIONS[type]
+        graph = SoundOperatorGraph(self, section, name)
+        try:
+            state = self.unloaded.get(name)
+            if state is not None:
+                graph.restore(state)
+            else:
+                graph.from_dict(self.data[section][name], self._resolver(section), self._layout_cache())
+        except Exception:
+            graph.close()
+            raise
+        self.unloaded.pop(name, None)
+        tab.layout().addWidget(graph.widget)
+        graph.dirty_changed.connect(lambda dirty: self._on_graph_changed(type, name))
+        self.graphs[name] = graph
+        self._evict(name)
 
-        graph.dirty_changed.connect(lambda dirty: self.mark_dirty(dirty))
+    def _unload_graph(self, name: str) -> None:
+        """Tear down a graph, keeping its state if it has unsaved changes"""
+        graph = self.graphs.pop(name)
+        if graph.dirty():
+            self.unloaded[name] = graph.state()
+        else:
+            layouts = self._layout_cache()
+            if layouts is not None:
+                graph.remember_layout(layouts)
+        graph.close()
+
+    def _touch(self, name: str) -> None:
+        """Mark a graph as the most recently used"""
+        self.graphs[name] = self.graphs.pop(name)
+
+    def _evict(self, keep: str | None = None) -> None:
+        """Unload the least recently used hidden graphs, while over maxGraphs or maxNodes"""
+        current = self.tabs.currentWidget()
+        nodes = sum(len(g.nodes) for g in self.graphs.values())
+        for name in list(self.graphs):
+            if len(self.graphs) <= self.maxGraphs and nodes <= self.maxNodes:
+                break
+            if name == keep or self.openTabs[name][1] is current:
+                continue
+            nodes -= len(self.graphs[name].nodes)
+            self._unload_graph(name)
+        if self.layouts is not None:
+            self.layouts.flush()
+
+    def _on_tab_changed(self, tab: int) -> None:
+        """Load the graph of the shown tab, if it was unloaded"""
+        w = self.tabs.widget(tab)
+        name = next((n for n, (_, t) in self.openTabs.items() if t is w), None)
+        if name is None:
+            return
+        if name in self.graphs:
+            self._touch(name)
+            return
+        try:
+            self._load_graph(self.openTabs[name][0], name, w)
+        except Exception as e:
+            self.statusBar().showMessage(f'Could not open {name}: {e}', 5000)
 
-        self.tabs.addTab(w, name)
-        
-        self.graphs[name] = graph
-        graph.widget.raise_()
-        return True
+    def cache_stats(self) -> dict[str, int]:
+        """Numbers of open tabs, loaded graphs, their nodes, and unloaded graphs with unsaved changes"""
+        return {
+            'tabs': len(self.openTabs),
+            'loaded': len(self.graphs),
+            'nodes': sum(len(g.nodes) for g in self.graphs.values()),
+            'unsaved_unloaded': len(self.unloaded),
+        }
 
     
-    def _load_operator_stack(self, data: VDFDict) -> bool:
+    def _resolver(self, section: str) -> ImportResolver:
+        """The import_stack resolver of a section of the open file, built when first needed"""
+        return self.stacks.resolver(section)
+
+    def _layout_cache(self) -> LayoutCache | None:
+        """The node position cache of the open file, None if no file is open"""
+        if self.file is None:
+            return None
+        if self.layouts is None or self.layouts.stack_file != self.file:
+            self.layouts = LayoutCache(self.file)
+        return self.layouts
+
+    def _remember_layouts(self, graphs: Iterable[SoundOperatorGraph]) -> None:
+        """Store the node positions of the graphs in the sidecar file"""
+        layouts = self._layout_cache()
+        if layouts is None:
+            return
+        for graph in graphs:
+            graph.remember_layout(layouts)
+        layouts.flush()
+
+    def _load_operator_stack(self, data: VDFDict | StackFile) -> bool:
+        self._remember_layouts(self.graphs.values())
+        if isinstance(self.data, StackFile):
+            self.data.close()
         self.data = data
+        self.stacks = OperatorStackFile(data)
+        self.search = None
+        self._indexTask = None
         self._populate_list()
+        self._run_search()
         return True
 
 
     def _populate_list(self):
         """Populate the left bar list of operator stacks"""
+        self.stackListStartStacks.takeChildren()
+        self.stackListUpdateStacks.takeChildren()
+        self.stackItems = {}
         if 'start_stacks' in self.data:
             for stackName in self.data['start_stacks'].keys():
-                stack = self.data['start_stacks'][stackName]
                 item = QTreeWidgetItem(self.stackListStartStacks)
                 item.setText(0, stackName)
                 item.setData(0, Qt.ItemDataRole.UserRole, (StackType.Start, stackName))
+                self.stackItems[(StackType.Start, stackName)] = item
         if 'update_stacks' in self.data:
             for stackName in self.data['update_stacks'].keys():
-                stack = self.data['update_stacks'][stackName]
                 item = QTreeWidgetItem(self.stackListUpdateStacks)
                 item.setText(0, stackName)
                 item.setData(0, Qt.ItemDataRole.UserRole, (StackType.Update, stackName))
+                self.stackItems[(StackType.Update, stackName)] = item
 
     def _setup_ui(self):
         """Setup the UI"""
         self._setup_menu()
         self._setup_stack_list()
+        self._setup_problem_list()
+        self._setup_search()
         self._setup_tabs()
+        self._setup_status_bar()
         self._update_window_title()
 
     def _setup_tabs(self):
         self.tabs = QTabWidget(self)
         self.tabs.setTabsClosable(True)
         self.tabs.tabCloseRequested.connect(self._close_tab)
+        self.tabs.currentChanged.connect(self._on_tab_changed)
         self.setCentralWidget(self.tabs)
         
         gettingStarted = QWidget(self)
         self.tabs.addTab(gettingStarted, 'Getting Started')
 
+    def _setup_status_bar(self):
+        self.loadProgress = QProgressBar(self)
+        self.loadProgress.setRange(0, 100)
+        self.loadProgress.setMaximumWidth(200)
+        self.loadCancel = QToolButton(self)
+        self.loadCancel.setText('Cancel')
+        self.loadCancel.clicked.connect(self._cancel_load)
+        self.statusBar().addPermanentWidget(self.loadProgress)
+        self.statusBar().addPermanentWidget(self.loadCancel)
+        self._show_load_progress(False)
+
+    def _show_load_progress(self, show: bool):
+        """Show or hide the status bar load progress indicator"""
+        self.loadProgress.setValue(0)
+        self.loadProgress.setVisible(show)
+        self.loadCancel.setVisible(show)
+
     def _close_tab(self, tab: int):
-        """Close a tab and remove the widget"""
+        """
+        Close a tab and remove the widget. Its graph is unloaded, unsaved changes are
+        kept until the file is saved
+        """
         w = self.tabs.widget(tab)
+        name = next((n for n, (_, t) in self.openTabs.items() if t is w), None)
+        if name is not None:
+            del self.openTabs[name]
+            if name in self.graphs:
+                self._unload_graph(name)
+            if self.layouts is not None:
+                self.layouts.flush()
         self.tabs.removeTab(tab)
         w.close()
 
@@ -151,9 +485,77 @@ class SoundEdit(QMainWindow):
         self.stackListStartStacks.setExpanded(True)
         self.stackListUpdateStacks.setExpanded(True)
 
-        dock = QDockWidget('Operator Stacks', self)
-        dock.setWidget(self.stackList)
-        self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, dock)
+        self.stacksDock = QDockWidget('Operator Stacks', self)
+        self.stacksDock.setWidget(self.stackList)
+        self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, self.stacksDock)
+
+    def _setup_problem_list(self):
+        self.problemList = QTreeWidget(self)
+        self.problemList.setHeaderLabels(['Severity', 'Location', 'Message'])
+        self.problemList.setRootIsDecorated(False)
+        self.problemList.setUniformRowHeights(True)
+        self.problemList.itemDoubleClicked.connect(self._on_problem_open)
+
+        self.problemsDock = QDockWidget('Problems', self)
+        self.problemsDock.setWidget(self.problemList)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.problemsDock)
+
+    def _setup_search(self):
+        self.searchEdit = QLineEdit(self)
+        self.searchEdit.setPlaceholderText('Operator, value, node or stack')
+        self.searchEdit.setClearButtonEnabled(True)
+        self.searchEdit.textChanged.connect(self._run_search)
+        self.searchKind = QComboBox(self)
+        self.searchKind.addItem('All', None)
+        for kind in KINDS:
+            self.searchKind.addItem(kind.capitalize(), kind)
+        self.searchKind.currentIndexChanged.connect(self._run_search)
+
+        self.searchList = QTreeWidget(self)
+        self.searchList.setHeaderLabels(['Location', 'Match'])
+        self.searchList.setRootIsDecorated(False)
+        self.searchList.setUniformRowHeights(True)
+        self.searchList.itemDoubleClicked.connect(self._on_search_open)
+
+        row = QHBoxLayout()
+        row.addWidget(self.searchEdit)
+        row.addWidget(self.searchKind)
+        w = QWidget(self)
+        w.setLayout(QVBoxLayout())
+        w.layout().setContentsMargins(0, 0, 0, 0)
+        w.layout().addLayout(row)
+        w.layout().addWidget(self.searchList)
+
+        self.searchDock = QDockWidget('Search', self)
+        self.searchDock.setWidget(w)
+        self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, self.searchDock)
+        self.tabifyDockWidget(self.stacksDock, self.searchDock)
+        self.stacksDock.raise_()
+
+    def _run_search(self) -> None:
+        """Fill the search panel with the matches of the current query"""
+        text = self.searchEdit.text()
+        if self.search is None or not text.strip():
+            self.searchList.clear()
+            self.searchDock.setWindowTitle('Search (indexing...)' if self._indexTask is not None else 'Search')
+            return
+        matches = self.search.search(text, self.searchKind.currentData(), SEARCH_LIMIT + 1)
+        items = []
+        for m in matches[:SEARCH_LIMIT]:
+            item = QTreeWidgetItem([m.location.location(), f'{m.kind}: {m.term}'])
+            item.setData(0, Qt.ItemDataRole.UserRole, m)
+            items.append(item)
+        self.searchList.clear()
+        self.searchList.addTopLevelItems(items)
+        self.searchDock.setWindowTitle(
+            f'Search (first {SEARCH_LIMIT} results)' if len(matches) > SEARCH_LIMIT else f'Search ({len(matches)} results)'
+        )
+
+    def _on_find(self, checked: bool) -> None:
+        self.searchDock.show()
+        self.searchDock.raise_()
+        self.searchEdit.setFocus()
+        self.searchEdit.selectAll()
 
     def _update_recents_menu(self):
         """Update entries on the recent files menu"""
@@ -178,11 +580,19 @@ class SoundEdit(QMainWindow):
         """
         self.fileMenu = self.menuBar().addMenu('File')
         self.fileMenu.addAction('Open').triggered.connect(self._on_open)
+        save = self.fileMenu.addAction('Save')
+        save.setShortcut(QKeySequence.StandardKey.Save)
+        save.triggered.connect(self._on_save)
         self.recents_menu = self.fileMenu.addMenu('Recent Files')
         self._update_recents_menu()
         self.fileMenu.addSeparator()
         self.fileMenu.addAction('Exit').triggered.connect(self._on_exit)
 
+        self.editMenu = self.menuBar().addMenu('Edit')
+        find = self.editMenu.addAction('Find in Stacks')
+        find.setShortcut(QKeySequence('Ctrl+Shift+F'))
+        find.triggered.connect(self._on_find)
+
         self.helpMenu = self.menuBar().addMenu('Help')
         self.helpMenu.addAction('About')
         self.helpMenu.addAction('About Qt').triggered.connect(QApplication.aboutQt)
@@ -196,6 +606,34 @@ class SoundEdit(QMainWindow):
         except Exception as e:
             raise e
 
+    def _on_problem_open(self, item: QTreeWidgetItem, col: int):
+        """Open the stack of a problem and select its node"""
+        p: Problem = item.data(0, Qt.ItemDataRole.UserRole)
+        self._show_node(p.section, p.stack, p.node)
+
+    def _on_search_open(self, item: QTreeWidgetItem, col: int):
+        """Open the stack of a search result and select its node"""
+        m: Match = item.data(0, Qt.ItemDataRole.UserRole)
+        self._show_node(m.location.section, m.location.stack, m.location.node)
+
+    def _show_node(self, section: str | None, stack: str | None, node: str | None) -> None:
+        """Open a stack in its tab and select one of its nodes"""
+        type = next((t for t, s in STACK_SECTIONS.items() if s == section), None)
+        if type is None or stack is None or stack not in self.data[section]:
+            return
+        try:
+            self.open_tab(type, stack)
+        except Exception as e:
+            self.statusBar().showMessage(f'Could not open {stack}: {e}', 5000)
+            return
+        graph = self.graphs[stack]
+        self.tabs.setCurrentWidget(graph.widget.parentWidget())
+        node = graph.nodes.get(node)
+        if node is not None:
+            graph.graph.clear_selection()
+            node.set_selected(True)
+            graph.graph.fit_to_selection()
+
     def _ask_save(self) -> bool:
         """
         Pops up an "ask save" dialog and returns if the caller should continue with their logic
@@ -205,13 +643,16 @@ class SoundEdit(QMainWindow):
         bool :
             True if the user saved/discarded their changes, or if the file isn't dirty, and you may continue
         """
-        if not self.dirty:
+        if not self.is_dirty():
             return True
 
-        return QMessageBox.question(
+        result = QMessageBox.question(
             self, 'Save Changes?', 'You have unsaved changes, would you like to save?',
             QMessageBox.StandardButton.Save | QMessageBox.StandardButton.Discard | QMessageBox.StandardButton.Cancel
-        ) != QMessageBox.StandardButton.Cancel
+        )
+        if result == QMessageBox.StandardButton.Save:
+            return self._on_save(False)
+        return result != QMessageBox.StandardButton.Cancel
 
     def _add_recent_file(self, file: str):
         """Add an entry to the recent files list"""
@@ -228,7 +669,7 @@ class SoundEdit(QMainWindow):
         s = QSettings()
         l = s.value('RecentFiles', ['', ''])
         if isinstance(l, list):
-            l.remove(file)
+            while file in l: l.remove(file)
         else:
             l = ['', '']
         s.setValue('RecentFiles', l)
@@ -236,34 +677,82 @@ class SoundEdit(QMainWindow):
     def _open_file(self, file: str) -> bool:
         """
         Open a specific file
+        The file is loaded on a worker thread, see _on_load_finished and _on_load_failed.
         On success, adds the file to the 'recent files' list, updates the window title.
         Shows a message box on failure, and removes the entry from the recent files list.
 
         Returns
         -------
         bool :
-            True on success
+            True if the load was started
         """
 
         if not self._ask_save():
             return False
 
-        self.file = None
+        self._cancel_load()
 
-        success, err = self.load_operator_stack(file)
-        if not success:
-            self._remove_recent_file(file)
-            QMessageBox.warning(
-                self, 'Could not load file',
-                f'Could not load operator stacks: {err}'
-            )
-            return False
+        loader = StackLoader(file)
+        loader.signals.progress.connect(self.loadProgress.setValue)
+        loader.signals.finished.connect(lambda result: self._on_load_finished(loader, result))
+        loader.signals.failed.connect(lambda err: self._on_load_failed(loader, err))
+        loader.signals.cancelled.connect(lambda: self._on_load_cancelled(loader))
+        self._loader = loader
+
+        self._show_load_progress(True)
+        self.statusBar().showMessage(f'Loading {file}...')
+        QThreadPool.globalInstance().start(loader)
+        return True
+
+    def _cancel_load(self):
+        """Cancel the in-progress file load, if any"""
+        if self._loader is not None:
+            self._loader.cancel()
+            self._loader = None
+            self._show_load_progress(False)
+            self.statusBar().showMessage('Load cancelled', 5000)
+
+    def _on_load_finished(self, loader: StackLoader, result: LoadResult):
+        """Called on the GUI thread once a file has been loaded"""
+        if loader is not self._loader:
+            # Superseded or cancelled after the worker finished
+            if isinstance(result.data, StackFile):
+                result.data.close()
+            return
+        self._loader = None
+        self._show_load_progress(False)
 
-        self.file = file
-        self._add_recent_file(file)
+        self._load_operator_stack(result.data)
+        self.statusBar().showMessage(
+            f'Loaded {result.file}' + (f' ({len(result.warnings)} warnings)' if result.warnings else ''),
+            5000
+        )
+
+        self.file = result.file
+        self._add_recent_file(result.file)
         self._update_window_title()
         self._update_recents_menu()
-        return True
+        self.validate()
+        self.index()
+
+    def _on_load_failed(self, loader: StackLoader, err: str):
+        """Called on the GUI thread when a file could not be loaded"""
+        if loader is not self._loader:
+            return
+        self._loader = None
+        self._show_load_progress(False)
+        self.statusBar().clearMessage()
+
+        self._remove_recent_file(loader.file)
+        QMessageBox.warning(
+            self, 'Could not load file',
+            f'Could not load operator stacks: {err}'
+        )
+
+    def _on_load_cancelled(self, loader: StackLoader):
+        if loader is self._loader:
+            self._loader = None
+            self._show_load_progress(False)
 
     def _on_open(self, checked: bool):
         """Called when we want to open a file"""
@@ -281,7 +770,15 @@ class SoundEdit(QMainWindow):
 
         self._open_file(fileName)
 
+    def _on_save(self, checked: bool) -> bool:
+        """Called when we want to save the file, shows a message box on failure"""
+        ok, err = self.save()
+        if not ok:
+            QMessageBox.warning(self, 'Could not save file', f'Could not save operator stacks: {err}')
+        return ok
+
     def _on_exit(self, checked: bool):
         """Called when we want to exit"""
         if self._ask_save():
+            self._remember_layouts(self.graphs.values())
             QApplication.exit(0)
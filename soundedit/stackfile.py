@@ -0,0 +1,289 @@
+"""
+Lazily loaded sound operator stack files
+
+The file is memory-mapped and scanned once to find the byte range of every stack
+under each section (start_stacks, update_stacks). Stacks are only parsed when first
+accessed. This module does not depend on Qt.
+"""
+
+import bisect
+import mmap
+import os
+
+from typing import Iterator, Mapping
+from vdf import VDFDict
+
+from . import keyvalues
+from .keyvalues import BlockSpan, ProgressCallback
+
+
+class StackSection(Mapping):
+    """
+    A section of a stack file (i.e. start_stacks) mapping stack names to their
+    parsed VDFDict. Stacks are parsed on first access and cached
+    """
+
+    def __init__(self, file: 'StackFile', name: str):
+        self.file = file
+        self.name = name
+        self._spans: dict[str, list[BlockSpan] | str] = {}
+        self._cache: dict[str, VDFDict] = {}
+
+    def _add(self, key: str, value: BlockSpan | str) -> None:
+        # Duplicate stacks are merged into the first, same as keyvalues.parse.
+        # Otherwise the first declaration wins, as with VDFDict lookups
+        prev = self._spans.get(key)
+        if prev is None:
+            self._spans[key] = [value] if isinstance(value, BlockSpan) else value
+        elif isinstance(prev, list) and isinstance(value, BlockSpan):
+            prev.append(value)
+
+    def __getitem__(self, name: str) -> VDFDict | str:
+        stack = self._cache.get(name)
+        if stack is not None:
+            return stack
+
+        stack = self.parse(name)
+        if isinstance(stack, VDFDict):
+            self._cache[name] = stack
+        return stack
+
+    def parse(self, name: str) -> VDFDict | str:
+        """Parse a new copy of a stack from the file, bypassing the cache"""
+        spans = self._spans[name]
+        if isinstance(spans, str):
+            return spans
+        if self.file.closed:
+            raise ValueError(f'Cannot load stack {name}, {self.file.file} is closed')
+
+        stack = VDFDict()
+        for span in spans:
+            keyvalues.parse(
+                self.file.data, start=span.start + 1, end=span.end - 1,
+                filename=self.file.file, root=stack
+            )
+        return stack
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._spans)
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._spans
+
+    def is_loaded(self, name: str) -> bool:
+        """Returns True if the stack has already been parsed"""
+        return name in self._cache
+
+    def spans(self, name: str) -> list[BlockSpan]:
+        """
+        Returns the byte ranges of a stack within the file.
+        There's more than one if the stack is declared multiple times
+        """
+        spans = self._spans[name]
+        return spans if isinstance(spans, list) else []
+
+    def imports(self, name: str) -> list[str]:
+        """
+        Returns the names of the stacks imported by a stack (via import_stack),
+        without parsing it
+        """
+        return [v for span in self.spans(name) for k, v in span.children if k == 'import_stack']
+
+
+class StackFile(Mapping):
+    """
+    A lazily loaded operator stack file
+
+    Behaves like the VDFDict returned by keyvalues.load, but only the file structure
+    is read up front. Call close() once the file is no longer needed.
+    """
+
+    def __init__(self, file: str, progress: ProgressCallback | None = None):
+        self.file = file
+        self._open()
+        self._sections: dict[str, StackSection | str] = {}
+
+        try:
+            root = keyvalues.scan(self.data, max_depth=2, filename=file, progress=progress)
+        except Exception:
+            self.close()
+            raise
+
+        for key, value in root.children:
+            if isinstance(value, BlockSpan):
+                section = self._sections.get(key)
+                if not isinstance(section, StackSection):
+                    section = self._sections[key] = StackSection(self, key)
+                for name, child in value.children:
+                    section._add(name, child)
+            elif key not in self._sections:
+                self._sections[key] = value
+
+    def __getitem__(self, key: str) -> StackSection | str:
+        return self._sections[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._sections)
+
+    def __len__(self) -> int:
+        return len(self._sections)
+
+    def _open(self) -> None:
+        self._fp = open(self.file, 'rb')
+        st = os.fstat(self._fp.fileno())
+        self._stat = (st.st_mtime_ns, st.st_size)
+        try:
+            self.data = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped
+            self.data = b''
+
+    @property
+    def closed(self) -> bool:
+        return self._fp.closed
+
+    def save(self, stacks: Mapping[tuple[str, str], Mapping]) -> int:
+        """
+        Write modified stacks back to the file
+
+        Each stack replaces its original declaration (the first one, if it's declared more than
+        once, other declarations are removed). Everything else is copied byte-for-byte, so only
+        the modified stacks are serialised. The file is written to a temporary file which is
+        then moved over the original. Afterwards the file is mapped again, and the modified
+        stacks are parsed from their new text when next accessed.
+
+        Parameters
+        ----------
+        stacks : Mapping[tuple[str, str], Mapping]
+            (section, stack name) -> new contents of the stack
+
+        Returns
+        -------
+        int :
+            Size of the new file
+        """
+        if self.closed:
+            raise ValueError(f'Cannot save, {self.file} is closed')
+        st = os.stat(self.file)
+        if (st.st_mtime_ns, st.st_size) != self._stat:
+            raise ValueError(f'Cannot save, {self.file} has been changed by another program')
+
+        # (start, end, replacement text)
+        edits: list[tuple[int, int, bytes]] = []
+        replaced: dict[int, tuple[StackSection, str]] = {}
+        for (section, name), stack in stacks.items():
+            sect = self._sections.get(section)
+            if not isinstance(sect, StackSection) or not sect.spans(name):
+                raise KeyError(f'{section}/{name} is not declared in {self.file}')
+            spans = sect.spans(name)
+            text = keyvalues.dump_pair(name, stack, level=1).encode('utf-8')
+            replaced[spans[0].key_start] = (sect, name)
+            edits.append((spans[0].key_start, spans[0].end, text))
+            edits += [(span.key_start, span.end, b'') for span in spans[1:]]
+        edits.sort()
+
+        chunks = []
+        pos = 0
+        for start, end, text in edits:
+            chunks += (self.data[pos:start], text)
+            pos = end
+        chunks.append(self.data[pos:])
+
+        tmp = f'{self.file}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'wb') as fp:
+                fp.writelines(chunks)
+            # The file can't be replaced while it's mapped on Windows
+            self.close()
+            os.replace(tmp, self.file)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            if self.closed:
+                self._open()
+
+        self._shift_spans(edits, replaced)
+        return sum(len(c) for c in chunks)
+
+    def _shift_spans(self, edits: list[tuple[int, int, bytes]],
+                     replaced: dict[int, tuple['StackSection', str]]) -> None:
+        """Move the stack spans to their place in the file after applying edits"""
+        ends = [end for _, end, _ in edits]
+        shift = [0]
+        for start, end, text in edits:
+            shift.append(shift[-1] + len(text) - (end - start))
+
+        def moved(offset: int) -> int:
+            return offset + shift[bisect.bisect_right(ends, offset)]
+
+        for sect in self._sections.values():
+            if not isinstance(sect, StackSection):
+                continue
+            for spans in sect._spans.values():
+                if not isinstance(spans, list):
+                    continue
+                for span in spans:
+                    if span.key_start in replaced:
+                        continue
+                    span.key_start = moved(span.key_start)
+                    span.start = moved(span.start)
+                    span.end = moved(span.end)
+
+        for i, (start, end, text) in enumerate(edits):
+            if start not in replaced:
+                continue
+            sect, name = replaced[start]
+            new_start = start + shift[i]
+            span = keyvalues.scan(text, max_depth=1).children[0][1]
+            span.key_start += new_start
+            span.start += new_start
+            span.end += new_start
+            sect._spans[name] = [span]
+            sect._cache.pop(name, None)
+
+    def close(self) -> None:
+        """Release the file mapping. Already parsed stacks remain usable"""
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b''
+        self._fp.close()
+
+    def __enter__(self) -> 'StackFile':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def stack_imports(stacks: Mapping, name: str) -> list[str]:
+    """
+    Returns the names of the stacks imported by a stack. Works on both lazy sections
+    and fully parsed VDFDicts, lazy sections don't need to parse the stack
+    """
+    if isinstance(stacks, StackSection):
+        return stacks.imports(name)
+    stack = stacks[name]
+    return stack.get_all_for('import_stack') if isinstance(stack, VDFDict) else []
+
+
+def missing_imports(data: Mapping) -> list[tuple[str, str, str]]:
+    """
+    Find import_stack entries that name a stack which doesn't exist in the same section
+
+    Returns
+    -------
+    list[tuple[str, str, str]] :
+        (section, stack, imported stack) for each missing import
+    """
+    missing = []
+    for section, stacks in data.items():
+        if not isinstance(stacks, Mapping):
+            continue
+        for name in stacks:
+            for imp in stack_imports(stacks, name):
+                if imp not in stacks:
+                    missing.append((section, name, imp))
+    return missing
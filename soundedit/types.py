@@ -6,6 +6,15 @@ class StackType:
     Update = 1
 
 
+# Name of the section in the stack file holding each type of stack
+STACK_SECTIONS = {
+    StackType.Start: 'start_stacks',
+    StackType.Update: 'update_stacks',
+}
+# And the reverse
+STACK_TYPES = {section: type for type, section in STACK_SECTIONS.items()}
+
+
 class NodeKeyValueType(TypedDict):
     """
     Describes a single key value for a node
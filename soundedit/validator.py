@@ -0,0 +1,263 @@
+"""
+Whole-file validation of operator stacks against the manifest
+
+Every stack in a file is checked in a single pass: unknown operators, inputs and
+keyvalues, references to missing nodes or outputs, port type mismatches, invalid
+keyvalue values, import_stack problems and cycles. Lookups go through indexes built
+once per manifest, so validation is linear in the number of nodes and connections.
+This module does not depend on Qt.
+"""
+
+from typing import Dict, Mapping, NamedTuple
+
+from . import keyvalues, manifest
+from .imports import ImportResolver
+from .keyvalues import KeyValuesSyntaxError
+from .manifest import Manifest, OperatorDesc
+
+
+class Severity:
+    Error = 'error'
+    Warning = 'warning'
+
+
+class Problem(NamedTuple):
+    """A single problem found in a stack file"""
+    severity: str
+    message: str
+    section: str | None = None
+    stack: str | None = None
+    node: str | None = None
+    key: str | None = None
+    line: int | None = None
+
+    def location(self) -> str:
+        """section/stack/node.key, leaving out whatever is unknown"""
+        where = '/'.join(x for x in (self.section, self.stack, self.node) if x)
+        return f'{where}.{self.key}' if self.key else where
+
+
+# Element types of ports which can be indexed, i.e. "input_angles[0]" or "input2[*]"
+_ELEMENT_TYPES = {'vec3': 'float', 'speakers': 'float', 'vec3x8': 'vec3'}
+
+_BOOL_VALUES = frozenset(('true', 'false', '1', '0'))
+
+
+def _split_index(key: str) -> tuple[str, str | None]:
+    """Split "name[index]" into ("name", "index")"""
+    if key.endswith(']'):
+        i = key.find('[')
+        if i > 0:
+            return key[:i], key[i + 1:-1]
+    return key, None
+
+
+def _is_float(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+class Validator:
+    """
+    Validates stack files against a manifest
+
+    Parameters
+    ----------
+    m : Manifest | None
+        The manifest, defaults to the current one
+    """
+
+    def __init__(self, m: Manifest | None = None):
+        self.manifest = m if m is not None else manifest.current()
+        self.operators: Dict[str, OperatorDesc] = self.manifest.node_types()
+
+    def validate(self, data: Mapping) -> list[Problem]:
+        """
+        Validate a parsed (or lazily loaded) stack file
+
+        Returns
+        -------
+        list[Problem] :
+            Problems in file order
+        """
+        problems: list[Problem] = []
+        for section, stacks in data.items():
+            if not isinstance(stacks, Mapping):
+                continue
+            imports = ImportResolver(stacks, section)
+            for name in stacks:
+                stack = stacks[name]
+                if isinstance(stack, Mapping):
+                    self._validate_stack(section, name, stack, imports, problems)
+        return problems
+
+    def validate_stack(self, section: str, name: str, stacks: Mapping) -> list[Problem]:
+        """Validate a single stack of a section, i.e. after it's been edited"""
+        problems: list[Problem] = []
+        self._validate_stack(section, name, stacks[name], ImportResolver(stacks, section), problems)
+        return problems
+
+    def _validate_stack(self, section: str, name: str, stack: Mapping,
+                        imports: ImportResolver, problems: list[Problem]) -> None:
+        for kind, imp in imports.problems(name):
+            message = f'imports unknown stack "{imp}"' if kind == 'missing' else f'import_stack cycle through "{imp}"'
+            problems.append(Problem(Severity.Error, message, section, name, key='import_stack'))
+
+        nodes = imports.merged(name)
+        # Values are either strings or blocks, isinstance() against str is much cheaper than Mapping
+        local = [(node, block) for node, block in keyvalues.pairs(stack) if not isinstance(block, str)]
+
+        broken = imports.is_broken(name)
+
+        def problem(severity: str, message: str, node: str | None = None, key: str | None = None):
+            problems.append(Problem(severity, message, section, name, node, key))
+
+        for node, block in local:
+            merged = nodes[node]
+            op = merged.get('operator')
+            if op is None:
+                # Otherwise it may override a node of the missing stack, which is already reported
+                if not broken:
+                    problem(Severity.Error, 'node has no operator', node)
+                continue
+            desc = self.operators.get(op)
+            if desc is None:
+                problem(Severity.Error, f'unknown operator "{op}"', node, 'operator')
+                continue
+
+            for key, value in keyvalues.pairs(block):
+                if key == 'operator':
+                    continue
+                base, index = _split_index(key)
+                port = desc.input_map.get(base)
+                if port is not None:
+                    self._check_input(problem, nodes, node, key, port.type, index, value, broken)
+                    continue
+                kv = desc.keyvalue_map.get(key)
+                if kv is None:
+                    problem(Severity.Error, f'{op} has no input or keyvalue "{key}"', node, key)
+                    continue
+                message = self._check_keyvalue(kv.type, kv.choices, key, value, nodes)
+                if message is not None:
+                    # Malformed values are still read by the game, with some fallback
+                    problem(Severity.Error if kv.type == 'enum' or key == 'iterate_operator' else Severity.Warning,
+                            message, node, key)
+
+        self._check_cycles(problem, nodes, [node for node, _ in local])
+
+    def _check_input(self, problem, nodes: Mapping, node: str, key: str,
+                     type: str, index: str | None, value: str, broken: bool) -> None:
+        if index is not None:
+            element = _ELEMENT_TYPES.get(type)
+            if element is None:
+                problem(Severity.Error, f'{type} input can\'t be indexed', node, key)
+                return
+            if index != '*' and not index.isdigit():
+                problem(Severity.Error, f'invalid index "{index}"', node, key)
+                return
+            type = element
+
+        if not value.startswith('@'):
+            if type == 'float' and not _is_float(value):
+                problem(Severity.Error, f'"{value}" is not a number', node, key)
+            return
+
+        other, _, output = value[1:].partition('.')
+        if not output:
+            problem(Severity.Error, f'malformed reference "{value}", expected @node.output', node, key)
+            return
+        target = nodes.get(other)
+        if target is None:
+            if not broken:
+                problem(Severity.Error, f'references unknown node "{other}"', node, key)
+            return
+        desc = self.operators.get(target.get('operator'))
+        if desc is None:
+            # Reported on the target node
+            return
+        out = desc.output_map.get(output)
+        if out is None:
+            problem(Severity.Error, f'{desc.name} node "{other}" has no output "{output}"', node, key)
+        elif out.type != type:
+            problem(Severity.Error, f'connects {out.type} output "{other}.{output}" to {type} input', node, key)
+
+    def _check_keyvalue(self, type: str, choices: tuple[str, ...] | None, key: str,
+                        value: str, nodes: Mapping) -> str | None:
+        """Returns an error message if the value isn't valid for the keyvalue"""
+        match type:
+            case 'enum':
+                if choices is not None and value not in choices:
+                    return f'invalid value "{value}", expected one of {", ".join(choices)}'
+            case 'bool':
+                # implicit_bool keyvalues also take a name, which implies true
+                if value.strip().lower() not in _BOOL_VALUES:
+                    return f'invalid value "{value}", expected true or false'
+            case 'float':
+                if not _is_float(value):
+                    return f'"{value}" is not a number'
+            case 'interval':
+                # A single number is a fixed value
+                parts = value.split(',')
+                if len(parts) > 2 or not all(_is_float(x) for x in parts):
+                    return f'invalid interval "{value}", expected min,max'
+            case _:
+                if key == 'iterate_operator' and value not in nodes:
+                    return f'iterates unknown node "{value}"'
+        return None
+
+    def _check_cycles(self, problem, nodes: Mapping[str, Mapping[str, str]], local: list[str]) -> None:
+        """Report each cycle in the connections once, on a node of this stack"""
+        # Iterated nodes read outputs of their iterate operator, i.e. the current index.
+        # Those are evaluated per iteration so don't count as a cycle
+        iterators = {node for node, block in nodes.items() if 'iterate_operator' in block}
+        edges: Dict[str, list[str]] = {}
+        for node, block in nodes.items():
+            deps = []
+            for value in block.values():
+                if value.startswith('@'):
+                    other = value[1:].partition('.')[0]
+                    if other in nodes and other not in iterators:
+                        deps.append(other)
+            edges[node] = deps
+
+        # Iterative DFS, colouring nodes: 1 = on the stack, 2 = done
+        state: Dict[str, int] = {}
+        local_set = set(local)
+        for start in local:
+            if start in state:
+                continue
+            path = [start]
+            iters = [iter(edges[start])]
+            state[start] = 1
+            while iters:
+                nxt = next(iters[-1], None)
+                if nxt is None:
+                    state[path.pop()] = 2
+                    iters.pop()
+                elif nxt not in state:
+                    state[nxt] = 1
+                    path.append(nxt)
+                    iters.append(iter(edges[nxt]))
+                elif state[nxt] == 1:
+                    cycle = path[path.index(nxt):]
+                    where = next((x for x in cycle if x in local_set), None)
+                    if where is not None:
+                        problem(Severity.Error, 'connections form a cycle: ' + ' -> '.join(cycle + [nxt]), where)
+
+
+def validate(data: Mapping, m: Manifest | None = None) -> list[Problem]:
+    """Validate a parsed stack file. See Validator"""
+    return Validator(m).validate(data)
+
+
+def validate_file(file: str, m: Manifest | None = None) -> list[Problem]:
+    """Parse and validate a stack file, syntax errors are returned as a problem"""
+    try:
+        with open(file, 'rb') as fp:
+            data = keyvalues.load(fp)
+    except KeyValuesSyntaxError as e:
+        return [Problem(Severity.Error, e.msg, line=e.lineno)]
+    return validate(data, m)